@@ -18,7 +18,8 @@ from fence.oidc.jwt_generator import generate_token
 from fence.oidc.client import query_client
 from fence.oidc.server import server
 from fence.rbac.client import ArboristClient
-from fence.resources.aws.boto_manager import BotoManager
+from fence.resources.aws.boto_manager import BotoManager, DEFAULT_MAX_POOLED_CLIENTS
+from fence.resources.aws.bucket_matcher import S3BucketMatcher
 from fence.resources.openid.google_oauth2 import Oauth2Client as GoogleClient
 from fence.resources.storage import StorageManager
 from fence.resources.user.user_session import UserSessionInterface
@@ -59,7 +60,19 @@ def app_config(app, settings="fence.settings", root_dir=None):
         root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
     if app.config.get("AWS_CREDENTIALS"):
         value = app.config["AWS_CREDENTIALS"].values()[0]
-        app.boto = BotoManager(value, logger=app.logger)
+        app.boto = BotoManager(
+            value,
+            logger=app.logger,
+            max_pooled_clients=app.config.get(
+                "BOTO_CLIENT_POOL_SIZE", DEFAULT_MAX_POOLED_CLIENTS
+            ),
+        )
+        app.s3_bucket_matcher = S3BucketMatcher(app.config.get("S3_BUCKETS", {}))
+        if app.config.get("ENABLE_SIGNED_URL_CACHE", False):
+            app.signed_url_cache = fence.blueprints.data.SignedUrlCache(
+                max_size=app.config.get("SIGNED_URL_CACHE_SIZE", 10000),
+                reuse_window=app.config.get("SIGNED_URL_CACHE_REUSE_WINDOW", 60),
+            )
         app.register_blueprint(fence.blueprints.data.blueprint, url_prefix="/data")
 
     app.keypairs = keys.load_keypairs(os.path.join(root_dir, "keys"))
@@ -1,4 +1,8 @@
-import re
+from collections import OrderedDict
+import csv
+import itertools
+import json
+import threading
 
 import flask
 import requests
@@ -13,16 +17,22 @@ from fence.auth import current_token
 from cdispyutils.hmac4 import generate_aws_presigned_url
 from cdispyutils.config import get_value
 
+from fence.resources.aws.bucket_matcher import S3BucketMatcher
+from fence.utils import bounded_imap
 from fence.resources.google.utils import (
     get_or_create_primary_service_account_key,
     create_primary_service_account_key,
     get_or_create_proxy_group_id,
+    url_signing_key_cache,
 )
+from fence.errors import APIError
 from fence.errors import UnavailableError
+from fence.errors import UserError
 from fence.errors import NotFound
 from fence.errors import Unauthorized
 from fence.errors import NotSupported
 from fence.errors import InternalError
+from fence.permissions import PermissionIndex, get_current_permission_index
 
 ACTION_DICT = {
     "s3": {"upload": "PUT", "download": "GET"},
@@ -32,6 +42,13 @@ ACTION_DICT = {
 SUPPORTED_PROTOCOLS = ["s3", "http", "ftp", "https", "gs"]
 SUPPORTED_ACTIONS = ["upload", "download"]
 
+# S3 numbers the parts of a multipart upload from 1 to 10000
+MAX_MULTIPART_UPLOAD_PARTS = 10000
+
+# columns of an uploaded manifest which may contain the GUIDs, in order of
+# preference; without any of them the first column is used
+MANIFEST_GUID_COLUMNS = ["guid", "object_id", "did", "id"]
+
 
 blueprint = flask.Blueprint("data", __name__)
 
@@ -57,17 +74,347 @@ def upload_file(file_id):
     return flask.jsonify(result)
 
 
-def get_signed_url_for_file(action, file_id):
+@blueprint.route("/upload/<path:file_id>/multipart", methods=["POST"])
+def initiate_multipart_upload(file_id):
+    """
+    Start a multipart upload of a file given by file_id.
+
+    The parts are then uploaded to urls from
+    ``/upload/<file_id>/multipart/parts`` (in parallel, if the client wants)
+    and assembled with ``/upload/<file_id>/multipart/complete``.
+    """
+    location = IndexedFile(file_id).get_multipart_upload_location()
+    upload_id = location.initiate_multipart_upload(get_expires_in())
+    return flask.jsonify({"guid": file_id, "uploadId": upload_id})
+
+
+@blueprint.route("/upload/<path:file_id>/multipart/parts", methods=["POST"])
+def presign_multipart_upload_parts(file_id):
+    """
+    Get presigned urls to upload a batch of parts of a multipart upload.
+
+    The body is ``{"uploadId": "...", "partNumbers": [1, 2, ...]}``.
+    """
+    body = get_multipart_upload_body()
+    part_numbers = get_part_numbers(body.get("partNumbers"))
+
+    indexed_file = IndexedFile(file_id)
+    location = indexed_file.get_multipart_upload_location()
+    urls = location.get_multipart_upload_part_urls(
+        body["uploadId"],
+        part_numbers,
+        get_expires_in(),
+        public_data=indexed_file.public,
+    )
+    return flask.jsonify(
+        {
+            "parts": [
+                {"partNumber": part_number, "url": urls[part_number]}
+                for part_number in part_numbers
+            ]
+        }
+    )
+
+
+@blueprint.route("/upload/<path:file_id>/multipart/complete", methods=["POST"])
+def complete_multipart_upload(file_id):
+    """
+    Assemble the uploaded parts of a multipart upload into the file.
+
+    The body is ``{"uploadId": "...", "parts": [{"partNumber": 1, "etag":
+    "..."}, ...]}`` with the ETag S3 returned for every uploaded part.
+    """
+    body = get_multipart_upload_body()
+    parts = body.get("parts")
+    if not isinstance(parts, list) or not all(
+        isinstance(part, dict) and part.get("etag") for part in parts
+    ):
+        raise UserError("parts must be a list of objects with partNumber and etag")
+    part_numbers = get_part_numbers([part.get("partNumber") for part in parts])
+    etags = {part["partNumber"]: part["etag"] for part in parts}
+
+    location = IndexedFile(file_id).get_multipart_upload_location()
+    location.complete_multipart_upload(
+        body["uploadId"],
+        [
+            {"PartNumber": part_number, "ETag": etags[part_number]}
+            for part_number in sorted(part_numbers)
+        ],
+        get_expires_in(),
+    )
+    return flask.jsonify({"guid": file_id, "uploadId": body["uploadId"]})
+
+
+@blueprint.route("/upload/<path:file_id>/multipart/abort", methods=["POST"])
+def abort_multipart_upload(file_id):
+    """
+    Abort a multipart upload, discarding the parts uploaded so far.
+
+    The body is ``{"uploadId": "..."}``.
+    """
+    body = get_multipart_upload_body()
+    location = IndexedFile(file_id).get_multipart_upload_location()
+    location.abort_multipart_upload(body["uploadId"], get_expires_in())
+    return flask.jsonify({"guid": file_id, "uploadId": body["uploadId"]})
+
+
+@blueprint.route("/manifest", methods=["POST"])
+@login_required({"data"})
+def sign_manifest():
+    """
+    Stream back presigned urls for every file in a manifest.
+
+    The manifest is either a JSON list of GUIDs (or ``{"guids": [...]}``) or
+    an uploaded CSV/TSV file in the form field ``file`` with a ``guid``
+    column. The query arguments ``action`` (``download`` by default),
+    ``protocol`` and ``expires_in`` apply to every file; pass
+    ``ordered=false`` to get results as soon as they are ready instead of in
+    manifest order.
+
+    The response is newline-delimited JSON with one object per GUID, either
+    ``{"guid": ..., "url": ...}`` or ``{"guid": ..., "error": ..., "status": ...}``.
+    """
+    action = flask.request.args.get("action", "download")
+    if action not in SUPPORTED_ACTIONS:
+        raise NotSupported("action {} is not supported".format(action))
     requested_protocol = flask.request.args.get("protocol", None)
+    expires_in = get_expires_in()
+    ordered = flask.request.args.get("ordered", "true").lower() != "false"
+    region = get_requested_region()
+    max_workers = flask.current_app.config.get("MANIFEST_SIGNING_WORKERS", 8)
+
+    guids = get_manifest_guids()
+
+    # authorization and the caller's signing details are resolved once here;
+    # the workers only check each file's acls against them
+    authorized_acls = get_authorized_acls(action)
+    signing_context = SigningContext.for_current_user(requested_protocol, expires_in)
+    app = flask.current_app._get_current_object()
+
+    def sign(guid):
+        with app.app_context():
+            return _sign_manifest_entry(
+                guid,
+                requested_protocol,
+                action,
+                expires_in,
+                authorized_acls,
+                signing_context,
+                region,
+            )
+
+    def generate():
+        for result in bounded_imap(sign, guids, max_workers, ordered=ordered):
+            yield json.dumps(result) + "\n"
+
+    return flask.Response(
+        flask.stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
+
+
+def _sign_manifest_entry(
+    guid, protocol, action, expires_in, authorized_acls, signing_context, region=None
+):
+    try:
+        indexed_file = IndexedFile(guid)
+        if not indexed_file.is_authorized(authorized_acls):
+            raise Unauthorized("You don't have access permission on this file")
+        url = indexed_file._get_signed_url(
+            protocol,
+            action,
+            expires_in,
+            signing_context=signing_context,
+            region=region,
+        )
+    except APIError as e:
+        return {"guid": guid, "error": e.message, "status": e.code}
+    except Exception as e:
+        flask.current_app.logger.exception(
+            "failed to sign url for {}: {}".format(guid, e)
+        )
+        return {"guid": guid, "error": "internal error", "status": 500}
+    return {"guid": guid, "url": url}
+
+
+def get_manifest_guids():
+    """
+    Return an iterator over the GUIDs in the manifest of the current request.
+
+    Uploaded files are read lazily, one row at a time.
+    """
+    manifest_file = flask.request.files.get("file")
+    if manifest_file:
+        return _iter_manifest_file_guids(manifest_file)
+
+    manifest = flask.request.get_json(silent=True)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("guids")
+    if not isinstance(manifest, list):
+        raise UserError(
+            "manifest must be a JSON list of GUIDs or an uploaded CSV/TSV file"
+        )
+    return iter(manifest)
+
+
+def _iter_manifest_file_guids(manifest_file):
+    lines = iter(manifest_file.stream)
+    first_line = next(lines, "")
+    is_tsv = "\t" in first_line or (manifest_file.filename or "").endswith(".tsv")
+    rows = csv.reader(
+        itertools.chain([first_line], lines), delimiter="\t" if is_tsv else ","
+    )
+
+    header = next(rows, [])
+    columns = [column.strip().lower() for column in header]
+    guid_column = next(
+        (columns.index(name) for name in MANIFEST_GUID_COLUMNS if name in columns),
+        None,
+    )
+    if guid_column is None:
+        # no header, so the first row is already data
+        guid_column = 0
+        rows = itertools.chain([header], rows)
+
+    for row in rows:
+        if len(row) > guid_column and row[guid_column].strip():
+            yield row[guid_column].strip()
+
+
+def get_expires_in():
+    """
+    Return the ``expires_in`` query argument, capped at
+    ``MAX_PRESIGNED_URL_TTL``.
+
+    Raises:
+        UserError: if ``expires_in`` is not an integer
+    """
     max_ttl = flask.current_app.config.get("MAX_PRESIGNED_URL_TTL", 3600)
-    expires_in = min(int(flask.request.args.get("expires_in", max_ttl)), max_ttl)
+    try:
+        expires_in = int(flask.request.args.get("expires_in", max_ttl))
+    except ValueError:
+        raise UserError("expires_in must be an integer")
+    return min(expires_in, max_ttl)
+
+
+def get_requested_region():
+    """
+    Return the region the client wants data served from: the ``region`` query
+    argument, or the deployment's ``DEFAULT_DATA_REGION``.
+    """
+    return flask.request.args.get("region") or flask.current_app.config.get(
+        "DEFAULT_DATA_REGION"
+    )
+
+
+def get_multipart_upload_body():
+    body = flask.request.get_json(silent=True)
+    if not isinstance(body, dict) or not body.get("uploadId"):
+        raise UserError("request body must be a JSON object with an uploadId")
+    return body
+
+
+def get_part_numbers(part_numbers):
+    """
+    Validate a list of part numbers of a multipart upload.
+    """
+    if (
+        not isinstance(part_numbers, list)
+        or not part_numbers
+        or not all(
+            isinstance(part_number, int)
+            and 1 <= part_number <= MAX_MULTIPART_UPLOAD_PARTS
+            for part_number in part_numbers
+        )
+    ):
+        raise UserError(
+            "part numbers must be a non-empty list of integers between 1 and "
+            "{}".format(MAX_MULTIPART_UPLOAD_PARTS)
+        )
+    if len(set(part_numbers)) != len(part_numbers):
+        raise UserError("part numbers must be unique")
+    return part_numbers
+
+
+def get_signed_url_for_file(action, file_id):
+    requested_protocol = flask.request.args.get("protocol", None)
+    expires_in = get_expires_in()
 
     indexed_file = IndexedFile(file_id)
-    signed_url = indexed_file.get_signed_url(requested_protocol, action, expires_in)
+    signed_url = indexed_file.get_signed_url(
+        requested_protocol, action, expires_in, region=get_requested_region()
+    )
 
     return {"url": signed_url}
 
 
+class SigningContext(object):
+    """
+    Details about the caller needed to sign urls, resolved once in the request
+    so that urls can be signed outside of it (e.g. on worker threads).
+
+    The caller's Google url signing key is only looked up (and created if
+    needed) when the first Google Storage url is signed.
+    """
+
+    def __init__(self, user_info, google_token=None, google_expiration_time=None):
+        self.user_info = user_info
+        self._google_token = google_token
+        self._google_expiration_time = google_expiration_time
+        self._google_private_key = None
+        self._google_key_resolved = False
+        self._google_key_lock = threading.Lock()
+
+    @property
+    def google_private_key(self):
+        """
+        The caller's Google url signing key, or None if Google Storage urls
+        can't be signed.
+        """
+        with self._google_key_lock:
+            if not self._google_key_resolved:
+                self._google_private_key = self._get_google_private_key()
+                self._google_key_resolved = True
+            return self._google_private_key
+
+    def _get_google_private_key(self):
+        if self._google_token is None:
+            return None
+        try:
+            return GoogleStorageIndexedFileLocation.get_url_signing_key(
+                self._google_expiration_time, token=self._google_token
+            )
+        except Exception as e:
+            flask.current_app.logger.warning(
+                "could not get url signing key for Google Storage: {}".format(e)
+            )
+            return None
+
+    @classmethod
+    def for_current_user(cls, protocol, expires_in):
+        if flask.g.token is None:
+            user_info = {
+                "user_id": str(flask.g.user.id),
+                "username": flask.g.user.username,
+            }
+        else:
+            user_info = S3IndexedFileLocation.get_user_info()
+
+        google_token = None
+        if protocol in (None, "gs"):
+            try:
+                google_token = validate_request(aud={"user"})
+            except Exception as e:
+                flask.current_app.logger.warning(
+                    "could not get url signing key for Google Storage: {}".format(e)
+                )
+
+        return cls(
+            user_info,
+            google_token=google_token,
+            google_expiration_time=int(time.time()) + int(expires_in),
+        )
+
+
 class IndexedFile(object):
     """
     A file from the index service that will contain information about
@@ -84,44 +431,69 @@ class IndexedFile(object):
         )
         self.public = check_public(self.set_acls)
 
-    def get_signed_url(self, protocol, action, expires_in):
+    def get_signed_url(self, protocol, action, expires_in, region=None):
         if not self.public and not self.check_authorization(action):
             raise Unauthorized("You don't have access permission on this file")
 
         if action is not None and action not in SUPPORTED_ACTIONS:
             raise NotSupported("action {} is not supported".format(action))
 
-        return self._get_signed_url(protocol, action, expires_in)
-
-    def _get_signed_url(self, protocol, action, expires_in):
-        signed_url = None
+        signed_url_cache = getattr(flask.current_app, "signed_url_cache", None)
+        if signed_url_cache is None:
+            return self._get_signed_url(protocol, action, expires_in, region=region)
+
+        # Authorization has already been checked against the current index
+        # record and token above, so a cached url is only handed out to the
+        # same principal while they still have access. The record's urls are
+        # part of the key so a moved file is signed again.
+        principal = None if self.public else flask.g.user.id
+        cache_key = (
+            principal,
+            self.file_id,
+            tuple(self.index_document.get("urls", [])),
+            protocol,
+            action,
+            region,
+        )
+        signed_url = signed_url_cache.get(cache_key, expires_in)
+        if signed_url is None:
+            expires_in = int(expires_in) + signed_url_cache.reuse_window
+            signed_url = self._get_signed_url(
+                protocol, action, expires_in, region=region
+            )
+            signed_url_cache.set(cache_key, signed_url, expires_in)
+        return signed_url
 
+    def _get_signed_url(
+        self, protocol, action, expires_in, signing_context=None, region=None
+    ):
         if protocol:
-            for file_location in self.indexed_file_locations:
-                # allow file location to be https, even if they specific http
-                if (file_location.protocol == protocol) or (
-                    protocol == "http" and file_location.protocol == "https"
-                ):
-                    signed_url = file_location.get_signed_url(
-                        action, expires_in, public_data=self.public
-                    )
-            if not signed_url:
+            # allow file location to be https, even if they specific http
+            file_locations = [
+                file_location
+                for file_location in self.indexed_file_locations
+                if (file_location.protocol == protocol)
+                or (protocol == "http" and file_location.protocol == "https")
+            ]
+            if not file_locations:
                 raise NotFound(
                     "File {} does not have a location with specified "
                     "protocol {}.".format(self.file_id, protocol)
                 )
-
-        # no protocol specified, return first location as signed url
+            # the last matching location is used, as it always has been,
+            # unless another one is closer to the region
+            file_locations = file_locations[::-1]
         elif len(self.indexed_file_locations) > 0:
-            signed_url = self.indexed_file_locations[0].get_signed_url(
-                action, expires_in, public_data=self.public
-            )
+            file_locations = self.indexed_file_locations
         else:
             # at this point, they haven't specified a protocol and we don't
             # have any actual locations, error out
             raise NotFound("Can't find any file locations.")
 
-        return signed_url
+        file_location = rank_locations(file_locations, region)[0]
+        return file_location.get_signed_url(
+            action, expires_in, public_data=self.public, signing_context=signing_context
+        )
 
     def _get_index_document(self):
         indexd_server = (
@@ -178,15 +550,31 @@ class IndexedFile(object):
             indexed_file_locations.append(new_location)
         return indexed_file_locations
 
+    def get_multipart_upload_location(self):
+        """
+        Return the s3 location to upload this file to in parts.
+        """
+        if not self.public and not self.check_authorization("upload"):
+            raise Unauthorized("You don't have access permission on this file")
+
+        for file_location in self.indexed_file_locations:
+            if file_location.protocol == "s3":
+                return file_location
+        raise NotSupported(
+            "File {} does not have an s3 location; multipart upload is only "
+            "supported for s3.".format(self.file_id)
+        )
+
     @login_required({"data"})
     def check_authorization(self, action):
-        if flask.g.token is None:
-            given_acls = set(filter_auth_ids(action, flask.g.user.project_access))
-        else:
-            given_acls = set(
-                filter_auth_ids(action, flask.g.token["context"]["user"]["projects"])
-            )
-        return len(self.set_acls & given_acls) > 0
+        return self.is_authorized(get_authorized_acls(action))
+
+    def is_authorized(self, authorized_acls):
+        """
+        Return whether a caller with access to ``authorized_acls`` may access
+        this file.
+        """
+        return self.public or len(self.set_acls & authorized_acls) > 0
 
 
 class IndexedFileLocationFactory(object):
@@ -229,7 +617,15 @@ class IndexedFileLocation(object):
         self.parsed_url = urlparse(url)
         self.protocol = self.parsed_url.scheme
 
-    def get_signed_url(self, action, expires_in, public_data=False):
+    def get_region(self):
+        """
+        Return the region the location is stored in, or None if unknown.
+        """
+        return None
+
+    def get_signed_url(
+        self, action, expires_in, public_data=False, signing_context=None
+    ):
         return self.url
 
 
@@ -284,11 +680,7 @@ class S3IndexedFileLocation(IndexedFileLocation):
         if len(aws_creds) == 0 and len(s3_buckets) > 0:
             raise InternalError("credential for buckets is not configured")
 
-        bucket_cred = None
-        for pattern in s3_buckets:
-            if re.match("^" + pattern + "$", self.parsed_url.netloc):
-                bucket_cred = s3_buckets[pattern]
-                break
+        bucket_cred = get_s3_bucket_matcher(s3_buckets).match(self.parsed_url.netloc)
         if bucket_cred is None:
             raise Unauthorized("permission denied for bucket")
 
@@ -309,7 +701,9 @@ class S3IndexedFileLocation(IndexedFileLocation):
                 aws_creds, bucket_cred, cred_key, expires_in
             )
 
-    def get_signed_url(self, action, expires_in, public_data=False):
+    def get_signed_url(
+        self, action, expires_in, public_data=False, signing_context=None
+    ):
         aws_creds = get_value(
             flask.current_app.config,
             "AWS_CREDENTIALS",
@@ -334,7 +728,10 @@ class S3IndexedFileLocation(IndexedFileLocation):
 
         user_info = {}
         if not public_data:
-            user_info = S3IndexedFileLocation.get_user_info()
+            if signing_context:
+                user_info = signing_context.user_info
+            else:
+                user_info = S3IndexedFileLocation.get_user_info()
 
         url = generate_aws_presigned_url(
             http_url,
@@ -348,6 +745,94 @@ class S3IndexedFileLocation(IndexedFileLocation):
 
         return url
 
+    def get_region(self):
+        """
+        Return the bucket's region from its ``S3_BUCKETS`` entry, or from the
+        regions already looked up from AWS. Never calls AWS itself.
+        """
+        s3_buckets = flask.current_app.config.get("S3_BUCKETS") or {}
+        bucket_cred = get_s3_bucket_matcher(s3_buckets).match(self.bucket_name)
+        if bucket_cred and bucket_cred.get("region"):
+            return bucket_cred["region"]
+        boto = getattr(flask.current_app, "boto", None)
+        if boto is None:
+            return None
+        return boto.get_cached_bucket_region(self.bucket_name)
+
+    @property
+    def bucket_name(self):
+        return self.parsed_url.netloc
+
+    @property
+    def key(self):
+        return self.parsed_url.path.strip("/")
+
+    def _get_multipart_upload_config(self, expires_in):
+        """
+        Return the credentials and region to use for a multipart upload to
+        this location.
+        """
+        aws_creds = get_value(
+            flask.current_app.config,
+            "AWS_CREDENTIALS",
+            InternalError("credentials not configured"),
+        )
+        config = self.get_credential_to_access_bucket(aws_creds, expires_in)
+        if config.get("aws_access_key_id") == "*":
+            raise NotSupported(
+                "multipart upload is not supported for bucket {}".format(
+                    self.bucket_name
+                )
+            )
+        region = flask.current_app.boto.get_bucket_region(self.bucket_name, config)
+        return config, region
+
+    def initiate_multipart_upload(self, expires_in):
+        config, region = self._get_multipart_upload_config(expires_in)
+        return flask.current_app.boto.initiate_multipart_upload(
+            self.bucket_name, self.key, config, region
+        )
+
+    def get_multipart_upload_part_urls(
+        self, upload_id, part_numbers, expires_in, public_data=False
+    ):
+        """
+        Return presigned urls to upload the given parts of a multipart upload,
+        as a dict from part number to url.
+
+        Credentials and region are resolved once for the whole batch; signing
+        each url is then done locally.
+        """
+        config, region = self._get_multipart_upload_config(expires_in)
+        http_url = "https://{}.s3.amazonaws.com/{}".format(self.bucket_name, self.key)
+        user_info = {} if public_data else S3IndexedFileLocation.get_user_info()
+
+        urls = {}
+        for part_number in part_numbers:
+            signed_qs = dict(user_info, partNumber=str(part_number), uploadId=upload_id)
+            urls[part_number] = generate_aws_presigned_url(
+                http_url,
+                ACTION_DICT["s3"]["upload"],
+                config,
+                "s3",
+                region,
+                expires_in,
+                signed_qs,
+            )
+        return urls
+
+    def complete_multipart_upload(self, upload_id, parts, expires_in):
+        config, region = self._get_multipart_upload_config(expires_in)
+        return flask.current_app.boto.complete_multipart_upload(
+            self.bucket_name, self.key, upload_id, parts, config, region
+        )
+
+    def abort_multipart_upload(self, upload_id, expires_in):
+        config, region = self._get_multipart_upload_config(expires_in)
+        return flask.current_app.boto.abort_multipart_upload(
+            self.bucket_name, self.key, upload_id, config, region
+        )
+
     @staticmethod
     def get_user_info():
         user_info = {}
@@ -367,7 +852,16 @@ class GoogleStorageIndexedFileLocation(IndexedFileLocation):
     def __init__(self, url):
         super(GoogleStorageIndexedFileLocation, self).__init__(url)
 
-    def get_signed_url(self, action, expires_in, public_data=False):
+    def get_region(self):
+        """
+        Return the bucket's region from its ``GS_BUCKETS`` entry, if any.
+        """
+        gs_buckets = flask.current_app.config.get("GS_BUCKETS") or {}
+        return gs_buckets.get(self.parsed_url.netloc, {}).get("region")
+
+    def get_signed_url(
+        self, action, expires_in, public_data=False, signing_context=None
+    ):
         resource_path = (
             self.parsed_url.netloc.strip("/") + "/" + self.parsed_url.path.strip("/")
         )
@@ -378,17 +872,57 @@ class GoogleStorageIndexedFileLocation(IndexedFileLocation):
             url = "https://storage.googleapis.com/" + resource_path
         else:
             expiration_time = int(time.time()) + int(expires_in)
+            private_key = None
+            if signing_context:
+                private_key = signing_context.google_private_key
+                if not private_key:
+                    raise InternalError("Google url signing is not available")
             url = self._generate_google_storage_signed_url(
-                ACTION_DICT["gs"][action], resource_path, expiration_time
+                ACTION_DICT["gs"][action],
+                resource_path,
+                expiration_time,
+                private_key=private_key,
             )
 
         return url
 
     def _generate_google_storage_signed_url(
-        self, http_verb, resource_path, expiration_time
+        self, http_verb, resource_path, expiration_time, private_key=None
     ):
-        set_current_token(validate_request(aud={"user"}))
+        if not private_key:
+            private_key = self.get_url_signing_key(expiration_time)
+
+        final_url = cirrus.google_cloud.utils.get_signed_url(
+            resource_path,
+            http_verb,
+            expiration_time,
+            extension_headers=None,
+            content_type="",
+            md5_value="",
+            service_account_creds=private_key,
+        )
+        return final_url
+
+    @classmethod
+    def get_url_signing_key(cls, expiration_time, token=None):
+        """
+        Return the current user's decrypted url signing key, valid at least
+        until ``expiration_time``. The user is the one of the already
+        validated ``token`` if given, e.g. outside of the request.
+        """
+        set_current_token(token or validate_request(aud={"user"}))
         user_id = current_token["sub"]
+
+        # the decrypted key is cached until shortly before it expires, so
+        # repeated signing for the same user skips the proxy group and key
+        # lookups as well as the decryption
+        private_key = url_signing_key_cache.get(user_id, expiration_time)
+        if not private_key:
+            private_key = cls._get_url_signing_key(user_id, expiration_time)
+        return private_key
+
+    @staticmethod
+    def _get_url_signing_key(user_id, expiration_time):
         proxy_group_id = get_or_create_proxy_group_id()
         username = current_token.get("context", {}).get("user", {}).get("name")
 
@@ -411,29 +945,119 @@ class GoogleStorageIndexedFileLocation(IndexedFileLocation):
                 user_id=user_id, username=username, proxy_group_id=proxy_group_id
             )
 
-        final_url = cirrus.google_cloud.utils.get_signed_url(
-            resource_path,
-            http_verb,
-            expiration_time,
-            extension_headers=None,
-            content_type="",
-            md5_value="",
-            service_account_creds=private_key,
-        )
-        return final_url
+        return private_key
+
+
+class SignedUrlCache(object):
+    """
+    Short-lived cache of issued signed urls, so bursts of identical requests
+    can reuse a url instead of signing again.
+
+    Urls to be cached are signed for ``reuse_window`` seconds longer than
+    requested, and a cached url is returned only if the time it has left
+    covers the ``expires_in`` of the new request. So identical requests share
+    a url for up to ``reuse_window`` seconds.
+    """
+
+    def __init__(self, max_size=10000, reuse_window=60):
+        self.max_size = max_size
+        self.reuse_window = reuse_window
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, expires_in):
+        entry = self._urls.get(key)
+        if not entry:
+            return None
+        url, expires_at = entry
+        if expires_at - int(time.time()) < int(expires_in):
+            return None
+        return url
+
+    def set(self, key, url, expires_in):
+        expires_at = int(time.time()) + int(expires_in)
+        with self._lock:
+            self._urls.pop(key, None)
+            self._urls[key] = (url, expires_at)
+            while len(self._urls) > self.max_size:
+                self._urls.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+#: Areas of the region prefixes which differ between clouds. AWS prefixes
+#: regions with a country or area code (``eu-west-1``, ``ap-southeast-1``)
+#: while Google spells the continent out (``europe-west1``,
+#: ``asia-southeast1``), so both are mapped to the same area.
+REGION_AREA_ALIASES = {
+    "us": "na",
+    "ca": "na",
+    "mx": "na",
+    "northamerica": "na",
+    "southamerica": "sa",
+    "europe": "eu",
+    "asia": "ap",
+    "australia": "ap",
+    "il": "me",
+    "africa": "af",
+}
+
+
+def get_region_area(region):
+    """
+    Return the broad area (roughly the continent) of a cloud region, e.g.
+    ``eu`` for both AWS's ``eu-west-1`` and Google's ``europe-west1``.
+    """
+    prefix = region.lower().split("-")[0]
+    return REGION_AREA_ALIASES.get(prefix, prefix)
+
+
+def rank_locations(file_locations, region):
+    """
+    Order file locations by how close they are to ``region``: locations in
+    that region first, then locations in the same area, then the rest
+    (including locations whose region is unknown). The original order is
+    kept between locations which are equally close.
+    """
+    if not region:
+        return list(file_locations)
+
+    def distance(file_location):
+        location_region = file_location.get_region()
+        if not location_region:
+            return 2
+        if location_region.lower() == region.lower():
+            return 0
+        if get_region_area(location_region) == get_region_area(region):
+            return 1
+        return 2
+
+    return sorted(file_locations, key=distance)
+
+
+def get_s3_bucket_matcher(s3_buckets):
+    """
+    Return the app's compiled matcher for ``S3_BUCKETS``, recompiling it only
+    if the configured buckets were replaced since it was built.
+    """
+    matcher = getattr(flask.current_app, "s3_bucket_matcher", None)
+    if matcher is None or matcher.s3_buckets is not s3_buckets:
+        matcher = S3BucketMatcher(s3_buckets)
+        flask.current_app.s3_bucket_matcher = matcher
+    return matcher
+
+
+def get_authorized_acls(action):
+    """
+    Return the set of auth ids the current user may perform ``action`` on.
+    """
+    return get_current_permission_index().authorized_auth_ids(action)
 
 
 def filter_auth_ids(action, list_auth_ids):
-    checked_permission = ""
-    if action == "download":
-        checked_permission = "read-storage"
-    elif action == "upload":
-        checked_permission = "write-storage"
-    authorized_dbgaps = []
-    for key, values in list_auth_ids.items():
-        if checked_permission in values:
-            authorized_dbgaps.append(key)
-    return authorized_dbgaps
+    return list(PermissionIndex(list_auth_ids).authorized_auth_ids(action))
 
 
 def check_public(set_acls):
@@ -30,7 +30,7 @@ from fence.resources.google.access_utils import (
 from fence.resources.google.utils import (
     get_monitoring_service_account_email,
     get_registered_service_accounts,
-    get_project_access_from_service_accounts,
+    get_project_access_by_service_account,
 )
 from fence.models import UserServiceAccount
 from flask_sqlalchemy_session import current_session
@@ -269,9 +269,12 @@ class GoogleServiceAccountRoot(Resource):
             project_service_accounts = get_registered_service_accounts(
                 google_project_id
             )
+            project_access_by_service_account = get_project_access_by_service_account(
+                project_service_accounts
+            )
 
             for project_sa in project_service_accounts:
-                project_access = get_project_access_from_service_accounts([project_sa])
+                project_access = project_access_by_service_account[project_sa.id]
 
                 # need to determine expiration by getting the access groups
                 # and then checking the expiration for each of them
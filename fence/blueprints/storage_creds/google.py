@@ -15,6 +15,7 @@ from fence.resources.google.utils import (
     get_service_account,
     get_or_create_service_account,
     get_or_create_proxy_group_id,
+    url_signing_key_cache,
 )
 
 
@@ -182,6 +183,7 @@ class GoogleCredentials(Resource):
                     if db_entry:
                         current_session.delete(db_entry)
                         current_session.commit()
+                    url_signing_key_cache.invalidate(key_id=access_key)
                 else:
                     flask.abort(
                         404,
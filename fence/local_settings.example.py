@@ -50,6 +50,8 @@ OPENID_CONNECT = {
     },
 }
 
+# A provider may set "requests_per_second" to limit the rate of API calls the
+# user sync makes to it when granting and revoking access.
 STORAGE_CREDENTIALS = {
     "cleversafe-server-a": {
         "backend": "cleversafe",
@@ -114,12 +116,34 @@ AWS_CREDENTIALS = {
 
 ASSUMED_ROLES = {"arn:aws:iam::role1": "CRED1"}
 
+#: ``BOTO_CLIENT_POOL_SIZE: int``
+#: The maximum number of boto3 clients (one per service and set of
+#: credentials) kept alive for reuse across requests.
+BOTO_CLIENT_POOL_SIZE = 64
+
+#: ``S3_BUCKETS: dict``
+#: Credentials to use for each bucket (keys may be regular expressions). An
+#: optional ``region`` saves looking the bucket's region up from AWS when
+#: choosing which replica of a file to sign.
 S3_BUCKETS = {
     "bucket1": {"cred": "CRED1"},
     "bucket2": {"cred": "CRED2"},
     "bucket3": {"cred": "CRED1", "role-arn": "arn:aws:iam::role1"},
 }
 
+#: ``GS_BUCKETS: dict``
+#: Regions of Google Storage buckets, used when choosing which replica of a
+#: file to sign, e.g. ``{"bucket4": {"region": "us-central1"}}``.
+GS_BUCKETS = {}
+
+#: ``DEFAULT_DATA_REGION: str``
+#: The region most clients of this commons run in, e.g. ``us-west-2``. For
+#: files with replicas in several buckets, fence signs a replica in the region
+#: the client passes as ``region`` (or this one) first, then one in the same
+#: area (e.g. ``us``). If unset and no ``region`` is passed, the replica is
+#: chosen by its position in the index record.
+DEFAULT_DATA_REGION = None
+
 #: Confiure which identity providers this fence instance can use for login.
 #:
 #: See ``fence/blueprints/login/__init__.py`` for which identity providers can
@@ -147,6 +171,27 @@ GOOGLE_GROUP_PREFIX = ""
 #: The number of seconds after a pre-signed url is issued until it expires.
 MAX_PRESIGNED_URL_TTL = 3600
 
+#: ``ENABLE_SIGNED_URL_CACHE: bool``
+#: Reuse a previously issued pre-signed url for repeated requests from the
+#: same user for the same file, protocol and action, as long as the url is
+#: still valid for the requested ``expires_in``.
+ENABLE_SIGNED_URL_CACHE = False
+
+#: ``SIGNED_URL_CACHE_SIZE: int``
+#: The maximum number of pre-signed urls kept for reuse.
+SIGNED_URL_CACHE_SIZE = 10000
+
+#: ``SIGNED_URL_CACHE_REUSE_WINDOW: int``
+#: Seconds for which a cached pre-signed url can be reused. Urls which may be
+#: reused are signed for this much longer than requested, so they can outlive
+#: ``MAX_PRESIGNED_URL_TTL`` by up to this many seconds.
+SIGNED_URL_CACHE_REUSE_WINDOW = 60
+
+#: ``MANIFEST_SIGNING_WORKERS: int``
+#: The number of threads each ``POST /data/manifest`` request uses to look up
+#: and sign the files in the manifest.
+MANIFEST_SIGNING_WORKERS = 8
+
 #: ``MAX_API_KEY_TTL: int``
 #: The number of seconds after an API KEY is issued until it expires.
 MAX_API_KEY_TTL = 2592000
@@ -180,6 +225,27 @@ GOOGLE_MANAGED_SERVICE_ACCOUNT_DOMAINS = {
     "storage-transfer-service.iam.gserviceaccount.com",
 }
 
+#: ``GOOGLE_MONITOR_WORKERS: int``
+#: Number of Google projects ``fence-create google-manage-user-registrations``
+#: validates concurrently.
+GOOGLE_MONITOR_WORKERS = 8
+
+#: ``GOOGLE_API_REQUESTS_PER_SECOND: Optional[float]``
+#: Maximum number of Google API calls per second made by all the threads of
+#: ``fence-create google-manage-user-registrations``, or None for no limit.
+GOOGLE_API_REQUESTS_PER_SECOND = None
+
+#: ``GOOGLE_MONITOR_MAX_VALIDATION_AGE: Optional[int]``
+#: Seconds for which ``fence-create google-manage-user-registrations`` skips
+#: Google projects found valid before, as long as their IAM membership, the
+#: IAM policies of their registered service accounts and their users' access
+#: didn't change. None to validate every project on every run.
+#: Changes to a project's parent organization and to the keys and types of
+#: its service accounts are only detected once this much time has passed,
+#: so e.g. a service account given a user-managed key keeps its data access
+#: until then.
+GOOGLE_MONITOR_MAX_VALIDATION_AGE = None
+
 REMOVE_SERVICE_ACCOUNT_EMAIL_NOTIFICATION = {
     "domain": "smtp domain",
     "subject": "User service account removal notification",
@@ -20,6 +20,7 @@ from sqlalchemy import (
     String,
     Column,
     Boolean,
+    LargeBinary,
     Text,
     MetaData,
     Table,
@@ -457,6 +458,35 @@ class ServiceAccountToGoogleBucketAccessGroup(Base):
     )
 
 
+class UserSyncState(Base):
+    """
+    State kept by ``fence-create sync`` between runs: the parsed content of
+    each access file, keyed by file and content hash, and a snapshot of the
+    access applied by the last sync. See ``fence.sync.sync_state``.
+    """
+
+    __tablename__ = "user_sync_state"
+
+    source = Column(String, primary_key=True)
+    fingerprint = Column(String)
+    # zlib-compressed JSON
+    data = Column(LargeBinary, nullable=False)
+
+
+class GoogleProjectValidation(Base):
+    """
+    Last time the Google project monitor found a Google project and its
+    registered service accounts valid, with a fingerprint of what that
+    validation depended on. See ``fence.scripting.google_monitor``.
+    """
+
+    __tablename__ = "google_project_validation"
+
+    google_project_id = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    validated = Column(BigInteger, nullable=False)
+
+
 to_timestamp = (
     "CREATE OR REPLACE FUNCTION pc_datetime_to_timestamp(datetoconvert timestamp) "
     "RETURNS BIGINT AS "
@@ -0,0 +1,250 @@
+"""
+Compiled view of what a user may do with the data in commons.
+
+A ``PermissionIndex`` is built once from a user's project access (either the
+``projects`` claim of their access token or ``User.project_access``) and then
+answers the authorization questions asked by data signing, storage credential
+endpoints and Google service account registration without walking the access
+mapping again.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+import flask
+
+from fence.models import AccessPrivilege, Project
+
+#: Storage privilege needed on a project to perform each data action.
+ACTION_PRIVILEGES = {"download": "read-storage", "upload": "write-storage"}
+
+
+class PermissionIndex(object):
+    """
+    Index of a user's project access by privilege.
+
+    Example:
+
+        index = PermissionIndex({"phs000178": ["read", "read-storage"]})
+        index.authorized_auth_ids("download")  # frozenset(["phs000178"])
+        index.authorized_auth_ids("upload")  # frozenset()
+    """
+
+    def __init__(self, project_access, storage_providers=None):
+        """
+        Args:
+            project_access (dict): project auth_id -> privileges on it
+            storage_providers (Optional[Callable]):
+                function returning the names of the storage providers the
+                user's projects are stored in; only called when storage
+                access is checked
+        """
+        self.project_access = {
+            auth_id: frozenset(privileges or [])
+            for auth_id, privileges in project_access.iteritems()
+        }
+        by_privilege = {}
+        for auth_id, privileges in self.project_access.iteritems():
+            for privilege in privileges:
+                by_privilege.setdefault(privilege, set()).add(auth_id)
+        self._by_privilege = {
+            privilege: frozenset(auth_ids)
+            for privilege, auth_ids in by_privilege.iteritems()
+        }
+        self._get_storage_providers = storage_providers
+        self._storage_providers = None
+
+    @classmethod
+    def from_token(cls, token):
+        """
+        Build the index from the project access in decoded access token claims.
+        """
+        return cls(token["context"]["user"]["projects"])
+
+    @classmethod
+    def from_user(cls, user):
+        """
+        Build the index from a ``fence.models.User``.
+        """
+
+        return cls(
+            dict(user.project_access),
+            storage_providers=_user_storage_providers(user),
+        )
+
+    def auth_ids_with_privilege(self, privilege):
+        return self._by_privilege.get(privilege, frozenset())
+
+    def authorized_auth_ids(self, action):
+        """
+        Return the auth_ids of the projects on which ``action`` (``download``
+        or ``upload``) is allowed.
+        """
+        privilege = ACTION_PRIVILEGES.get(action)
+        if privilege is None:
+            return frozenset()
+        return self.auth_ids_with_privilege(privilege)
+
+    def has_project(self, auth_id):
+        """
+        Return whether the user has any privilege on the project.
+        """
+        return auth_id in self.project_access
+
+    @property
+    def storage_providers(self):
+        if self._storage_providers is None:
+            if self._get_storage_providers is None:
+                self._storage_providers = frozenset()
+            else:
+                self._storage_providers = frozenset(self._get_storage_providers())
+        return self._storage_providers
+
+    def can_access_storage(self, provider):
+        """
+        Return whether the user may get credentials for storage ``provider``:
+        they need ``read-storage`` on some project, and some project of theirs
+        has to be stored in that provider.
+        """
+        return (
+            len(self.auth_ids_with_privilege("read-storage")) > 0
+            and provider in self.storage_providers
+        )
+
+
+def _user_storage_providers(user):
+    """
+    Return a function listing the storage providers of a user's projects.
+    """
+
+    def storage_providers():
+        return [
+            storage_access.provider.name
+            for project in user.projects.values()
+            for storage_access in project.storage_access
+        ]
+
+    return storage_providers
+
+
+class TokenPermissionIndexCache(object):
+    """
+    Cache of permission indexes built from access tokens, keyed by the token
+    id. The projects claim of a token never changes, so an index can be
+    reused until the token expires.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        jti = token.get("jti")
+        if jti is None:
+            return PermissionIndex.from_token(token)
+
+        entry = self._indexes.get(jti)
+        if entry and entry[1] > time.time():
+            return entry[0]
+
+        index = PermissionIndex.from_token(token)
+        with self._lock:
+            self._indexes.pop(jti, None)
+            self._indexes[jti] = (index, token.get("exp", 0))
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+token_permission_index_cache = TokenPermissionIndexCache()
+
+
+def _get_request_indexes():
+    """
+    Return the dict of permission indexes built while handling the current
+    request, or None outside of a request.
+
+    The app context (and so ``flask.g``) can outlive a request, so the dict is
+    tied to the request object and discarded once another request comes in.
+    """
+    if not flask.has_request_context():
+        return None
+    request = flask.request._get_current_object()
+    cached = getattr(flask.g, "permission_indexes", None)
+    if cached is None or cached[0] is not request:
+        cached = flask.g.permission_indexes = (request, {})
+    return cached[1]
+
+
+def get_user_permission_index(user):
+    """
+    Return the permission index for a ``fence.models.User``, built from their
+    access in the database. During a request the index is shared by every
+    check made for the same user.
+    """
+    indexes = _get_request_indexes()
+    if indexes is None:
+        return PermissionIndex.from_user(user)
+    if user.id not in indexes:
+        indexes[user.id] = PermissionIndex.from_user(user)
+    return indexes[user.id]
+
+
+def get_user_permission_indexes(users, session):
+    """
+    Return the permission indexes for several ``fence.models.User``s, by user
+    id. The project access of all the users without an index yet is read with
+    one query; during a request the indexes are shared like the ones returned
+    by ``get_user_permission_index``.
+
+    Args:
+        users (List[fence.models.User]): users to index
+        session (sqlalchemy.orm.session.Session): session to read access with
+
+    Return:
+        dict: user id -> PermissionIndex
+    """
+    indexes = _get_request_indexes()
+    if indexes is None:
+        indexes = {}
+    missing = {user.id: user for user in users if user.id not in indexes}
+    if missing:
+        project_access = {user_id: {} for user_id in missing}
+        rows = (
+            session.query(
+                AccessPrivilege.user_id, Project.auth_id, AccessPrivilege.privilege
+            )
+            .join(Project, Project.id == AccessPrivilege.project_id)
+            .filter(AccessPrivilege.user_id.in_(missing.keys()))
+        )
+        for user_id, auth_id, privileges in rows:
+            project_access[user_id][auth_id] = privileges
+        for user_id, user in missing.iteritems():
+            indexes[user_id] = PermissionIndex(
+                project_access[user_id],
+                storage_providers=_user_storage_providers(user),
+            )
+    return {user.id: indexes[user.id] for user in users}
+
+
+def get_current_permission_index():
+    """
+    Return the permission index for the user of the current request.
+
+    The index is built from the access token if the request carried one (and
+    cached for the lifetime of the token) and from the user's access in the
+    database otherwise.
+    """
+    token = getattr(flask.g, "token", None)
+    if token is None:
+        return get_user_permission_index(flask.g.user)
+    indexes = _get_request_indexes()
+    if "token" not in indexes:
+        indexes["token"] = token_permission_index_cache.get(token)
+    return indexes["token"]
@@ -67,6 +67,37 @@ class ArboristClient(object):
             return None
         return response.json()
 
+    def list_resources(self):
+        """
+        List the existing resources.
+
+        Return:
+            dict: response JSON from arborist
+
+        Example:
+
+            {
+                "resources": [
+                    {
+                        "name": "project",
+                        "path": "/project",
+                        "subresources": ["/project/phs000178"]
+                    }
+                ]
+            }
+
+        """
+        return _request_get_json(requests.get(self._resource_url))
+
+    def list_roles(self):
+        """
+        List the existing roles.
+
+        Return:
+            dict: response JSON from arborist, with the roles under "roles"
+        """
+        return _request_get_json(requests.get(self._role_url))
+
     def list_policies(self):
         """
         List the existing policies.
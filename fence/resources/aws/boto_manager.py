@@ -1,23 +1,119 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import uuid
+
 from boto3 import client
 from boto3.exceptions import Boto3Error
+from botocore.exceptions import ClientError
 from fence.errors import UserError, InternalError, UnavailableError
-import uuid
+
+
+#: Default maximum number of boto3 clients kept alive by a ``ClientPool``.
+DEFAULT_MAX_POOLED_CLIENTS = 64
+
+#: Errors from S3 multipart calls which are caused by the request (an unknown
+#: upload id, missing or misordered parts) rather than by fence or AWS.
+MULTIPART_USER_ERROR_CODES = [
+    "NoSuchUpload",
+    "InvalidPart",
+    "InvalidPartOrder",
+    "EntityTooSmall",
+]
+
+
+class ClientPool(object):
+    """
+    Bounded, thread-safe pool of boto3 clients keyed by service and credential
+    identity.
+
+    Creating a boto3 client is expensive (endpoint resolution, loading
+    botocore models), but low-level clients are safe to share between threads
+    once created. Clients are created lazily on first use and the least
+    recently used one is dropped once ``max_size`` is reached.
+
+    The lock is a ``threading.Lock``, which gevent's monkey-patching turns into
+    a greenlet-aware lock, so the pool is safe under both threaded and greenlet
+    workers.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_POOLED_CLIENTS):
+        self.max_size = max(int(max_size), 1)
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _credential_identity(config):
+        """
+        Return a hashable identity for the credentials in ``config`` without
+        keeping the secrets themselves as dictionary keys.
+        """
+        identity = hashlib.sha256()
+        for field in sorted(config.keys()):
+            identity.update("{}={};".format(field, config[field]).encode("utf-8"))
+        return identity.hexdigest()
+
+    def get(self, service, config):
+        """
+        Return a client for ``service`` using the credentials in ``config``,
+        creating and caching it if necessary.
+
+        Args:
+            service (str): boto3 service name, e.g. ``"s3"`` or ``"sts"``
+            config (dict): keyword arguments for ``boto3.client``
+
+        Return:
+            botocore.client.BaseClient: the pooled client
+        """
+        key = (service, self._credential_identity(config))
+        with self._lock:
+            pooled_client = self._clients.pop(key, None)
+            if pooled_client is None:
+                # boto3's default session is not thread-safe, so clients are
+                # also constructed while holding the lock
+                pooled_client = client(service, **config)
+            self._clients[key] = pooled_client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return pooled_client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self):
+        return len(self._clients)
 
 
 class BotoManager(object):
-    def __init__(self, config, logger):
+    def __init__(self, config, logger, max_pooled_clients=DEFAULT_MAX_POOLED_CLIENTS):
         self.sts_client = client("sts", **config)
         self.s3_client = client("s3", **config)
+        self.client_pool = ClientPool(max_size=max_pooled_clients)
+        # a bucket's region never changes, so lookups are kept for the life
+        # of the process
+        self.bucket_regions = {}
         self.logger = logger
         self.ec2 = None
         self.iam = None
 
+    def _get_client(self, service, config, default):
+        """
+        Return a pooled client for ``config`` if it carries its own
+        credentials, otherwise the default client created at init.
+
+        The default clients are never reassigned here, so concurrent requests
+        using different credentials do not interfere with each other.
+        """
+        if config and "aws_access_key_id" in config:
+            return self.client_pool.get(service, config)
+        return default
+
     def assume_role(self, role_arn, duration_seconds, config=None):
         try:
-            if config and config.has_key("aws_access_key_id"):
-                self.sts_client = client("sts", **config)
+            sts_client = self._get_client("sts", config, self.sts_client)
             session_name_postfix = uuid.uuid4()
-            return self.sts_client.assume_role(
+            return sts_client.assume_role(
                 RoleArn=role_arn,
                 DurationSeconds=duration_seconds,
                 RoleSessionName="{}-{}".format("gen3", session_name_postfix),
@@ -30,8 +126,7 @@ class BotoManager(object):
             raise UnavailableError("Fail to reach AWS: {}".format(ex.message))
 
     def presigned_url(self, bucket, key, expires, config, method="get_object"):
-        if config.has_key("aws_access_key_id"):
-            self.s3_client = client("s3", **config)
+        s3_client = self._get_client("s3", config, self.s3_client)
         if method not in ["get_object", "put_object"]:
             raise UserError("method {} not allowed".format(method))
         if expires is None:
@@ -39,7 +134,7 @@ class BotoManager(object):
         elif expires > 3600 * 24:
             expires = 3600 * 24
 
-        url = self.s3_client.generate_presigned_url(
+        url = s3_client.generate_presigned_url(
             ClientMethod=method,
             Params={"Bucket": bucket, "Key": key}
             if method == "get_object"
@@ -48,11 +143,19 @@ class BotoManager(object):
         )
         return url
 
+    def get_cached_bucket_region(self, bucket):
+        """
+        Return the region of ``bucket`` if it was already looked up, without
+        calling AWS.
+        """
+        return self.bucket_regions.get(bucket)
+
     def get_bucket_region(self, bucket, config):
+        if bucket in self.bucket_regions:
+            return self.bucket_regions[bucket]
         try:
-            if config.has_key("aws_access_key_id"):
-                self.s3_client = client("s3", **config)
-            response = self.s3_client.get_bucket_location(Bucket=bucket)
+            s3_client = self._get_client("s3", config, self.s3_client)
+            response = s3_client.get_bucket_location(Bucket=bucket)
             region = response.get("LocationConstraint")
         except Boto3Error as ex:
             self.logger.exception(ex)
@@ -61,9 +164,79 @@ class BotoManager(object):
             self.logger.exception(ex)
             raise UnavailableError("Fail to reach AWS: {}".format(ex.message))
         if region is None:
-            return "us-east-1"
+            region = "us-east-1"
+        self.bucket_regions[bucket] = region
         return region
 
+    def _multipart_call(self, method, config, region, **kwargs):
+        """
+        Call a multipart upload ``method`` of an s3 client for ``config`` in
+        the bucket's region, translating errors.
+        """
+        if region:
+            config = dict(config, region_name=region)
+        try:
+            s3_client = self._get_client("s3", config, self.s3_client)
+            return getattr(s3_client, method)(**kwargs)
+        except ClientError as ex:
+            self.logger.exception(ex)
+            if ex.response.get("Error", {}).get("Code") in MULTIPART_USER_ERROR_CODES:
+                raise UserError("Fail to {}: {}".format(method, ex.message))
+            raise InternalError("Fail to {}: {}".format(method, ex.message))
+        except Boto3Error as ex:
+            self.logger.exception(ex)
+            raise InternalError("Fail to {}: {}".format(method, ex.message))
+        except Exception as ex:
+            self.logger.exception(ex)
+            raise UnavailableError("Fail to reach AWS: {}".format(ex.message))
+
+    def initiate_multipart_upload(self, bucket, key, config, region=None):
+        """
+        Start a multipart upload of ``key`` and return its upload id.
+        """
+        response = self._multipart_call(
+            "create_multipart_upload",
+            config,
+            region,
+            Bucket=bucket,
+            Key=key,
+            ServerSideEncryption="AES256",
+        )
+        return response["UploadId"]
+
+    def complete_multipart_upload(
+        self, bucket, key, upload_id, parts, config, region=None
+    ):
+        """
+        Assemble the uploaded ``parts`` into the object.
+
+        Args:
+            parts (List[dict]): ``{"PartNumber": int, "ETag": str}`` for every
+                uploaded part, in ascending order of part number
+        """
+        return self._multipart_call(
+            "complete_multipart_upload",
+            config,
+            region,
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+    def abort_multipart_upload(self, bucket, key, upload_id, config, region=None):
+        """
+        Abort a multipart upload and free the storage used by its parts.
+        """
+        return self._multipart_call(
+            "abort_multipart_upload",
+            config,
+            region,
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+        )
+
     def get_all_groups(self, list_group_name):
         """
         Get all group listed in the list_group_name.
@@ -0,0 +1,123 @@
+"""
+Resolve bucket names against the ``S3_BUCKETS`` configuration.
+
+The keys of ``S3_BUCKETS`` are regular expressions which must match the whole
+bucket name. Most of them are plain bucket names, so those are looked up in a
+dict first; the remaining patterns are compiled once into a few combined
+expressions instead of being rebuilt by ``re.match`` for every request.
+"""
+import re
+import threading
+
+
+#: Python 2's ``re`` module refuses to compile expressions with 100 or more
+#: groups, so combined expressions are split to stay under that limit.
+MAX_GROUPS_PER_EXPRESSION = 99
+
+#: Default number of resolved bucket names to remember.
+DEFAULT_CACHE_SIZE = 10000
+
+#: Characters which give a key of ``S3_BUCKETS`` regex meaning; keys without
+#: any of them can only match themselves.
+REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+_NOT_FOUND = object()
+
+
+def is_literal_pattern(pattern):
+    return not any(char in REGEX_METACHARACTERS for char in pattern)
+
+
+class S3BucketMatcher(object):
+    """
+    Precompiled lookup from bucket name to its ``S3_BUCKETS`` entry.
+
+    Precedence is deterministic: a key equal to the bucket name always wins,
+    then patterns are tried in sorted order and the first full match is used.
+
+    Example:
+
+        matcher = S3BucketMatcher({"bucket1": {"cred": "CRED1"}})
+        matcher.match("bucket1")  # {"cred": "CRED1"}
+        matcher.match("bucket2")  # None
+    """
+
+    def __init__(self, s3_buckets, cache_size=DEFAULT_CACHE_SIZE):
+        self.s3_buckets = s3_buckets
+        self.cache_size = cache_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+        patterns = sorted(s3_buckets.keys())
+        self._exact = {
+            pattern: s3_buckets[pattern]
+            for pattern in patterns
+            if is_literal_pattern(pattern)
+        }
+        self._expressions = self._compile(
+            [pattern for pattern in patterns if pattern not in self._exact]
+        )
+
+    @staticmethod
+    def _compile(patterns):
+        """
+        Compile ``patterns`` into as few combined expressions as possible.
+
+        Each pattern is wrapped in its own group; the index of that group in
+        the combined expression identifies the pattern that matched, even if
+        the pattern contains groups of its own.
+
+        Return:
+            List[Tuple[re.RegexObject, List[Tuple[int, str]]]]:
+                combined expression and (group index, pattern) pairs
+        """
+        expressions = []
+        chunk = []
+        chunk_groups = 0
+
+        def flush():
+            if chunk:
+                combined = "|".join("({})".format(pattern) for _, pattern in chunk)
+                expressions.append((re.compile("^(?:" + combined + ")$"), list(chunk)))
+
+        for pattern in patterns:
+            groups = re.compile(pattern).groups + 1
+            if chunk and chunk_groups + groups > MAX_GROUPS_PER_EXPRESSION:
+                flush()
+                chunk = []
+                chunk_groups = 0
+            chunk.append((chunk_groups + 1, pattern))
+            chunk_groups += groups
+        flush()
+
+        return expressions
+
+    def _resolve(self, bucket_name):
+        if bucket_name in self._exact:
+            return self._exact[bucket_name]
+        for expression, group_patterns in self._expressions:
+            match = expression.match(bucket_name)
+            if not match:
+                continue
+            # alternation tries patterns left to right, so the first matching
+            # group is the first pattern in sorted order that matched
+            for group_index, pattern in group_patterns:
+                if match.start(group_index) != -1:
+                    return self.s3_buckets[pattern]
+        return None
+
+    def match(self, bucket_name):
+        """
+        Return the ``S3_BUCKETS`` entry for ``bucket_name``, or ``None`` if no
+        configured pattern matches it.
+        """
+        bucket_cred = self._cache.get(bucket_name, _NOT_FOUND)
+        if bucket_cred is not _NOT_FOUND:
+            return bucket_cred
+
+        bucket_cred = self._resolve(bucket_name)
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[bucket_name] = bucket_cred
+        return bucket_cred
@@ -20,15 +20,16 @@ import fence
 from cdislogging import get_logger
 
 from fence.errors import NotFound, NotSupported
+from fence.permissions import get_user_permission_indexes
 from fence.models import (
     User,
     Project,
-    AccessPrivilege,
     UserGoogleAccount,
     UserServiceAccount,
     ServiceAccountAccessPrivilege,
     ServiceAccountToGoogleBucketAccessGroup,
 )
+from fence.resources.google.cache import cached_read
 from fence.resources.google.utils import (
     get_db_session,
     get_users_from_google_members,
@@ -44,7 +45,7 @@ ALLOWED_SERVICE_ACCOUNT_TYPES = [
 ]
 
 
-def get_google_project_number(google_project_id, google_cloud_manager):
+def get_google_project_number(google_project_id, google_cloud_manager, cache=None):
     """
     Return a project's "projectNumber" which uniquely identifies it.
     This will only be successful if fence can access info about the given google project
@@ -53,12 +54,17 @@ def get_google_project_number(google_project_id, google_cloud_manager):
     Args:
         google_project_id (str): Google project ID
         google_cloud_manager (GoogleCloudManager): cloud manager instance
+        cache (GoogleAPICache, optional): cache of Google API reads
 
     Returns:
         str: string repsentation of an int64 uniquely identifying a Google project
     """
     try:
-        response = google_cloud_manager.get_project_info()
+        response = cached_read(
+            cache,
+            ("project_info", google_project_id),
+            google_cloud_manager.get_project_info,
+        )
         return response.get("projectNumber")
     except Exception as exc:
         logger.error(
@@ -68,7 +74,7 @@ def get_google_project_number(google_project_id, google_cloud_manager):
         return None
 
 
-def get_google_project_membership(project_id, google_cloud_manager):
+def get_google_project_membership(project_id, google_cloud_manager, cache=None):
     """
     Returns GCM get_project_membership() result, which is a list of all
     members on the projects IAM
@@ -76,27 +82,38 @@ def get_google_project_membership(project_id, google_cloud_manager):
     Args:
         project_id(str): unique id for project
         google_cloud_manager(GoogleCloudManager): cloud manager instance
+        cache(GoogleAPICache, optional): cache of Google API reads
 
     Returns
         List(GooglePolicyMember): list of members on project's IAM
     """
 
-    return google_cloud_manager.get_project_membership(project_id)
+    return cached_read(
+        cache,
+        ("project_membership", project_id),
+        google_cloud_manager.get_project_membership,
+        project_id,
+    )
 
 
-def get_google_project_parent_org(google_cloud_manager):
+def get_google_project_parent_org(google_cloud_manager, cache=None):
     """
     Checks if google project has parent org. Wraps
     GoogleCloudManager.get_project_organization()
 
     Args:
         google_cloud_manager(GoogleCloudManager): cloud manager instance
+        cache(GoogleAPICache, optional): cache of Google API reads
 
     Returns:
         str: The Google projects parent organization name or None if it does't have one
     """
     try:
-        return google_cloud_manager.get_project_organization()
+        return cached_read(
+            cache,
+            ("project_organization", google_cloud_manager.project_id),
+            google_cloud_manager.get_project_organization,
+        )
     except Exception as exc:
         logger.error(
             "Could not determine if Google project (id: {}) has parent org"
@@ -160,7 +177,7 @@ def get_google_project_valid_users_and_service_accounts(
         raise
 
 
-def is_valid_service_account_type(account_id, google_cloud_manager):
+def is_valid_service_account_type(account_id, google_cloud_manager, cache=None):
     """
     Checks service account type against allowed service account types
     for service account registration
@@ -168,13 +185,19 @@ def is_valid_service_account_type(account_id, google_cloud_manager):
     Args:
         account_id(str): account identifier to check valid type
         google_cloud_manager(GoogleCloudManager): cloud manager instance
+        cache(GoogleAPICache, optional): cache of Google API reads
 
     Returns:
         Bool: True if service acocunt type is allowed as defined
         in ALLOWED_SERVICE_ACCOUNT_TYPES
     """
     try:
-        sa_type = google_cloud_manager.get_service_account_type(account_id)
+        sa_type = cached_read(
+            cache,
+            ("service_account_type", account_id),
+            google_cloud_manager.get_service_account_type,
+            account_id,
+        )
         return sa_type in ALLOWED_SERVICE_ACCOUNT_TYPES
     except Exception as exc:
         logger.error(
@@ -186,7 +209,7 @@ def is_valid_service_account_type(account_id, google_cloud_manager):
 
 
 def service_account_has_external_access(
-    service_account, google_cloud_manager, policy=None
+    service_account, google_cloud_manager, policy=None, cache=None
 ):
     """
     Checks if service account has external access or not.
@@ -195,12 +218,16 @@ def service_account_has_external_access(
         service_account(str): service account
         google_project_id(str): google project id
         policy(dict): response from previous call to get_service_account_policy
+        cache(GoogleAPICache, optional): cache of Google API reads
 
     Returns:
         bool: whether or not the service account has external access
     """
-    response = policy or google_cloud_manager.get_service_account_policy(
-        service_account
+    response = policy or cached_read(
+        cache,
+        ("service_account_policy", service_account),
+        google_cloud_manager.get_service_account_policy,
+        service_account,
     )
     if response.status_code != 200:
         logger.error(
@@ -218,7 +245,12 @@ def service_account_has_external_access(
         policy = GooglePolicy.from_json(json_obj)
         if policy.roles:
             return True
-    if google_cloud_manager.get_service_account_keys_info(service_account):
+    if cached_read(
+        cache,
+        ("service_account_keys", service_account),
+        google_cloud_manager.get_service_account_keys_info,
+        service_account,
+    ):
         return True
     return False
 
@@ -367,19 +399,18 @@ def is_user_member_of_all_google_projects(
 
 
 def do_all_users_have_access_to_project(users, project_id, db=None):
+    """
+    Check if all the users (``fence.models.User``) have access to the
+    project with id ``project_id``. The users' permission indexes are built
+    together, with one query for all of them.
+    """
     session = get_db_session(db)
-    # users will be list of fence.model.User's
-    # check if all users has access to a project with project_id
+    project = (session.query(Project).filter(Project.id == project_id)).first()
+    project_auth_id = project.auth_id if project else None
+    indexes = get_user_permission_indexes(users, session) if project else {}
     for user in users:
-        access_privilege = (
-            session.query(AccessPrivilege)
-            .filter(AccessPrivilege.user_id == user.id)
-            .filter(AccessPrivilege.project_id == project_id)
-        ).first()
-
-        if not access_privilege:
-            project = (session.query(Project).filter(Project.id == project_id)).first()
-            project_rep = project.auth_id if project else project_id
+        if project_auth_id is None or not indexes[user.id].has_project(project_auth_id):
+            project_rep = project_auth_id or project_id
             logger.info(
                 "User ({}) does not have access to project ({}). There may be other "
                 "users that do not have access to this project.".format(
@@ -990,7 +1021,7 @@ def force_add_service_accounts_to_access(
             )
 
 
-def get_service_account_policy(account, google_cloud_manager):
+def get_service_account_policy(account, google_cloud_manager, cache=None):
     """
     Get the policy for the service account identified by `account`,
     using the provided cloud_manager
@@ -998,11 +1029,17 @@ def get_service_account_policy(account, google_cloud_manager):
     Args:
         account(str): service account identifier
         google_cloud_manager: cloud_manager instance
+        cache(GoogleAPICache, optional): cache of Google API reads
     Returns:
         (Response): returns response from Google API
 
     """
-    sa_policy = google_cloud_manager.get_service_account_policy(account)
+    sa_policy = cached_read(
+        cache,
+        ("service_account_policy", account),
+        google_cloud_manager.get_service_account_policy,
+        account,
+    )
     if sa_policy.status_code != 200:
         raise NotFound(
             "Unable to get Service Account policy (status: {})".format(
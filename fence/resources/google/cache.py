@@ -0,0 +1,94 @@
+"""
+Read-through cache of Google API reads for the length of one run.
+
+Validating projects and service accounts reads the same data from Google
+several times: every service account check needs the project number, and the
+project check reads the project's membership and the policies of its
+service accounts again. A ``GoogleAPICache`` created for a run (for example
+one run of the monitor) and passed to the validity classes and the
+``access_utils`` helpers makes each distinct read once.
+
+Reads which raise are not cached, so they are retried by the next caller.
+"""
+
+from collections import defaultdict
+import threading
+
+
+class _Entry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = False
+        self.value = None
+
+
+class GoogleAPICache(object):
+    """
+    Cache of read results by key, shared by any number of threads. A key is
+    a tuple whose first item is the kind of read, e.g.
+    ``("service_account_policy", account)``; hit rates are counted per kind.
+
+    Example:
+
+        cache = GoogleAPICache()
+        policy = cache.get(
+            ("service_account_policy", account),
+            gcm.get_service_account_policy,
+            account,
+        )
+        logger.info(cache.report())
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def get(self, key, read, *args, **kwargs):
+        """
+        Return the cached result for ``key``, or call ``read(*args,
+        **kwargs)`` and cache its result. Concurrent callers with the same
+        key wait for the first one's read instead of reading again.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+        with entry.lock:
+            hit = entry.done
+            if not hit:
+                entry.value = read(*args, **kwargs)
+                entry.done = True
+            value = entry.value
+        with self._lock:
+            if hit:
+                self.hits[key[0]] += 1
+            else:
+                self.misses[key[0]] += 1
+        return value
+
+    def report(self):
+        """
+        Return the hit rate of each kind of read, as a line for the logs.
+        """
+        with self._lock:
+            kinds = sorted(set(self.hits) | set(self.misses))
+            rates = []
+            for kind in kinds:
+                hits = self.hits[kind]
+                reads = hits + self.misses[kind]
+                rates.append(
+                    "{} {}/{} ({:.0%})".format(kind, hits, reads, float(hits) / reads)
+                )
+        return "Google API cache hits: {}".format(", ".join(rates) or "none")
+
+
+def cached_read(cache, key, read, *args, **kwargs):
+    """
+    ``cache.get(key, read, *args, **kwargs)`` if there is a ``cache``,
+    otherwise just ``read(*args, **kwargs)``.
+    """
+    if cache is None:
+        return read(*args, **kwargs)
+    return cache.get(key, read, *args, **kwargs)
@@ -1,10 +1,13 @@
+from collections import OrderedDict
 import time
 import json
 import os
+import threading
 from cryptography.fernet import Fernet
 import flask
 from flask_sqlalchemy_session import current_session
 from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
 
 from cirrus import GoogleCloudManager
 from cirrus.google_cloud.iam import GooglePolicyMember
@@ -31,6 +34,78 @@ from userdatamodel.user import GoogleProxyGroup, User, AccessPrivilege
 from fence.errors import NotSupported, NotFound
 
 
+class UrlSigningKeyCache(object):
+    """
+    In-memory cache of users' decrypted primary service account keys, which
+    are used for signing Google Storage urls.
+
+    Entries stop being returned ``expiration_buffer`` seconds before the key
+    expires, so a key is never handed out after the scheduled cleanup
+    (``fence-create google-manage-keys``) may have deleted it. Keys rotated or
+    deleted through this process are replaced/invalidated explicitly.
+
+    Invalidation only reaches the cache of the current process, so a key
+    deleted through another worker process is still handed out by this one
+    until its entry is ``ttl`` seconds old. The ttl is kept well below the
+    lifetime of the keys (days) to bound that window to a few minutes.
+    """
+
+    def __init__(self, max_size=10000, expiration_buffer=300, ttl=300):
+        self.max_size = max_size
+        self.expiration_buffer = expiration_buffer
+        self.ttl = ttl
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, min_expiration=None):
+        """
+        Return the cached private key for the user, or None if there isn't one
+        that stays valid past ``min_expiration`` (unix time).
+        """
+        now = int(time.time())
+        min_expiration = min_expiration or now
+        entry = self._keys.get(str(user_id))
+        if not entry:
+            return None
+        private_key, _, expires, cached_until = entry
+        if cached_until <= now or expires - self.expiration_buffer < min_expiration:
+            return None
+        return private_key
+
+    def set(self, user_id, private_key, key_id, expires):
+        if not expires:
+            return
+        with self._lock:
+            self._keys.pop(str(user_id), None)
+            self._keys[str(user_id)] = (
+                private_key,
+                key_id,
+                expires,
+                int(time.time()) + self.ttl,
+            )
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def invalidate(self, user_id=None, key_id=None):
+        """
+        Drop the cached key for the given user and/or with the given key id.
+        """
+        with self._lock:
+            if user_id is not None:
+                self._keys.pop(str(user_id), None)
+            if key_id is not None:
+                for cached_user_id, entry in list(self._keys.items()):
+                    if entry[1] == key_id:
+                        self._keys.pop(cached_user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+url_signing_key_cache = UrlSigningKeyCache()
+
+
 def get_or_create_primary_service_account_key(
     user_id, username, proxy_group_id, expires=None
 ):
@@ -70,6 +145,12 @@ def get_or_create_primary_service_account_key(
             str(user_service_account_key.private_key)
         )
         sa_private_key = json.loads(private_key_bytes.decode("utf-8"))
+        url_signing_key_cache.set(
+            user_id,
+            sa_private_key,
+            user_service_account_key.key_id,
+            user_service_account_key.expires,
+        )
     else:
         sa_private_key = create_primary_service_account_key(
             user_id, username, proxy_group_id, expires
@@ -147,6 +228,7 @@ def create_primary_service_account_key(user_id, username, proxy_group_id, expire
     add_custom_service_account_key_expiration(
         key_id, service_account.id, expires, private_key=private_key
     )
+    url_signing_key_cache.set(user_id, sa_private_key, key_id, expires)
 
     return sa_private_key
 
@@ -554,21 +636,39 @@ def get_project_access_from_service_accounts(service_accounts, db=None):
 
     Returns a list of Project objects
     """
-    session = get_db_session(db)
+    project_access = get_project_access_by_service_account(service_accounts, db=db)
+    return [
+        project
+        for service_account in service_accounts
+        for project in project_access[service_account.id]
+    ]
+
+
+def get_project_access_by_service_account(service_accounts, db=None):
+    """
+    Get the projects each of the provided service accounts (UserServiceAccount
+    db objects) has access to, in one query.
+
+    Returns:
+        dict: service account id -> list of Project objects
+    """
+    project_access = {service_account.id: [] for service_account in service_accounts}
+    if not project_access:
+        return project_access
 
-    projects = []
-    for service_account in service_accounts:
-        access = [
-            access_privilege.project
-            for access_privilege in (
-                session.query(ServiceAccountAccessPrivilege)
-                .filter_by(service_account_id=service_account.id)
-                .all()
+    session = get_db_session(db)
+    access_privileges = (
+        session.query(ServiceAccountAccessPrivilege)
+        .options(joinedload(ServiceAccountAccessPrivilege.project))
+        .filter(ServiceAccountAccessPrivilege.service_account_id.in_(project_access))
+        .all()
+    )
+    for access_privilege in access_privileges:
+        if access_privilege.project is not None:
+            project_access[access_privilege.service_account_id].append(
+                access_privilege.project
             )
-            if access_privilege.project is not None
-        ]
-        projects.extend(access)
-    return list(projects)
+    return project_access
 
 
 def get_service_account_ids_from_google_members(members):
@@ -604,9 +704,20 @@ def get_users_from_google_members(members, db=None):
     Raises:
         NotFound: Member on google project doesn't exist in our db
     """
+    emails = {member.email_id.lower().strip() for member in members}
+    users_by_email = {}
+    if emails:
+        session = get_db_session(db)
+        users_by_email = dict(
+            session.query(UserGoogleAccount.email, User)
+            .join(User, User.id == UserGoogleAccount.user_id)
+            .filter(UserGoogleAccount.email.in_(emails))
+            .all()
+        )
+
     result = []
     for member in members:
-        user = get_user_from_google_member(member, db=db)
+        user = users_by_email.get(member.email_id.lower().strip())
         if user:
             result.append(user)
         else:
@@ -632,17 +743,12 @@ def get_user_from_google_member(member, db=None):
     """
     session = get_db_session(db)
 
-    linked_google_account = (
-        session.query(UserGoogleAccount)
+    return (
+        session.query(User)
+        .join(UserGoogleAccount, UserGoogleAccount.user_id == User.id)
         .filter(UserGoogleAccount.email == member.email_id.lower().strip())
         .first()
     )
-    if linked_google_account:
-        return (
-            session.query(User).filter(User.id == linked_google_account.user_id).first()
-        )
-
-    return None
 
 
 def get_monitoring_service_account_email(app_creds_file=None):
@@ -682,8 +788,22 @@ def is_google_managed_service_account(
     return service_account_domain in google_managed_service_account_domains
 
 
+#: SQLAlchemyDriver for each database url ``get_db_session`` was called with.
+_db_drivers = {}
+_db_drivers_lock = threading.Lock()
+
+
 def get_db_session(db=None):
+    """
+    Return a new session on the database at url ``db``, or the flask session
+    if there is no ``db``. The driver (engine and connection pool) for a url
+    is created on first use and shared by the later sessions.
+    """
     if db:
-        return SQLAlchemyDriver(db).Session()
+        with _db_drivers_lock:
+            driver = _db_drivers.get(db)
+            if driver is None:
+                driver = _db_drivers[db] = SQLAlchemyDriver(db)
+        return driver.Session()
     else:
         return current_session
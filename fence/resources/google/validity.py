@@ -171,6 +171,7 @@ class GoogleProjectValidity(ValidityInfo):
         new_service_account_access=None,
         user_id=None,
         google_cloud_manager=None,
+        cache=None,
         *args,
         **kwargs
     ):
@@ -188,6 +189,8 @@ class GoogleProjectValidity(ValidityInfo):
                 access to
             user_id (None, optional): User requesting validation. ONLY pass this if you
                 want to check if the user is a member of this project.
+            cache (GoogleAPICache, optional): cache of Google API reads, to
+                share them with other validity checks in the same run
         """
         self.google_project_id = google_project_id
         self.new_service_account = new_service_account
@@ -196,6 +199,7 @@ class GoogleProjectValidity(ValidityInfo):
         self.google_cloud_manager = google_cloud_manager or GoogleCloudManager(
             google_project_id
         )
+        self.cache = cache
 
         super(GoogleProjectValidity, self).__init__(*args, **kwargs)
 
@@ -238,7 +242,7 @@ class GoogleProjectValidity(ValidityInfo):
             "for project id {}".format(self.google_project_id)
         )
         google_project_number = get_google_project_number(
-            self.google_project_id, self.google_cloud_manager
+            self.google_project_id, self.google_cloud_manager, cache=self.cache
         )
         has_access = bool(google_project_number)
 
@@ -259,7 +263,7 @@ class GoogleProjectValidity(ValidityInfo):
             "for project id {}".format(self.google_project_id)
         )
         membership = get_google_project_membership(
-            self.google_project_id, self.google_cloud_manager
+            self.google_project_id, self.google_cloud_manager, cache=self.cache
         )
         logger.debug("Project Members: {}".format(str(membership)))
 
@@ -289,7 +293,9 @@ class GoogleProjectValidity(ValidityInfo):
             "Retrieving Parent Organization "
             "for project id {} to make sure it's valid".format(self.google_project_id)
         )
-        parent_org = get_google_project_parent_org(self.google_cloud_manager)
+        parent_org = get_google_project_parent_org(
+            self.google_cloud_manager, cache=self.cache
+        )
         valid_parent_org = True
 
         # if there is an org, let's remove whitelisted orgs and then check validity
@@ -364,6 +370,7 @@ class GoogleProjectValidity(ValidityInfo):
                 self.google_project_id,
                 google_project_number=google_project_number,
                 google_cloud_manager=self.google_cloud_manager,
+                cache=self.cache,
             )
 
             service_account_id = str(self.new_service_account)
@@ -589,6 +596,7 @@ class GoogleProjectValidity(ValidityInfo):
             self.google_project_id,
             google_project_number=google_project_number,
             google_cloud_manager=self.google_cloud_manager,
+            cache=self.cache,
         )
 
         logger.debug(
@@ -679,6 +687,7 @@ class GoogleServiceAccountValidity(ValidityInfo):
         google_project_id,
         google_cloud_manager=None,
         google_project_number=None,
+        cache=None,
         *args,
         **kwargs
     ):
@@ -690,6 +699,8 @@ class GoogleServiceAccountValidity(ValidityInfo):
         self.google_cloud_manager = google_cloud_manager or GoogleCloudManager(
             google_project_id
         )
+        # cache of Google API reads shared with other checks in the same run
+        self.cache = cache
         super(GoogleServiceAccountValidity, self).__init__(*args, **kwargs)
 
         # setup default values for error information, will get updated in
@@ -770,7 +781,9 @@ class GoogleServiceAccountValidity(ValidityInfo):
         if check_policy_accessible:
             try:
                 policy_accessible = True
-                sa_policy = get_service_account_policy(self.account_id, gcm)
+                sa_policy = get_service_account_policy(
+                    self.account_id, gcm, cache=self.cache
+                )
             except NotFound:
                 policy_accessible = False
                 gcm.close()
@@ -791,7 +804,9 @@ class GoogleServiceAccountValidity(ValidityInfo):
                 return
 
             no_external_access = not (
-                service_account_has_external_access(self.account_id, gcm, sa_policy)
+                service_account_has_external_access(
+                    self.account_id, gcm, sa_policy, cache=self.cache
+                )
             )
             self.set("no_external_access", no_external_access)
             if not no_external_access:
@@ -815,7 +830,9 @@ class GoogleServiceAccountValidity(ValidityInfo):
                 # don't return early, we can still check type without checking
                 # policy, however, if the SA doesn't exist, this will fail
 
-            valid_type = is_valid_service_account_type(self.account_id, gcm)
+            valid_type = is_valid_service_account_type(
+                self.account_id, gcm, cache=self.cache
+            )
 
             self.set("valid_type", valid_type)
             if not valid_type:
@@ -1,6 +1,10 @@
+from collections import namedtuple
 import copy
 from functools import wraps
+import random
+import time
 
+from sqlalchemy import func
 from storageclient import get_client
 
 from fence.models import (
@@ -13,7 +17,9 @@ from fence.models import (
     query_for_user,
 )
 from fence.errors import NotSupported, InternalError, Unauthorized, NotFound
+from fence.permissions import get_user_permission_index
 from fence.resources.google import STORAGE_ACCESS_PROVIDER_NAME as GOOGLE_PROVIDER
+from fence.utils import RateLimiter, bounded_imap
 
 
 def check_exist(f):
@@ -30,6 +36,73 @@ def check_exist(f):
 #       ex: delete-storage
 PRIVILEGES = ["read-storage", "write-storage", "admin"]
 
+#: Attempts made at a storage API call which fails with a 429 or 5xx status.
+MAX_ATTEMPTS = 5
+#: Seconds to wait before the first retry of a failed call, doubled for every
+#: retry after it up to ``BACKOFF_MAX``. The actual wait is jittered.
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 32.0
+
+#: Number of users looked up per database query.
+QUERY_BATCH_SIZE = 1000
+
+
+class AccessChange(
+    namedtuple("AccessChange", ["provider", "username", "project", "access"])
+):
+    """
+    Access of a user to the buckets of a project in a storage provider, to be
+    applied by ``StorageManager.apply_access_changes``. ``access`` is the
+    list of privileges to grant, or None to revoke access.
+    """
+
+    __slots__ = ()
+
+
+class _AclCall(object):
+    """
+    A bucket ACL (for Google, access group membership) change for one storage
+    user, coalesced from the ``AccessChange`` items at ``changes`` indexes.
+    """
+
+    def __init__(self, provider, target, storage_user, storage_username):
+        self.provider = provider
+        self.target = target
+        self.storage_user = storage_user
+        self.storage_username = storage_username
+        self.add = False
+        self.access = None
+        self.access_group = None
+        self.changes = []
+
+
+def _get_status_code(error):
+    """
+    Return the HTTP status of a failed storage API call, or None.
+    """
+    # googleapiclient HttpError
+    resp = getattr(error, "resp", None)
+    if getattr(resp, "status", None):
+        return int(resp.status)
+    response = getattr(error, "response", None)
+    # botocore ClientError
+    if isinstance(response, dict):
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    # requests HTTPError
+    if getattr(response, "status_code", None):
+        return response.status_code
+    for attribute in ("status_code", "code"):
+        try:
+            return int(getattr(error, attribute))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return None
+
+
+def _is_retryable(error):
+    status = _get_status_code(error)
+    return status is not None and (status == 429 or 500 <= status < 600)
+
 
 def get_endpoints_descriptions(providers, session):
     desc = {}
@@ -50,6 +123,7 @@ class StorageManager(object):
     def __init__(self, credentials, logger):
         self.logger = logger
         self.clients = {}
+        self.rate_limiters = {}
         for provider, config in credentials.iteritems():
             if "backend" not in config:
                 self.logger.error(
@@ -59,6 +133,13 @@ class StorageManager(object):
                 )
                 raise InternalError("Something went wrong")
 
+            config = copy.deepcopy(config)
+            # optional limit on the rate of API calls made to the provider by
+            # ``apply_access_changes``
+            requests_per_second = config.pop("requests_per_second", None)
+            if requests_per_second:
+                self.rate_limiters[provider] = RateLimiter(requests_per_second)
+
             backend = config["backend"]
             creds = copy.deepcopy(config)
             del creds["backend"]
@@ -68,17 +149,7 @@ class StorageManager(object):
         """
         check if the user should be authorized to storage resources
         """
-        storage_access = any(
-            ["read-storage" in item for item in user.project_access.values()]
-        )
-        backend_access = any(
-            [
-                sa.provider.name == provider
-                for p in user.projects.values()
-                for sa in p.storage_access
-            ]
-        )
-        if storage_access and backend_access:
+        if get_user_permission_index(user).can_access_storage(provider):
             return True
         else:
             raise Unauthorized("Your are not authorized")
@@ -191,6 +262,240 @@ class StorageManager(object):
                     b, provider, storage_user, storage_username, session
                 )
 
+    def apply_access_changes(self, changes, session, max_workers=1):
+        """
+        Grant and revoke access to the buckets of projects in bulk.
+
+        Each storage user is looked up once, and the changes to the same
+        bucket (for Google, bucket access group) for the same user are
+        coalesced into one API call, a grant winning over a revoke. The calls
+        are made from ``max_workers`` threads, within the
+        ``requests_per_second`` limit configured for each provider, and
+        retried with exponential backoff when they fail with a 429 or 5xx
+        status.
+
+        The Google proxy group to bucket access group entries are added to or
+        deleted from ``session`` for the calls which succeeded only. The
+        session is not committed.
+
+        Unlike ``grant_access``, a Google user missing from the database (or a
+        Google bucket without access groups) fails the change instead of
+        raising.
+
+        Args:
+            changes (Iterable[AccessChange]): changes to apply
+            session (sqlalchemy.orm.session.Session): fence's db session
+            max_workers (int): number of threads making storage API calls
+
+        Return:
+            List[AccessChange]: the changes which were not (fully) applied
+        """
+        changes = list(changes)
+        for change in changes:
+            if change.provider not in self.clients:
+                raise NotSupported("This backend is not supported by the system!")
+
+        storage_users = self._get_storage_users(changes, session, max_workers)
+
+        # (provider, bucket name or access group email, storage username) -> call
+        calls = {}
+        failed = set()
+        for i, change in enumerate(changes):
+            storage_user = storage_users[(change.provider, change.username.lower())]
+            if isinstance(storage_user, Exception):
+                failed.add(i)
+                continue
+            if storage_user is None:
+                if change.access is not None:
+                    self.logger.error(
+                        "User not found with username {}. For Google Storage "
+                        "Backend user's must already exist in the db and have "
+                        "a Google Proxy Group.".format(change.username)
+                    )
+                    failed.add(i)
+                continue
+            storage_username = StorageManager._get_storage_username(
+                storage_user, change.provider
+            )
+            if not storage_username:
+                continue
+
+            def plan(target, add, access=None, access_group=None):
+                key = (change.provider, target, storage_username)
+                if key not in calls:
+                    calls[key] = _AclCall(
+                        change.provider, target, storage_user, storage_username
+                    )
+                call = calls[key]
+                call.changes.append(i)
+                call.access_group = access_group
+                if add:
+                    call.add = True
+                    if access is not None:
+                        call.access = (call.access or set()) | set(access)
+
+            for bucket in change.project.buckets:
+                if change.provider != GOOGLE_PROVIDER:
+                    if change.access is None:
+                        plan(bucket.name, add=False)
+                    else:
+                        plan(
+                            bucket.name,
+                            add=True,
+                            access=self._get_valid_access_privileges(change.access),
+                        )
+                    continue
+
+                if change.access is not None and not bucket.google_bucket_access_groups:
+                    self.logger.error(
+                        "Google bucket {} does not have any access groups.".format(
+                            bucket.name
+                        )
+                    )
+                    failed.add(i)
+                    continue
+                access = StorageManager._get_bucket_access_privileges(
+                    change.access or []
+                )
+                for bucket_access_group in bucket.google_bucket_access_groups:
+                    bucket_privileges = bucket_access_group.privileges or []
+                    # NOTE: the "bucket" of a Google ACL call is the Google
+                    #       Access Group's email address. A user whose
+                    #       privileges no longer cover a group (e.g. went from
+                    #       read & write to read) is removed from it.
+                    plan(
+                        bucket_access_group.email,
+                        add=(
+                            change.access is not None
+                            and set(bucket_privileges).issubset(access)
+                        ),
+                        access_group=bucket_access_group,
+                    )
+
+        def apply_call(call):
+            if call.add and call.access is not None:
+                self._call_with_backoff(
+                    call.provider,
+                    "add_bucket_acl",
+                    call.target,
+                    call.storage_username,
+                    access=sorted(call.access),
+                )
+            elif call.add:
+                self._call_with_backoff(
+                    call.provider, "add_bucket_acl", call.target, call.storage_username
+                )
+            else:
+                self._call_with_backoff(
+                    call.provider,
+                    "delete_bucket_acl",
+                    call.target,
+                    call.storage_username,
+                )
+
+        calls = calls.values()
+        succeeded = []
+        results = bounded_imap(apply_call, calls, max_workers)
+        for call, result in zip(calls, results):
+            if isinstance(result, Exception):
+                self.logger.error(
+                    "could not {} {} {} {} in {}: {}".format(
+                        "add" if call.add else "remove",
+                        call.storage_username,
+                        "to" if call.add else "from",
+                        call.target,
+                        call.provider,
+                        result,
+                    )
+                )
+                failed.update(call.changes)
+                continue
+            if call.access_group is not None:
+                self.logger.info(
+                    "User {}'s Google proxy group ({}) {} Google Bucket Access "
+                    "Group {}.".format(
+                        call.storage_user.email,
+                        call.storage_username,
+                        "added to" if call.add else "removed from",
+                        call.target,
+                    )
+                )
+                succeeded.append(call)
+
+        self._update_google_db_entries_for_bucket_access(succeeded, session)
+        return [changes[i] for i in sorted(failed)]
+
+    def _get_storage_users(self, changes, session, max_workers):
+        """
+        Look up the storage users of ``changes``: Google users in fence's db
+        in batches, other users with the provider's client (created if access
+        is granted to them) from ``max_workers`` threads.
+
+        Return:
+            dict: (provider, lowercased username) -> user, None if there is
+            none, or the exception raised looking them up
+        """
+        storage_users = {}
+        google_usernames = set()
+        # (provider, lowercased username) -> (username, whether to create)
+        lookups = {}
+        for change in changes:
+            key = (change.provider, change.username.lower())
+            if change.provider == GOOGLE_PROVIDER:
+                google_usernames.add(key[1])
+                storage_users[key] = None
+            else:
+                create = lookups.get(key, (None, False))[1]
+                lookups[key] = (change.username, create or change.access is not None)
+
+        google_usernames = sorted(google_usernames)
+        for start in range(0, len(google_usernames), QUERY_BATCH_SIZE):
+            batch = google_usernames[start : start + QUERY_BATCH_SIZE]
+            users = session.query(User).filter(func.lower(User.username).in_(batch))
+            for user in users:
+                storage_users[(GOOGLE_PROVIDER, user.username.lower())] = user
+
+        def lookup(item):
+            (provider, _), (username, create) = item
+            method = "get_or_create_user" if create else "get_user"
+            return self._call_with_backoff(provider, method, username)
+
+        lookups = lookups.items()
+        for (key, (username, _)), result in zip(
+            lookups, bounded_imap(lookup, lookups, max_workers)
+        ):
+            if isinstance(result, Exception):
+                self.logger.error(
+                    "could not get user {} in {}: {}".format(username, key[0], result)
+                )
+            storage_users[key] = result
+        return storage_users
+
+    def _call_with_backoff(self, provider, method, *args, **kwargs):
+        """
+        Call ``method`` of the client for ``provider`` within the provider's
+        rate limit, retrying with jittered exponential backoff if it fails
+        with a 429 or 5xx status.
+        """
+        rate_limiter = self.rate_limiters.get(provider)
+        delay = BACKOFF_BASE
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            if rate_limiter:
+                rate_limiter.acquire()
+            try:
+                return getattr(self.clients[provider], method)(*args, **kwargs)
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS or not _is_retryable(e):
+                    raise
+                wait = random.uniform(delay / 2, delay)
+                self.logger.warning(
+                    "{} in {} failed ({}), retrying in {:.1f}s".format(
+                        method, provider, e, wait
+                    )
+                )
+                time.sleep(wait)
+                delay = min(delay * 2, BACKOFF_MAX)
+
     @check_exist
     def has_bucket_access(self, provider, user, bucket, access):
         """
@@ -437,6 +742,35 @@ class StorageManager(object):
         session.add(storage_user_access_db_entry)
         session.commit()
 
+    @staticmethod
+    def _update_google_db_entries_for_bucket_access(calls, session):
+        """
+        Add or delete the db entries of the proxy groups added to or removed
+        from Google bucket access groups by ``calls``, with the existing
+        entries loaded in batches.
+        """
+        proxy_group_ids = sorted(
+            {call.storage_user.google_proxy_group_id for call in calls}
+        )
+        entries = {}
+        for start in range(0, len(proxy_group_ids), QUERY_BATCH_SIZE):
+            batch = proxy_group_ids[start : start + QUERY_BATCH_SIZE]
+            query = session.query(GoogleProxyGroupToGoogleBucketAccessGroup).filter(
+                GoogleProxyGroupToGoogleBucketAccessGroup.proxy_group_id.in_(batch)
+            )
+            for entry in query:
+                entries[(entry.proxy_group_id, entry.access_group_id)] = entry
+
+        for call in calls:
+            key = (call.storage_user.google_proxy_group_id, call.access_group.id)
+            if call.add and key not in entries:
+                entries[key] = GoogleProxyGroupToGoogleBucketAccessGroup(
+                    proxy_group_id=key[0], access_group_id=key[1]
+                )
+                session.add(entries[key])
+            elif not call.add and key in entries:
+                session.delete(entries.pop(key))
+
     # FIXME: create a delete() on GoogleProxyGroupToGoogleBucketAccessGroup and use here.
     #        previous attempts to use similar delete() calls on other models resulting in errors
     #        with mismatched sessions during testing
@@ -186,6 +186,11 @@ def sync_users(
     sync_from_local_csv_dir=None,
     sync_from_local_yaml_file=None,
     arborist=None,
+    full_sync=False,
+    chunk_size=1000,
+    max_chunk_seconds=None,
+    storage_workers=8,
+    stream_user_yaml=False,
 ):
     """
     sync ACL files from dbGap to auth db and storage backends
@@ -195,6 +200,11 @@ def sync_users(
     Args:
         projects: path to project_mapping yaml file which contains mapping
         from dbgap phsids to projects in fence database
+        full_sync: ignore the state saved by the last sync
+        chunk_size: maximum number of users or accesses changed per transaction
+        max_chunk_seconds: target duration of each transaction
+        storage_workers: number of threads changing access in storage backends
+        stream_user_yaml: read the user.yaml one user at a time
     Returns:
         None
     Examples:
@@ -245,6 +255,11 @@ def sync_users(
         sync_from_local_csv_dir=sync_from_local_csv_dir,
         sync_from_local_yaml_file=sync_from_local_yaml_file,
         arborist=arborist,
+        full_sync=full_sync,
+        chunk_size=chunk_size,
+        max_chunk_seconds=max_chunk_seconds,
+        storage_workers=storage_workers,
+        stream_user_yaml=stream_user_yaml,
     )
     syncer.sync()
 
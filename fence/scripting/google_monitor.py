@@ -5,10 +5,22 @@ This file contains scripts to monitor user-registered service accounts and
 their respective Google projects. The functions in this file will also
 handle invalid service accounts and projects.
 """
+from collections import namedtuple
+import hashlib
+import json
+import time
 import traceback
 from cirrus.google_cloud.iam import GooglePolicyMember
 from cirrus import GoogleCloudManager
 
+from fence.models import (
+    AccessPrivilege,
+    GoogleProjectValidation,
+    ServiceAccountAccessPrivilege,
+    UserGoogleAccount,
+    UserServiceAccount,
+)
+from fence.resources.google.cache import GoogleAPICache, cached_read
 from fence.resources.google.validity import (
     GoogleProjectValidity,
     GoogleServiceAccountValidity,
@@ -16,11 +28,14 @@ from fence.resources.google.validity import (
 
 from fence.resources.google.utils import (
     get_all_registered_service_accounts,
+    get_db_session,
     is_google_managed_service_account,
 )
 
 from fence.resources.google.access_utils import (
+    get_google_project_membership,
     get_google_project_number,
+    get_service_account_policy,
     force_remove_service_account_from_access,
     force_remove_service_account_from_db,
 )
@@ -31,6 +46,18 @@ from cdislogging import get_logger
 
 logger = get_logger(__name__)
 
+#: Default number of Google projects validated concurrently.
+GOOGLE_MONITOR_WORKERS = 8
+
+#: Settings the validation of a Google project depends on.
+_VALIDATION_SETTINGS = (
+    "GOOGLE_MANAGED_SERVICE_ACCOUNT_DOMAINS",
+    "WHITE_LISTED_GOOGLE_PARENT_ORGS",
+    "WHITE_LISTED_SERVICE_ACCOUNT_EMAILS",
+)
+
+_Validation = namedtuple("_Validation", ["fingerprint", "validated"])
+
 
 def validation_check(db, config=None):
     """
@@ -41,133 +68,410 @@ def validation_check(db, config=None):
     remove all registered service accounts for a given project if the project
     itself is invalid.
 
+    Google projects are validated concurrently by ``GOOGLE_MONITOR_WORKERS``
+    threads (from ``config``), each project with its own
+    ``GoogleCloudManager``. The calls to the Google API made through those
+    managers are limited to ``GOOGLE_API_REQUESTS_PER_SECOND`` across all
+    threads, if set.
+
+    Google API reads are cached for the length of the run, so data shared by
+    several checks is only read once; the hit rates are logged at the end.
+
+    If ``GOOGLE_MONITOR_MAX_VALIDATION_AGE`` (seconds) is set, projects found
+    valid are remembered with a fingerprint of their IAM membership, the IAM
+    policy etags of their registered service accounts and the data access of
+    their members in fence. A project whose fingerprint didn't change is only
+    validated again once its last validation is older than that.
+
     NOTE: This entire function should be time-efficient and finish in less
           than 90 seconds.
           TODO: Test this function with various amounts of service accounts
                 and delays from the google API
     """
+    config = config or {}
     registered_service_accounts = get_all_registered_service_accounts(db=db)
     project_service_account_mapping = _get_project_service_account_mapping(
         registered_service_accounts
     )
 
-    for google_project_id, sa_emails in project_service_account_mapping.iteritems():
-        email_required = False
-        invalid_registered_service_account_reasons = {}
-        invalid_project_reasons = {}
-        sa_emails_removed = []
-        for sa_email in sa_emails:
-            logger.debug("Validating Google Service Account: {}".format(sa_email))
-            # Do some basic service account checks, this won't validate
-            # the data access, that's done when the project's validated
-            try:
-                validity_info = _is_valid_service_account(
-                    sa_email, google_project_id, config=config
-                )
-            except Unauthorized:
-                """
-                is_validity_service_account can raise an exception if the monitor does
-                not have access, which will be caught and handled during the Project check below
-                The logic in the endpoints is reversed (Project is checked first,
-                not SAs) which is why there's is a sort of weird handling of it here.
-                """
-                logger.info(
-                    "Monitor does not have access to validate "
-                    "service account {}. This should be handled "
-                    "in project validation."
-                )
-                continue
-            if not validity_info:
-                logger.info(
-                    "INVALID SERVICE ACCOUNT {} DETECTED. REMOVING. Validity Information: {}".format(
-                        sa_email, str(getattr(validity_info, "_info", None))
-                    )
-                )
-                force_remove_service_account_from_access(
-                    sa_email, google_project_id, db=db
+    # without a db url, the db is reached through the flask session, which
+    # only works in the current thread
+    max_workers = config.get("GOOGLE_MONITOR_WORKERS", GOOGLE_MONITOR_WORKERS)
+    if not db:
+        max_workers = 1
+    limiter = None
+    if config.get("GOOGLE_API_REQUESTS_PER_SECOND"):
+        limiter = utils.RateLimiter(config["GOOGLE_API_REQUESTS_PER_SECOND"])
+    cache = GoogleAPICache()
+    max_age = config.get("GOOGLE_MONITOR_MAX_VALIDATION_AGE")
+    validations = _get_google_project_validations(db=db) if max_age else {}
+    new_validations = {}
+
+    def validate(item):
+        google_project_id, sa_emails = item
+        try:
+            new_validations[google_project_id] = _validate_google_project(
+                google_project_id,
+                sa_emails,
+                db=db,
+                config=config,
+                limiter=limiter,
+                cache=cache,
+                validation=validations.get(google_project_id),
+                max_age=max_age,
+            )
+        except Exception as exc:
+            logger.error(
+                "Could not validate Google Project {}: {}".format(
+                    google_project_id, str(exc)
                 )
-                if validity_info["policy_accessible"] is False:
-                    logger.info(
-                        "SERVICE ACCOUNT POLICY NOT ACCESSIBLE OR DOES NOT "
-                        "EXIST. SERVICE ACCOUNT WILL BE REMOVED FROM FENCE DB"
-                    )
-                    force_remove_service_account_from_db(sa_email, db=db)
-
-                # remove from list so we don't try to remove again
-                # if project is invalid too
-                sa_emails_removed.append(sa_email)
-
-                invalid_registered_service_account_reasons[
-                    sa_email
-                ] = _get_service_account_removal_reasons(validity_info)
-                email_required = True
+            )
+            traceback.print_exc()
+            return False
+        return True
+
+    items = project_service_account_mapping.iteritems()
+    if max_workers > 1:
+        results = utils.bounded_imap(validate, items, max_workers, ordered=False)
+    else:
+        results = (validate(item) for item in items)
+    failed = len([result for result in results if result is not True])
+    if failed:
+        logger.error("Could not validate {} Google Projects.".format(failed))
+    logger.info(cache.report())
+    if max_age:
+        _save_google_project_validations(validations, new_validations, db=db)
+
+
+def _validate_google_project(
+    google_project_id,
+    sa_emails,
+    db=None,
+    config=None,
+    limiter=None,
+    cache=None,
+    validation=None,
+    max_age=None,
+):
+    """
+    Validate a Google project and its registered service accounts, remove
+    the invalid ones from access and notify the project's owners.
 
-        for sa_email in sa_emails_removed:
-            sa_emails.remove(sa_email)
+    With a ``max_age``, the project is skipped if its fingerprint is the one
+    of its last ``validation`` and that is less than ``max_age`` seconds old.
 
-        logger.debug("Validating Google Project: {}".format(google_project_id))
-        google_project_validity = _is_valid_google_project(
-            google_project_id, db=db, config=config
-        )
-        if not google_project_validity:
-            # for now, if we detect in invalid project, remove ALL service
-            # accounts from access for that project.
-            #
-            # TODO: If the issue is ONLY a specific service account,
-            # it may be possible to isolate it and only remove that
-            # from access.
+    Args:
+        google_project_id (str): google project id
+        sa_emails (List[str]): the project's registered service accounts
+        limiter (Optional[fence.utils.RateLimiter]): limit on Google API calls
+        cache (Optional[GoogleAPICache]): cache of Google API reads for the run
+        validation (Optional[_Validation]): the project's last validation
+        max_age (Optional[int]): seconds a validation stays good for
+
+    Returns:
+        Optional[_Validation]: the validation to remember for the project, if
+        it is valid
+    """
+    gcm = _RateLimitedCloudManager(GoogleCloudManager(google_project_id), limiter)
+    fingerprint = None
+    if max_age:
+        try:
+            with gcm:
+                fingerprint = _get_google_project_fingerprint(
+                    google_project_id, sa_emails, gcm, db=db, config=config, cache=cache
+                )
+        except Exception as exc:
+            logger.warning(
+                "Could not fingerprint Google Project {}, validating it: {}".format(
+                    google_project_id, str(exc)
+                )
+            )
+        if (
+            fingerprint
+            and validation
+            and validation.fingerprint == fingerprint
+            and time.time() - validation.validated < max_age
+        ):
+            logger.debug(
+                "Google Project {} unchanged since validated at {}, "
+                "skipping.".format(google_project_id, validation.validated)
+            )
+            return validation
+
+    email_required = False
+    invalid_registered_service_account_reasons = {}
+    invalid_project_reasons = {}
+    sa_emails_removed = []
+    for sa_email in sa_emails:
+        logger.debug("Validating Google Service Account: {}".format(sa_email))
+        # Do some basic service account checks, this won't validate
+        # the data access, that's done when the project's validated
+        try:
+            validity_info = _is_valid_service_account(
+                sa_email,
+                google_project_id,
+                config=config,
+                google_cloud_manager=gcm,
+                cache=cache,
+            )
+        except Unauthorized:
+            """
+            is_validity_service_account can raise an exception if the monitor does
+            not have access, which will be caught and handled during the Project check below
+            The logic in the endpoints is reversed (Project is checked first,
+            not SAs) which is why there's is a sort of weird handling of it here.
+            """
+            logger.info(
+                "Monitor does not have access to validate "
+                "service account {}. This should be handled "
+                "in project validation."
+            )
+            continue
+        if not validity_info:
             logger.info(
-                "INVALID GOOGLE PROJECT {} DETECTED. REMOVING ALL SERVICE ACCOUNTS. "
-                "Validity Information: {}".format(
-                    google_project_id,
-                    str(getattr(google_project_validity, "_info", None)),
+                "INVALID SERVICE ACCOUNT {} DETECTED. REMOVING. Validity Information: {}".format(
+                    sa_email, str(getattr(validity_info, "_info", None))
                 )
             )
-            for sa_email in sa_emails:
-                force_remove_service_account_from_access(
-                    sa_email, google_project_id, db=db
+            _acquire(limiter)
+            force_remove_service_account_from_access(sa_email, google_project_id, db=db)
+            if validity_info["policy_accessible"] is False:
+                logger.info(
+                    "SERVICE ACCOUNT POLICY NOT ACCESSIBLE OR DOES NOT "
+                    "EXIST. SERVICE ACCOUNT WILL BE REMOVED FROM FENCE DB"
                 )
+                force_remove_service_account_from_db(sa_email, db=db)
+
+            # remove from list so we don't try to remove again
+            # if project is invalid too
+            sa_emails_removed.append(sa_email)
+
+            invalid_registered_service_account_reasons[
+                sa_email
+            ] = _get_service_account_removal_reasons(validity_info)
+            email_required = True
+
+    for sa_email in sa_emails_removed:
+        sa_emails.remove(sa_email)
+
+    logger.debug("Validating Google Project: {}".format(google_project_id))
+    google_project_validity = _is_valid_google_project(
+        google_project_id, db=db, config=config, google_cloud_manager=gcm, cache=cache
+    )
+    if not google_project_validity:
+        # for now, if we detect in invalid project, remove ALL service
+        # accounts from access for that project.
+        #
+        # TODO: If the issue is ONLY a specific service account,
+        # it may be possible to isolate it and only remove that
+        # from access.
+        logger.info(
+            "INVALID GOOGLE PROJECT {} DETECTED. REMOVING ALL SERVICE ACCOUNTS. "
+            "Validity Information: {}".format(
+                google_project_id, str(getattr(google_project_validity, "_info", None))
+            )
+        )
+        for sa_email in sa_emails:
+            _acquire(limiter)
+            force_remove_service_account_from_access(sa_email, google_project_id, db=db)
+
+        # projects can be invalid for project-related reasons or because
+        # of NON-registered service accounts
+        invalid_project_reasons["general"] = _get_general_project_removal_reasons(
+            google_project_validity
+        )
+        invalid_project_reasons[
+            "non_registered_service_accounts"
+        ] = _get_invalid_sa_project_removal_reasons(google_project_validity)
+        invalid_project_reasons["access"] = _get_access_removal_reasons(
+            google_project_validity
+        )
+        email_required = True
 
-            # projects can be invalid for project-related reasons or because
-            # of NON-registered service accounts
-            invalid_project_reasons["general"] = _get_general_project_removal_reasons(
-                google_project_validity
+    if email_required:
+        logger.debug(
+            "Sending email with service account removal reasons: {} and project "
+            "removal reasons: {}.".format(
+                invalid_registered_service_account_reasons, invalid_project_reasons
             )
-            invalid_project_reasons[
-                "non_registered_service_accounts"
-            ] = _get_invalid_sa_project_removal_reasons(google_project_validity)
-            invalid_project_reasons["access"] = _get_access_removal_reasons(
-                google_project_validity
+        )
+        _acquire(limiter)
+        _send_emails_informing_service_account_removal(
+            _get_user_email_list_from_google_project_with_owner_role(
+                google_project_id, cache=cache
+            ),
+            invalid_registered_service_account_reasons,
+            invalid_project_reasons,
+            google_project_id,
+        )
+
+    if email_required or not fingerprint:
+        return None
+    return _Validation(fingerprint, int(time.time()))
+
+
+def _get_google_project_fingerprint(
+    google_project_id, sa_emails, gcm, db=None, config=None, cache=None
+):
+    """
+    Return a hash of the parts of what a Google project's validation depends
+    on which can be read cheaply: the project's IAM membership, the IAM
+    policy etags of its registered service accounts, the data access of those
+    service accounts and of the project's users in fence, and the settings.
+    ``gcm`` has to be open.
+
+    Changes to the rest (the project's parent organization, the keys and
+    types of its service accounts) are only found once the last validation
+    is too old.
+    """
+    members = sorted(
+        [
+            member.member_type,
+            member.email_id.lower().strip(),
+            sorted(role.name for role in member.roles),
+        ]
+        for member in get_google_project_membership(google_project_id, gcm, cache=cache)
+    )
+    etags = {
+        sa_email: get_service_account_policy(sa_email, gcm, cache=cache)
+        .json()
+        .get("etag")
+        for sa_email in sa_emails
+    }
+
+    session = get_db_session(db)
+    service_account_access = (
+        session.query(
+            UserServiceAccount.email, ServiceAccountAccessPrivilege.project_id
+        )
+        .outerjoin(
+            ServiceAccountAccessPrivilege,
+            ServiceAccountAccessPrivilege.service_account_id == UserServiceAccount.id,
+        )
+        .filter(UserServiceAccount.google_project_id == google_project_id)
+        .all()
+    )
+    user_emails = [
+        email
+        for member_type, email, _ in members
+        if member_type == GooglePolicyMember.USER
+    ]
+    user_access = []
+    if user_emails:
+        user_access = (
+            session.query(UserGoogleAccount.email, AccessPrivilege.project_id)
+            .outerjoin(
+                AccessPrivilege, AccessPrivilege.user_id == UserGoogleAccount.user_id
             )
-            email_required = True
+            .filter(UserGoogleAccount.email.in_(user_emails))
+            .all()
+        )
 
-        if email_required:
-            logger.debug(
-                "Sending email with service account removal reasons: {} and project "
-                "removal reasons: {}.".format(
-                    invalid_registered_service_account_reasons, invalid_project_reasons
+    settings = [(config or {}).get(name) for name in _VALIDATION_SETTINGS]
+    data = [
+        members,
+        etags,
+        sorted(tuple(row) for row in service_account_access),
+        sorted(tuple(row) for row in user_access),
+        settings,
+    ]
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=sorted)).hexdigest()
+
+
+def _get_google_project_validations(db=None):
+    """
+    Return the last validation of each Google project, by project id.
+    """
+    session = get_db_session(db)
+    return {
+        row.google_project_id: _Validation(row.fingerprint, row.validated)
+        for row in session.query(GoogleProjectValidation)
+    }
+
+
+def _save_google_project_validations(validations, new_validations, db=None):
+    """
+    Replace the ``validations`` loaded at the start of the run with the
+    ``new_validations`` of the projects validated in it. Projects which were
+    not found valid, or are not registered anymore, are forgotten.
+    """
+    session = get_db_session(db)
+    for google_project_id in set(validations) | set(new_validations):
+        validation = new_validations.get(google_project_id)
+        if validation == validations.get(google_project_id):
+            continue
+        if validation is None:
+            session.query(GoogleProjectValidation).filter_by(
+                google_project_id=google_project_id
+            ).delete()
+        else:
+            session.merge(
+                GoogleProjectValidation(
+                    google_project_id=google_project_id,
+                    fingerprint=validation.fingerprint,
+                    validated=validation.validated,
                 )
             )
-            _send_emails_informing_service_account_removal(
-                _get_user_email_list_from_google_project_with_owner_role(
-                    google_project_id
-                ),
-                invalid_registered_service_account_reasons,
-                invalid_project_reasons,
-                google_project_id,
-            )
+    session.commit()
+
+
+def _acquire(limiter):
+    if limiter:
+        limiter.acquire()
+
+
+class _RateLimitedCloudManager(object):
+    """
+    Wrap a ``GoogleCloudManager`` so that each call of one of its methods
+    first waits for ``limiter``. Opening and closing the manager is not
+    limited.
+    """
+
+    def __init__(self, manager, limiter=None):
+        self._manager = manager
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attribute = getattr(self._manager, name)
+        if (
+            self._limiter is None
+            or name.startswith("_")
+            or name in ("open", "close")
+            or not callable(attribute)
+        ):
+            return attribute
+
+        def limited(*args, **kwargs):
+            self._limiter.acquire()
+            return attribute(*args, **kwargs)
+
+        return limited
+
+    def __enter__(self):
+        self._manager.__enter__()
+        return self
 
+    def __exit__(self, *args):
+        return self._manager.__exit__(*args)
 
-def _is_valid_service_account(sa_email, google_project_id, config=None):
+
+def _is_valid_service_account(
+    sa_email, google_project_id, config=None, google_cloud_manager=None, cache=None
+):
     """
     Validate the given registered service account and remove if invalid.
 
     Args:
         sa_email(str): service account email
         google_project_id(str): google project id
+        google_cloud_manager(GoogleCloudManager, optional): manager to use
+        cache(GoogleAPICache, optional): cache of Google API reads
     """
-    with GoogleCloudManager(google_project_id) as gcm:
-        google_project_number = get_google_project_number(google_project_id, gcm)
+    manager = google_cloud_manager or GoogleCloudManager(google_project_id)
+    with manager as gcm:
+        google_project_number = get_google_project_number(
+            google_project_id, gcm, cache=cache
+        )
 
     has_access = bool(google_project_number)
     if not has_access:
@@ -178,7 +482,11 @@ def _is_valid_service_account(sa_email, google_project_id, config=None):
 
     try:
         sa_validity = GoogleServiceAccountValidity(
-            sa_email, google_project_id, google_project_number=google_project_number
+            sa_email,
+            google_project_id,
+            google_project_number=google_project_number,
+            google_cloud_manager=google_cloud_manager,
+            cache=cache,
         )
         google_sa_domains = (
             config.get("GOOGLE_MANAGED_SERVICE_ACCOUNT_DOMAINS") if config else None
@@ -214,13 +522,17 @@ def _is_valid_service_account(sa_email, google_project_id, config=None):
     return sa_validity
 
 
-def _is_valid_google_project(google_project_id, db=None, config=None):
+def _is_valid_google_project(
+    google_project_id, db=None, config=None, google_cloud_manager=None, cache=None
+):
     """
     Validate the given google project id and remove all registered service
     accounts under that project if invalid.
     """
     try:
-        project_validity = GoogleProjectValidity(google_project_id)
+        project_validity = GoogleProjectValidity(
+            google_project_id, google_cloud_manager=google_cloud_manager, cache=cache
+        )
         project_validity.check_validity(early_return=True, db=db, config=config)
     except Exception as exc:
         # any issues, assume invalid
@@ -393,12 +705,13 @@ def _get_project_service_account_mapping(registered_service_accounts):
     return output
 
 
-def _get_user_email_list_from_google_project_with_owner_role(project_id):
+def _get_user_email_list_from_google_project_with_owner_role(project_id, cache=None):
     """
     Get a list of emails associated to google project id
 
     Args:
         project_id(str): project id
+        cache(GoogleAPICache, optional): cache of Google API reads
 
     Returns:
         list(str): list of emails belong to the project
@@ -406,7 +719,14 @@ def _get_user_email_list_from_google_project_with_owner_role(project_id):
     """
 
     with GoogleCloudManager(project_id, use_default=False) as prj:
-        members = prj.get_project_membership(project_id)
+        # read with other credentials (use_default=False) than the validity
+        # checks, so cached separately from their reads of the membership
+        members = cached_read(
+            cache,
+            ("project_membership_as_fence", project_id),
+            prj.get_project_membership,
+            project_id,
+        )
         users = [
             member
             for member in members
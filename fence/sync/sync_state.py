@@ -0,0 +1,166 @@
+"""
+State kept between user syncs, so that a sync only parses the access files
+that changed since the last one and writes only the access that differs from
+what the last sync applied, instead of diffing against the whole
+``access_privilege`` table.
+"""
+
+import hashlib
+import json
+import zlib
+
+from fence.models import UserSyncState
+from fence.sync.user_projects import UserProjects
+
+#: Source under which the access applied by the last sync is stored.
+APPLIED_SOURCE = "applied"
+
+#: Source under which the progress of an unfinished sync is stored.
+CHECKPOINT_SOURCE = "checkpoint"
+
+
+def file_fingerprint(filepath, *salt):
+    """
+    Return a hash of the content of a file and of ``salt``, which should hold
+    any settings the result of parsing the file depends on.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(salt, sort_keys=True, default=sorted))
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_json(obj):
+    # sets are stored as sorted lists
+    if isinstance(obj, UserProjects):
+        return obj.to_json()
+    return sorted(obj)
+
+
+def _encode(data):
+    return zlib.compress(json.dumps(data, sort_keys=True, default=_to_json))
+
+
+def _decode(data):
+    return json.loads(zlib.decompress(data))
+
+
+def _decode_user_projects(user_projects):
+    # also reads the nested dicts saved before ``UserProjects``
+    return UserProjects.from_json(user_projects)
+
+
+class SyncState(object):
+    """
+    The sync state in the database.
+
+    Example:
+
+        state = SyncState(sess)
+        fingerprint = file_fingerprint(filepath)
+        result = state.get_parsed(source, fingerprint)
+        if result is None:
+            result = parse(filepath)
+            state.set_parsed(source, fingerprint, result)
+        ...
+        state.save_applied(user_projects, user_info)
+    """
+
+    def __init__(self, sess, full=False):
+        """
+        Args:
+            sess: sqlalchemy session
+            full (bool): ignore the saved state; new state is still saved
+        """
+        self.session = sess
+        self.full = full
+        self._rows = {row.source: row for row in sess.query(UserSyncState)}
+        self._seen = set()
+
+    def _put(self, source, fingerprint, data):
+        row = self._rows.get(source)
+        if row is None:
+            row = self._rows[source] = UserSyncState(source=source)
+            self.session.add(row)
+        row.fingerprint = fingerprint
+        row.data = _encode(data)
+
+    def get_parsed(self, source, fingerprint):
+        """
+        Return the saved result of parsing ``source`` as
+        ``(user_projects, user_info, dbgap_projects)``, or None if it was not
+        saved for a file with this fingerprint.
+        """
+        self._seen.add(source)
+        row = self._rows.get(source)
+        if self.full or row is None or row.fingerprint != fingerprint:
+            return None
+        user_projects, user_info, dbgap_projects = _decode(row.data)
+        return _decode_user_projects(user_projects), user_info, set(dbgap_projects)
+
+    def set_parsed(self, source, fingerprint, result):
+        self._seen.add(source)
+        self._put(source, fingerprint, list(result))
+
+    def get_applied(self):
+        """
+        Return the ``(user_projects, user_info)`` applied by the last sync, or
+        None if there is none.
+        """
+        row = self._rows.get(APPLIED_SOURCE)
+        if self.full or row is None:
+            return None
+        user_projects, user_info = _decode(row.data)
+        return _decode_user_projects(user_projects), user_info
+
+    @staticmethod
+    def plan_fingerprint(user_projects, user_info):
+        """
+        Return a hash identifying the access a sync is applying.
+
+        The hash only depends on the access, not on how ``user_projects``
+        happens to number its projects, and is computed one user at a time.
+        """
+        digest = hashlib.sha256()
+        for username in sorted(user_projects):
+            digest.update(
+                json.dumps(
+                    [username, user_projects[username]], sort_keys=True, default=sorted
+                )
+            )
+        digest.update(json.dumps(user_info, sort_keys=True, default=sorted))
+        return digest.hexdigest()
+
+    def get_checkpoint(self, plan):
+        """
+        Return the ``(phase, last_key)`` recorded by an unfinished sync of the
+        same plan, or None.
+        """
+        row = self._rows.get(CHECKPOINT_SOURCE)
+        if row is None or row.fingerprint != plan:
+            return None
+        phase, last_key = _decode(row.data)
+        if isinstance(last_key, list):
+            last_key = tuple(last_key)
+        return phase, last_key
+
+    def set_checkpoint(self, plan, phase, last_key):
+        """
+        Record that a sync of ``plan`` applied ``phase`` up to and including
+        ``last_key``. Saved with the next commit.
+        """
+        self._put(CHECKPOINT_SOURCE, plan, [phase, last_key])
+
+    def save_applied(self, user_projects, user_info):
+        """
+        Record the access applied by this sync, forget the sources which were
+        not seen and the checkpoint, and commit.
+        """
+        self._put(APPLIED_SOURCE, None, [user_projects, user_info])
+        for source, row in list(self._rows.items()):
+            if source != APPLIED_SOURCE and source not in self._seen:
+                self.session.delete(row)
+                del self._rows[source]
+        self.session.commit()
@@ -1,20 +1,25 @@
+import binascii
 from contextlib import contextmanager
 from csv import DictReader
 import errno
 import glob
+import hashlib
+import multiprocessing
 import os
+from Queue import Queue
 import re
-from StringIO import StringIO
 import subprocess as sp
 import tempfile
 import shutil
+import time
 from stat import S_ISDIR
-import yaml
 
 from cdispyutils.log import get_logger
 import paramiko
 from paramiko.proxy import ProxyCommand
+from sqlalchemy import bindparam, func, tuple_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import subqueryload
 from userdatamodel.driver import SQLAlchemyDriver
 
 from fence.models import (
@@ -25,10 +30,93 @@ from fence.models import (
     Tag,
     User,
     users_to_policies,
-    query_for_user,
 )
 from fence.rbac.client import ArboristClient, ArboristError
-from fence.resources.storage import StorageManager
+from fence.errors import InternalError
+from fence.resources.storage import AccessChange, StorageManager
+from fence.sync.sync_state import SyncState, file_fingerprint
+from fence.sync.user_projects import UserProjects
+from fence.sync.user_yaml import UserYaml
+from fence.utils import bounded_imap
+
+#: Number of rows written per statement when applying access changes.
+DB_BATCH_SIZE = 1000
+
+#: Default number of threads making storage backend API calls.
+STORAGE_WORKERS = 8
+
+#: Default number of files downloaded from the dbGaP server concurrently.
+DOWNLOAD_WORKERS = 4
+
+#: Size of the reads copying a downloaded file.
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+#: Hash used to check downloaded files, one the SFTP ``check-file``
+#: extension supports.
+DOWNLOAD_CHECKSUM = "sha1"
+
+
+def _batches(items, size=DB_BATCH_SIZE):
+    """
+    Split ``items`` into lists of at most ``size``, yielded along with the
+    number of items up to and including the batch.
+    """
+    for start in range(0, len(items), size):
+        batch = items[start : start + size]
+        yield start + len(batch), batch
+
+
+def _changed_access(user_projects, applied_user_projects):
+    """
+    Return the (lowercased username, project auth_id) pairs whose privileges
+    differ between two ``user_projects`` dicts.
+    """
+
+    def by_key(user_projects):
+        return {
+            (username.lower(), auth_id): frozenset(privileges)
+            for username, projects in user_projects.iteritems()
+            for auth_id, privileges in projects.iteritems()
+        }
+
+    new = by_key(user_projects)
+    old = by_key(applied_user_projects)
+    return {key for key in set(new) | set(old) if new.get(key) != old.get(key)}
+
+
+class _IdentityMap(object):
+    """
+    The projects and authorization providers in the database, loaded up front,
+    and users (with their tags) loaded a chunk at a time, so the sync looks
+    them up in memory instead of querying per row. Objects created during the
+    sync are added to it.
+    """
+
+    def __init__(self, sess):
+        self.session = sess
+        self.users = {}
+        self.projects = {project.auth_id: project for project in sess.query(Project)}
+        self.auth_providers = {
+            provider.name: provider for provider in sess.query(AuthorizationProvider)
+        }
+
+    def load_users(self, usernames):
+        """
+        Load the users with the given usernames, matched case-insensitively.
+
+        Return:
+            dict: lowercased username -> user, for all users loaded so far
+        """
+        lowered = sorted({username.lower() for username in usernames})
+        for _, batch in _batches(lowered):
+            query = (
+                self.session.query(User)
+                .options(subqueryload(User.tags))
+                .filter(func.lower(User.username).in_(batch))
+            )
+            for user in query:
+                self.users[user.username.lower()] = user
+        return self.users
 
 
 def _format_policy_id(path, privilege):
@@ -36,23 +124,233 @@ def _format_policy_id(path, privilege):
     return "{}-{}".format(resource, privilege)
 
 
-def download_dir(sftp, remote_dir, local_dir):
+def _arborist_ids(response, *keys):
+    """
+    Return the set of ids listed in an arborist response under the first of
+    ``keys`` it has, as ids or objects with an ``"id"``, or None if the
+    response doesn't list any (for instance because the request failed).
+    """
+    if not isinstance(response, dict) or "error" in response:
+        return None
+    for key in keys:
+        if key in response:
+            return {
+                item["id"] if isinstance(item, dict) else item for item in response[key]
+            }
+    return None
+
+
+def _resource_paths(resources, parent=""):
+    """
+    Return the paths of ``resources`` and all of their subresources. The
+    resources are JSON like in ``ArboristClient.create_resource``, or as
+    listed by arborist, which gives their path and lists subresources by path.
+    """
+    paths = set()
+    for resource in resources:
+        if not isinstance(resource, dict):
+            if not resource.startswith("/"):
+                resource = parent + "/" + resource
+            paths.add(resource)
+            continue
+        path = resource.get("path") or parent + "/" + resource["name"]
+        paths.add(path)
+        paths.update(_resource_paths(resource.get("subresources") or [], path))
+    return paths
+
+
+def list_remote_files(sftp, remote_dir, relative_dir=""):
+    """
+    Recursively list the files under ``remote_dir``.
+
+    Return:
+        List[Tuple[str, str, paramiko.SFTPAttributes]]:
+            remote path, path relative to ``remote_dir`` and attributes of
+            every file
+    """
+    files = []
+    for item in sftp.listdir_attr(remote_dir):
+        remote_path = remote_dir + "/" + item.filename
+        relative_path = os.path.join(relative_dir, item.filename)
+        if S_ISDIR(item.st_mode):
+            files.extend(list_remote_files(sftp, remote_path, relative_path))
+        else:
+            files.append((remote_path, relative_path, item))
+    return files
+
+
+def _file_checksum(path):
+    """
+    Return the ``DOWNLOAD_CHECKSUM`` hex digest of the file at ``path``.
+    """
+    digest = hashlib.new(DOWNLOAD_CHECKSUM)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_BUFFER_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remote_checksum(remote_file):
+    """
+    Return the ``DOWNLOAD_CHECKSUM`` hex digest of an open remote file, or
+    None if the server does not support the ``check-file`` extension.
+    """
+    try:
+        return binascii.hexlify(remote_file.check(DOWNLOAD_CHECKSUM))
+    except IOError:
+        return None
+
+
+def _checksum_path(local_path):
+    return "{}.{}".format(local_path, DOWNLOAD_CHECKSUM)
+
+
+def _is_downloaded(local_path, attributes):
+    """
+    Return whether ``local_path`` has the size and modification time of the
+    remote file with ``attributes``, and still has the checksum recorded when
+    it was downloaded.
+    """
+    try:
+        stat = os.stat(local_path)
+        with open(_checksum_path(local_path)) as f:
+            checksum = f.read().strip()
+    except (IOError, OSError):
+        return False
+    if stat.st_size != attributes.st_size or int(stat.st_mtime) != int(
+        attributes.st_mtime
+    ):
+        return False
+    return _file_checksum(local_path) == checksum
+
+
+def download_file(sftp, remote_path, local_path, attributes):
+    """
+    Download a remote file with ``attributes`` to ``local_path``, unless it
+    is there already with the same size, modification time and checksum.
+
+    The file is written to a partial file named after the remote size and
+    modification time, so that a transfer interrupted earlier resumes where
+    it stopped unless the remote file changed since. The downloaded file must
+    have the remote size and, if the server can compute it, the remote
+    checksum; a resumed download which doesn't is downloaded again from the
+    start. The file is only moved to ``local_path`` (with the remote
+    modification time) once complete, and its checksum is written next to it
+    to check the copy on the next download.
+
+    Return:
+        bool: whether the file was downloaded
+
+    Raises:
+        IOError: if the downloaded file doesn't have the remote size or
+            checksum
+    """
+    if _is_downloaded(local_path, attributes):
+        return False
+
+    directory = os.path.dirname(local_path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    partial_path = "{}.{}-{}.part".format(
+        local_path, attributes.st_size, int(attributes.st_mtime)
+    )
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    if offset > attributes.st_size:
+        offset = 0
+
+    with sftp.open(remote_path, "rb") as remote_file:
+        while True:
+            remote_file.seek(offset)
+            remote_file.prefetch()
+            with open(partial_path, "ab" if offset else "wb") as local_file:
+                shutil.copyfileobj(remote_file, local_file, DOWNLOAD_BUFFER_SIZE)
+
+            size = os.path.getsize(partial_path)
+            if size != attributes.st_size:
+                os.remove(partial_path)
+                raise IOError(
+                    "downloaded {} bytes of {} instead of {}".format(
+                        size, remote_path, attributes.st_size
+                    )
+                )
+            checksum = _file_checksum(partial_path)
+            remote_checksum = _remote_checksum(remote_file)
+            if remote_checksum is None or remote_checksum == checksum:
+                break
+            os.remove(partial_path)
+            if not offset:
+                raise IOError(
+                    "downloaded {} with {} checksum {} instead of {}".format(
+                        remote_path, DOWNLOAD_CHECKSUM, checksum, remote_checksum
+                    )
+                )
+            # the part downloaded earlier is corrupted, start over
+            offset = 0
+
+    os.rename(partial_path, local_path)
+    os.utime(local_path, (attributes.st_atime, attributes.st_mtime))
+    with open(_checksum_path(local_path), "w") as f:
+        f.write(checksum)
+    return True
+
+
+def download_dir(sftp, remote_dir, local_dir, open_sftp=None, workers=1):
     """
     Recursively download file from remote_dir to local_dir
+
+    Files which are already in ``local_dir`` with the remote size,
+    modification time and their recorded checksum are skipped (see
+    ``download_file``). With more than one
+    worker, files are downloaded concurrently, each worker over its own SFTP
+    channel from ``open_sftp``.
+
     Args:
+        sftp (paramiko.SFTPClient): client to list the files with
         remote_dir(str)
         local_dir(str)
-    Returns: None
+        open_sftp (Optional[Callable]): return a new SFTP channel for a worker
+        workers (int): number of concurrent downloads
+
+    Returns:
+        List[str]: local paths of the remote files
     """
-    dir_items = sftp.listdir_attr(remote_dir)
+    files = list_remote_files(sftp, remote_dir)
+    workers = min(workers, len(files)) if open_sftp else 1
+    channels = Queue()
+    channels.put(sftp)
+    opened = []
+    for _ in range(workers - 1):
+        channel = open_sftp()
+        opened.append(channel)
+        channels.put(channel)
+
+    def download(remote_file):
+        remote_path, relative_path, attributes = remote_file
+        channel = channels.get()
+        try:
+            return download_file(
+                channel,
+                remote_path,
+                os.path.join(local_dir, relative_path),
+                attributes,
+            )
+        finally:
+            channels.put(channel)
 
-    for item in dir_items:
-        remote_path = remote_dir + "/" + item.filename
-        local_path = os.path.join(local_dir, item.filename)
-        if S_ISDIR(item.st_mode):
-            download_dir(sftp, remote_path, local_path)
-        else:
-            sftp.get(remote_path, local_path)
+    try:
+        results = list(bounded_imap(download, files, workers))
+    finally:
+        for channel in opened:
+            channel.close()
+
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        raise errors[0]
+    return [os.path.join(local_dir, relative_path) for _, relative_path, _ in files]
 
 
 def arborist_role_for_permission(permission):
@@ -64,6 +362,106 @@ def arborist_role_for_permission(permission):
     }
 
 
+@contextmanager
+def _open_file(filepath, decrypt_key=None):
+    """
+    Open a file for reading, decrypting it with ``decrypt_key`` if given. Only
+    files encrypted by the unix ``crypt`` tool, which dbGaP uses, can be
+    decrypted.
+
+    Decrypted content is streamed from ``crypt`` as it is read rather than
+    buffered, so it has to be read to the end inside the ``with`` block.
+
+    Raises:
+        EnvironmentError: if ``crypt`` fails
+    """
+    if decrypt_key is None:
+        with open(filepath, "r") as f:
+            yield f
+        return
+
+    with open(filepath, "r") as encrypted, open(os.devnull, "w") as devnull:
+        p = sp.Popen(
+            ["crypt", decrypt_key], stdin=encrypted, stdout=sp.PIPE, stderr=devnull
+        )
+        try:
+            yield p.stdout
+        except Exception:
+            p.kill()
+            raise
+        finally:
+            p.stdout.close()
+            returncode = p.wait()
+    if returncode != 0:
+        raise EnvironmentError(
+            "could not decrypt {}: crypt exited with {}".format(filepath, returncode)
+        )
+
+
+def parse_dbgap_file(
+    filepath,
+    privileges,
+    decrypt_key=None,
+    parse_consent_code=True,
+    project_mapping=None,
+):
+    """
+    Parse one dbGaP access file. This does not touch the database, so files
+    can be parsed in separate processes; see ``UserSyncer._parse_csv``.
+
+    Args:
+        filepath (str): path to the file
+        privileges (Iterable[str]): privileges granted on the file's projects
+        decrypt_key (Optional[str]): key to decrypt the file with, if encrypted
+        parse_consent_code (bool): whether projects include the consent code
+        project_mapping (dict): how dbgap ids map to projects
+
+    Return:
+        Tuple[UserProjects, dict, set]:
+            (user_projects, user_info, dbgap_projects), where the first two are
+            as returned by ``UserSyncer._parse_csv`` and ``dbgap_projects``
+            are the projects which are not in the project mapping
+    """
+    project_mapping = project_mapping or {}
+    user_projects = UserProjects()
+    user_info = dict()
+    dbgap_projects = set()
+    with _open_file(filepath, decrypt_key=decrypt_key) as f:
+        csv = DictReader(f, quotechar='"', skipinitialspace=True)
+        for row in csv:
+            username = row.get("login", "")
+            if username == "":
+                continue
+
+            phsid = row.get("phsid", "").split(".")
+            dbgap_project = phsid[0]
+            if len(phsid) > 1 and parse_consent_code:
+                consent_code = phsid[-1]
+                if consent_code != "c999":
+                    dbgap_project += "." + consent_code
+
+            display_name = row.get("user name", "")
+            user_info[username] = {
+                "email": row.get("email", ""),
+                "display_name": display_name,
+                "phone_number": row.get("phone", ""),
+                "tags": {"dbgap_role": row.get("role", "")},
+            }
+
+            if dbgap_project not in project_mapping:
+                dbgap_projects.add(dbgap_project)
+                user_projects.add(username, dbgap_project, privileges)
+
+            for element_dict in project_mapping.get(dbgap_project, []):
+                user_projects.add(username, element_dict["auth_id"], privileges)
+    return user_projects, user_info, dbgap_projects
+
+
+def _parse_dbgap_file(args):
+    # Pool.map passes a single argument
+    return parse_dbgap_file(*args)
+
+
 class UserSyncer(object):
     def __init__(
         self,
@@ -76,6 +474,11 @@ class UserSyncer(object):
         sync_from_local_csv_dir=None,
         sync_from_local_yaml_file=None,
         arborist=None,
+        full_sync=False,
+        chunk_size=DB_BATCH_SIZE,
+        max_chunk_seconds=None,
+        storage_workers=STORAGE_WORKERS,
+        stream_user_yaml=False,
     ):
         """
         Syncs ACL files from dbGap to auth database and storage backends
@@ -89,19 +492,45 @@ class UserSyncer(object):
             arborist:
                 base URL for arborist service if the syncer should also create
                 resources in arborist
+            full_sync:
+                ignore the state saved by the last sync: parse every file and
+                diff against all access in the database
+            chunk_size:
+                maximum number of users or accesses changed per transaction
+            max_chunk_seconds:
+                if set, shrink or grow chunks (up to ``chunk_size``) so that
+                each transaction takes about this long
+            storage_workers:
+                number of threads granting and revoking access in storage
+                backends
+            stream_user_yaml:
+                read the users of the user.yaml one at a time instead of
+                loading the whole file first, to use less memory
         """
         self.sync_from_local_csv_dir = sync_from_local_csv_dir
         self.sync_from_local_yaml_file = sync_from_local_yaml_file
+        self.full_sync = full_sync
+        self.chunk_size = chunk_size
+        self.max_chunk_seconds = max_chunk_seconds
+        self.storage_workers = storage_workers
+        self.stream_user_yaml = stream_user_yaml
         self.is_sync_from_dbgap_server = is_sync_from_dbgap_server
         if is_sync_from_dbgap_server:
             self.server = dbGaP["info"]
             self.protocol = dbGaP["protocol"]
             self.dbgap_key = dbGaP["decrypt_key"]
         self.parse_consent_code = dbGaP.get("parse_consent_code", True)
+        # number of processes decrypting and parsing dbGaP files
+        self.parse_processes = dbGaP.get("parse_processes", multiprocessing.cpu_count())
+        # number of files downloaded from the dbGaP server at once, and where
+        # to keep them between syncs so unchanged files aren't downloaded again
+        self.download_workers = dbGaP.get("download_workers", DOWNLOAD_WORKERS)
+        self.download_cache_dir = dbGaP.get("download_cache_dir")
         self.session = db_session
         self.driver = SQLAlchemyDriver(DB)
         self.project_mapping = project_mapping or {}
         self._projects = dict()
+        self._identity_map = None
         self.logger = get_logger("user_syncer")
 
         self.arborist_client = None
@@ -137,11 +566,16 @@ class UserSyncer(object):
         """
         Download all data from sftp sever to a local dir
 
+        Files are downloaded by ``download_workers`` workers over as many SFTP
+        channels of one connection, and files already in ``path`` with the
+        remote size, modification time and their recorded checksum are
+        skipped.
+
         Args:
             path (str): path to local directory
 
         Returns:
-            None
+            List[str]: paths of the downloaded files
         """
         proxy = None
         if self.server.get("proxy", "") != "":
@@ -154,22 +588,29 @@ class UserSyncer(object):
                 )
             )
 
-        with paramiko.SSHClient() as client:
-            client.set_missing_host_key_policy(paramiko.WarningPolicy())
-            parameters = {
-                "hostname": self.server.get("host", ""),
-                "username": self.server.get("username", ""),
-                "password": self.server.get("password", ""),
-                "port": self.server.get("port", 22),
-            }
+        try:
+            with paramiko.SSHClient() as client:
+                client.set_missing_host_key_policy(paramiko.WarningPolicy())
+                parameters = {
+                    "hostname": self.server.get("host", ""),
+                    "username": self.server.get("username", ""),
+                    "password": self.server.get("password", ""),
+                    "port": self.server.get("port", 22),
+                }
+                if proxy:
+                    parameters["sock"] = proxy
+                client.connect(**parameters)
+                with client.open_sftp() as sftp:
+                    return download_dir(
+                        sftp,
+                        "./",
+                        path,
+                        open_sftp=client.open_sftp,
+                        workers=self.download_workers,
+                    )
+        finally:
             if proxy:
-                parameters["sock"] = proxy
-            client.connect(**parameters)
-            with client.open_sftp() as sftp:
-                download_dir(sftp, "./", path)
-
-        if proxy:
-            proxy.close()
+                proxy.close()
 
     def _get_from_ftp_with_proxy(self, path):
         """
@@ -205,23 +646,18 @@ class UserSyncer(object):
         """
 
         if encrypted:
-            has_crypt = sp.call(["which", "crypt"])
-            if has_crypt != 0:
-                self.logger.error("Need to install crypt to decrypt files from dbgap")
-                exit(1)
-            p = sp.Popen(
-                ["crypt", self.dbgap_key],
-                stdin=open(filepath, "r"),
-                stdout=sp.PIPE,
-                stderr=open(os.devnull, "w"),
-            )
-            yield StringIO(p.communicate()[0])
-        else:
-            f = open(filepath, "r")
+            self._check_crypt()
+        decrypt_key = self.dbgap_key if encrypted else None
+        with _open_file(filepath, decrypt_key=decrypt_key) as f:
             yield f
-            f.close()
 
-    def _parse_csv(self, file_dict, sess, encrypted=True):
+    def _check_crypt(self):
+        has_crypt = sp.call(["which", "crypt"])
+        if has_crypt != 0:
+            self.logger.error("Need to install crypt to decrypt files from dbgap")
+            exit(1)
+
+    def _parse_csv(self, file_dict, sess, encrypted=True, state=None):
         """
         parse csv files to python dict
 
@@ -229,9 +665,11 @@ class UserSyncer(object):
             fild_dict: a dictionary with key(file path) and value(privileges)
             encrypted: whether those files are encrypted
             sess: sqlalchemy session
+            state (Optional[SyncState]):
+                sync state to reuse the results of parsing unchanged files from
 
         Return:
-            Tuple[[dict, dict]]:
+            Tuple[[UserProjects, dict]]:
                 (user_project, user_info) where user_project is a mapping from
                 usernames to project permissions and user_info is a mapping
                 from usernames to user details, such as email
@@ -256,166 +694,97 @@ class UserSyncer(object):
             )
 
         """
-        user_projects = dict()
-        user_info = dict()
-        for filepath, privileges in file_dict.iteritems():
+        files = []
+        for filepath, privileges in sorted(file_dict.iteritems()):
             self.logger.info("Reading file {}".format(filepath))
             if os.stat(filepath).st_size == 0:
                 continue
             if not self._match_pattern(filepath, encrypted=encrypted):
                 continue
+            files.append((filepath, privileges))
+        if encrypted and files:
+            self._check_crypt()
+
+        results = [None] * len(files)
+        fingerprints = [None] * len(files)
+        sources = [
+            "{}:{}".format("dbgap" if encrypted else "csv", os.path.basename(filepath))
+            for filepath, _ in files
+        ]
+        if state is not None:
+            for i, (filepath, privileges) in enumerate(files):
+                fingerprints[i] = file_fingerprint(
+                    filepath,
+                    sorted(privileges),
+                    self.parse_consent_code,
+                    self.project_mapping,
+                )
+                results[i] = state.get_parsed(sources[i], fingerprints[i])
+                if results[i] is not None:
+                    self.logger.info("{} is unchanged".format(filepath))
+
+        to_parse = [i for i, result in enumerate(results) if result is None]
+        # there is only a key when syncing from the dbGaP server
+        decrypt_key = self.dbgap_key if encrypted and to_parse else None
+        args = [
+            (
+                files[i][0],
+                files[i][1],
+                decrypt_key,
+                self.parse_consent_code,
+                self.project_mapping,
+            )
+            for i in to_parse
+        ]
+        processes = min(self.parse_processes or 1, len(args))
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                parsed = pool.map(_parse_dbgap_file, args)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            parsed = [_parse_dbgap_file(arg) for arg in args]
+        for i, result in zip(to_parse, parsed):
+            results[i] = result
+            if state is not None:
+                state.set_parsed(sources[i], fingerprints[i], result)
+
+        # merge in file order, so the result does not depend on which file
+        # finished first
+        user_projects = UserProjects()
+        user_info = dict()
+        dbgap_projects = set()
+        for file_projects, file_info, file_dbgap_projects in results:
+            self.sync_two_phsids_dict(file_projects, user_projects)
+            self.sync_two_user_info_dict(file_info, user_info)
+            dbgap_projects.update(file_dbgap_projects)
+
+        for dbgap_project in sorted(dbgap_projects):
+            if dbgap_project not in self._projects:
+                project = self._get_or_create_project(sess, auth_id=dbgap_project)
+                if project.name is None:
+                    project.name = dbgap_project
+                self._projects[dbgap_project] = project
 
-            with self._read_file(filepath, encrypted=encrypted) as f:
-                csv = DictReader(f, quotechar='"', skipinitialspace=True)
-                for row in csv:
-                    username = row.get("login", "")
-                    if username == "":
-                        continue
-
-                    phsid_privileges = {}
-                    phsid = row.get("phsid", "").split(".")
-                    dbgap_project = phsid[0]
-                    if len(phsid) > 1 and self.parse_consent_code:
-                        consent_code = phsid[-1]
-                        if consent_code != "c999":
-                            dbgap_project += "." + consent_code
-
-                    display_name = row.get("user name", "")
-                    user_info[username] = {
-                        "email": row.get("email", ""),
-                        "display_name": display_name,
-                        "phone_number": row.get("phone", ""),
-                        "tags": {"dbgap_role": row.get("role", "")},
-                    }
-
-                    if dbgap_project not in self.project_mapping:
-                        if dbgap_project not in self._projects:
-                            project = self._get_or_create(
-                                sess, Project, auth_id=dbgap_project
-                            )
-                            if project.name is None:
-                                project.name = dbgap_project
-                            self._projects[dbgap_project] = project
-                        phsid_privileges = {dbgap_project: set(privileges)}
-                        if username in user_projects:
-                            user_projects[username].update(phsid_privileges)
-                        else:
-                            user_projects[username] = phsid_privileges
-
-                    for element_dict in self.project_mapping.get(dbgap_project, []):
-                        try:
-                            phsid_privileges = {
-                                element_dict["auth_id"]: set(privileges)
-                            }
-                            if username not in user_projects:
-                                user_projects[username] = {}
-                            user_projects[username].update(phsid_privileges)
-                        except ValueError as e:
-                            self.logger.info(e)
         return user_projects, user_info
 
-    def _parse_yaml(self, filepath, encrypted=True):
+    def _load_user_yaml(self, filepath, encrypted=True):
         """
-        parse yaml files to python nested dictionary
+        Load a user.yaml, once for both the database and the arborist sync.
+
         Args:
             filepath: yaml file
             encrypted: whether those files are encrypted
-        Returns:
-            user_project: a nested dict of
-            {
-                username: {
-                    'project1': {'read-storage','write-storage'},
-                    'project2': {'read-storage'},
-                    }
-            }
-            user_info: a dict of
-            {
-                username: {
-                    'email': email,
-                    'display_name': display_name,
-                    'phone_number': phonenum,
-                    'tags': {'k1':'v1', 'k2': 'v2'}
-                    'admin': is_admin
-                }
-            }
-        """
-        user_project = dict()
-        user_info = dict()
-
-        with self._read_file(filepath, encrypted=encrypted) as stream:
-            data = yaml.safe_load(stream)
-
-        users = data.get("users", {})
-        for username, details in users.iteritems():
-            # users should occur only once each; skip if already processed
-            if username in user_project:
-                self.logger.error("user `{}` occurs multiple times".format(username))
-                raise EnvironmentError("invalid yaml file")
-
-            privileges = {}
-
-            try:
-                for project in details.get("projects", {}):
-                    privileges[project["auth_id"]] = set(project["privilege"])
-            except KeyError as e:
-                self.logger.error("project missing field: {}".format(e))
-                continue
-
-            user_info[username] = {
-                "email": details.get("email", username),
-                "display_name": details.get("display_name", ""),
-                "phone_number": details.get("phone_number", ""),
-                "tags": details.get("tags", {}),
-                "admin": details.get("admin", False),
-            }
-            user_project[username] = privileges
-
-        return user_project, user_info
-
-    def _parse_resources_from_yaml(self, filepath, encrypted=True):
-        """
-        Args:
-            filepath (str): path to user yaml file
 
         Return:
-            Tuple[
-                Mapping[str, Mapping[str, Set[str]]],
-                Mapping[str, Union[str, Mapping[...]]],
-            ]:
-                the type is complicated---there's two parts:
-                    - first the per-resource-path permissions for every user:
-                        username -> (mapping: resource path -> set(permission))
-                    - second the entire resource tree that gets handed to
-                      arborist, which is a recursive type
-        """
-        data = dict()
-        with self._read_file(filepath, encrypted=encrypted) as f:
-            data = yaml.safe_load(f)
-
-        users = data.get("users", {})
-        result = dict()
-        # resources should be the resource tree to construct in arborist
-        resources = data.get("resources")
-
-        for username, user_info in users.iteritems():
-            # users should occur only once each; skip if already processed
-            if username in result:
-                msg = "invalid yaml file: user `{}` occurs multiple times".format(
-                    username
-                )
-                self.logger.error(msg)
-                raise EnvironmentError(msg)
-            resource_permissions = dict()
-            for project in user_info.get("projects", {}):
-                # project may not have `resource` field
-                try:
-                    resource = project["resource"]
-                except KeyError:
-                    continue
-                resource_permissions[resource] = set(project["privilege"])
-            result[username] = resource_permissions
-
-        return result, resources
+            fence.sync.user_yaml.UserYaml
+        """
+        with self._read_file(filepath, encrypted=encrypted) as stream:
+            return UserYaml.load(
+                stream, streaming=self.stream_user_yaml, logger=self.logger
+            )
 
     @staticmethod
     def sync_two_user_info_dict(user_info1, user_info2):
@@ -439,7 +808,9 @@ class UserSyncer(object):
         Merge pshid1 into phsids2
 
         Args:
-            phsids1, phsids2: nested dicts mapping phsids to sets of permissions
+            phsids1, phsids2:
+                nested dicts (or ``UserProjects``) mapping phsids to sets of
+                permissions
 
             {
                 username: {
@@ -468,6 +839,9 @@ class UserSyncer(object):
 
             For the other cases, just simple addition
         """
+        if isinstance(phsids2, UserProjects):
+            phsids2.update(phsids1)
+            return
         for user, projects1 in phsids1.iteritems():
             if not phsids2.get(user):
                 phsids2[user] = projects1
@@ -477,12 +851,28 @@ class UserSyncer(object):
                         phsids2[user][phsid1] = set()
                     phsids2[user][phsid1].update(privilege1)
 
-    def sync_to_db_and_storage_backend(self, user_project, user_info, sess):
+    def sync_to_db_and_storage_backend(self, user_project, user_info, sess, state=None):
         """
         sync user access control to database and storage backend
 
+        The access currently in the database is loaded in one query and diffed
+        against ``user_project`` in memory, keyed by lowercased username (like
+        ``query_for_user``, usernames match case-insensitively) and project
+        auth_id; the difference is then written in batches of
+        ``DB_BATCH_SIZE`` rows.
+
+        Changes are applied in chunks of at most ``chunk_size`` users or
+        accesses, each in its own transaction, so locks are held briefly and
+        an interrupted sync keeps the chunks it finished. Rerunning it diffs
+        against the database again and so picks up where it stopped.
+
+        With a sync ``state``, only the access and users which differ from
+        the last applied sync are loaded and written, progress is
+        checkpointed after every chunk and the applied access is saved at
+        the end.
+
         Args:
-            user_project(dict): a dictionary of
+            user_project(dict or UserProjects): a mapping of
             {
                 username: {
                     'project1': {'read-storage','write-storage'},
@@ -492,69 +882,213 @@ class UserSyncer(object):
             user_info(dict): a dictionary of {username: user_info{}}
             use_mapping(bool)
             sess: a sqlalchemy session
+            state (Optional[fence.sync.sync_state.SyncState]): sync state
 
         Return:
             None
         """
+        # objects loaded before an earlier commit are expired, start afresh
+        self._identity_map = _IdentityMap(sess)
         self._init_projects(user_project, sess)
 
         auth_provider_list = [
-            self._get_or_create(sess, AuthorizationProvider, name="dbGaP"),
-            self._get_or_create(sess, AuthorizationProvider, name="fence"),
+            self._get_or_create_auth_provider(sess, "dbGaP"),
+            self._get_or_create_auth_provider(sess, "fence"),
         ]
 
-        cur_db_user_project_list = {
-            (ua.user.username, ua.project.auth_id)
-            for ua in sess.query(AccessPrivilege).all()
-        }
-
-        syncing_user_project_list = set()
+        # (lowercased username, auth_id) -> username as spelled in user_project
+        syncing_usernames = {}
         for username, projects in user_project.iteritems():
-            for project, _ in projects.iteritems():
-                syncing_user_project_list.add((username, project))
+            for project in projects:
+                syncing_usernames[(username.lower(), project)] = username
+
+        applied = state.get_applied() if state else None
+        if applied is None:
+            cur_db_access = self._load_access_privileges(sess)
+            changed_user_info = user_info
+        else:
+            changed = _changed_access(user_project, applied[0])
+            cur_db_access = {
+                key: access
+                for key, access in self._load_access_privileges(
+                    sess, usernames={username for username, _ in changed}
+                ).iteritems()
+                if key in changed
+            }
+            syncing_usernames = {
+                key: username
+                for key, username in syncing_usernames.iteritems()
+                if key in changed
+            }
+            changed_user_info = {
+                username: info
+                for username, info in user_info.iteritems()
+                if applied[1].get(username) != info
+            }
 
-        to_delete = set.difference(cur_db_user_project_list, syncing_user_project_list)
-        to_add = set.difference(syncing_user_project_list, cur_db_user_project_list)
-        to_update = set.intersection(
-            cur_db_user_project_list, syncing_user_project_list
+        to_delete = set.difference(set(cur_db_access), set(syncing_usernames))
+        to_add = set.difference(set(syncing_usernames), set(cur_db_access))
+        to_update = set.intersection(set(cur_db_access), set(syncing_usernames))
+        self.logger.info(
+            "{} accesses to revoke, {} to grant and {} to update".format(
+                len(to_delete), len(to_add), len(to_update)
+            )
         )
 
-        self._upsert_userinfo(sess, user_info)
-        self._revoke_from_storage(to_delete, sess)
-        self._revoke_from_db(sess, to_delete)
-        self._grant_from_storage(to_add, user_project, sess)
-        self._grant_from_db(sess, to_add, user_info, user_project, auth_provider_list)
+        checkpoint = None
+        if state:
+            plan = state.plan_fingerprint(user_project, user_info)
+            checkpoint = state.get_checkpoint(plan)
+            if checkpoint:
+                self.logger.info(
+                    "resuming sync interrupted while applying {}".format(checkpoint[0])
+                )
 
-        # re-grant
-        self._grant_from_storage(to_update, user_project, sess)
-        self._update_from_db(sess, to_update, user_project)
+        def chunk_done(phase, last_key, failed=None):
+            if failed:
+                # keep the access changed in storage, but don't checkpoint
+                # past the chunk so that running the sync again retries it
+                sess.commit()
+                raise InternalError(
+                    "could not change access to {} projects in storage".format(
+                        len(failed)
+                    )
+                )
+            if state:
+                state.set_checkpoint(plan, phase, last_key)
+            sess.commit()
+
+        for chunk in self._chunks(sorted(changed_user_info), "users updated"):
+            self._upsert_userinfo(
+                sess, {username: changed_user_info[username] for username in chunk}
+            )
+            chunk_done("users", chunk[-1])
+
+        for chunk in self._chunks(sorted(to_delete), "accesses revoked"):
+            failed = self._revoke_from_storage(
+                {(cur_db_access[key][1], key[1]) for key in chunk}, sess
+            )
+            self._revoke_from_db(
+                sess,
+                [key for key in chunk if (cur_db_access[key][1], key[1]) not in failed],
+                cur_db_access,
+            )
+            chunk_done("revoke", chunk[-1], failed)
+
+        for chunk in self._chunks(sorted(to_add), "accesses granted"):
+            chunk_to_add = {(syncing_usernames[key], key[1]) for key in chunk}
+            failed = self._grant_from_storage(chunk_to_add, user_project, sess)
+            self._grant_from_db(
+                sess, chunk_to_add - failed, user_info, user_project, auth_provider_list
+            )
+            chunk_done("grant", chunk[-1], failed)
+
+        # re-grant. Accesses are only skipped if an earlier run of this sync
+        # got past them: they were either re-granted or granted then.
+        to_update = sorted(to_update)
+        if checkpoint and checkpoint[0] == "update":
+            to_update = [key for key in to_update if key > checkpoint[1]]
+        for chunk in self._chunks(to_update, "accesses updated"):
+            chunk_to_update = {key: syncing_usernames[key] for key in chunk}
+            failed = self._grant_from_storage(
+                {(username, key[1]) for key, username in chunk_to_update.iteritems()},
+                user_project,
+                sess,
+            )
+            chunk_to_update = {
+                key: username
+                for key, username in chunk_to_update.iteritems()
+                if (username, key[1]) not in failed
+            }
+            self._update_from_db(sess, chunk_to_update, user_project, cur_db_access)
+            chunk_done("update", chunk[-1], failed)
 
         self._validate_and_update_user_admin(sess, user_info)
+        if state:
+            state.save_applied(user_project, user_info)
+
+    def _chunks(self, items, description):
+        """
+        Split a list of work items into chunks of at most ``chunk_size``
+        items, logging progress after each.
+
+        With ``max_chunk_seconds`` set, the size of the next chunk is adapted
+        to how long the last one took (the time between yields), so that each
+        chunk's transaction holds its locks for about that long.
+        """
+        size = self.chunk_size
+        start = 0
+        while start < len(items):
+            chunk = items[start : start + size]
+            started = time.time()
+            yield chunk
+            start += len(chunk)
+            self.logger.info("{} {}/{}".format(description, start, len(items)))
+            if self.max_chunk_seconds:
+                elapsed = time.time() - started
+                if elapsed > self.max_chunk_seconds:
+                    size = max(size // 2, 1)
+                elif elapsed < self.max_chunk_seconds / 2.0:
+                    size = min(size * 2, self.chunk_size)
 
-    def _revoke_from_db(self, sess, to_delete):
+    @staticmethod
+    def _load_access_privileges(sess, usernames=None):
+        """
+        Load user access to projects in the auth database: all of it, or that
+        of the users with the given lowercased ``usernames``.
+
+        Return:
+            dict: a dictionary of
+            {
+                (lowercased username, project.auth_id):
+                    (access_privilege.id, username, privilege)
+            }
+        """
+        query = (
+            sess.query(
+                AccessPrivilege.id,
+                User.username,
+                Project.auth_id,
+                AccessPrivilege.privilege,
+            )
+            .join(AccessPrivilege.user)
+            .join(AccessPrivilege.project)
+        )
+        if usernames is None:
+            queries = [query]
+        else:
+            queries = [
+                query.filter(func.lower(User.username).in_(batch))
+                for _, batch in _batches(sorted(usernames))
+            ]
+        return {
+            (username.lower(), auth_id): (access_id, username, privilege or [])
+            for query in queries
+            for access_id, username, auth_id, privilege in query
+        }
+
+    def _revoke_from_db(self, sess, to_delete, cur_db_access):
         """
         Revoke user access to projects in the auth database
 
         Args:
             sess: sqlalchemy session
-            to_delete: a set of (username, project.auth_id) to be revoked from db
+            to_delete:
+                a set of (lowercased username, project.auth_id) to be revoked
+                from db
+            cur_db_access: the access in db, from ``_load_access_privileges``
         Return:
             None
         """
-        for (username, project_auth_id) in to_delete:
-            q = (
-                sess.query(AccessPrivilege)
-                .filter(AccessPrivilege.user.has(username=username))
-                .filter(AccessPrivilege.project.has(auth_id=project_auth_id))
-                .all()
-            )
-            for access in q:
-                self.logger.info(
-                    "revoke {} access to {} in db".format(username, project_auth_id)
-                )
-                sess.delete(access)
+        ids = []
+        for key in sorted(to_delete):
+            access_id, username, _ = cur_db_access[key]
+            self.logger.info("revoke {} access to {} in db".format(username, key[1]))
+            ids.append(access_id)
 
-        sess.commit()
+        table = AccessPrivilege.__table__
+        for _, batch in _batches(ids):
+            sess.execute(table.delete().where(table.c.id.in_(batch)))
 
     def _validate_and_update_user_admin(self, sess, user_info):
         """
@@ -584,35 +1118,50 @@ class UserSyncer(object):
                 )
         sess.commit()
 
-    def _update_from_db(self, sess, to_update, user_project):
+    def _update_from_db(self, sess, to_update, user_project, cur_db_access):
         """
-        Update user access to projects in the auth database
+        Update user access to projects in the auth database. Only accesses
+        whose privileges changed are written.
 
         Args:
             sess: sqlalchemy session
             to_update:
-                a set of (username, project.auth_id) to be updated from db
+                a dict of {(lowercased username, project.auth_id): username}
+                to be updated from db
+            cur_db_access: the access in db, from ``_load_access_privileges``
 
         Return:
             None
         """
-
-        for (username, project_auth_id) in to_update:
-            q = (
-                sess.query(AccessPrivilege)
-                .filter(AccessPrivilege.user.has(username=username))
-                .filter(AccessPrivilege.project.has(auth_id=project_auth_id))
-                .all()
-            )
-            for access in q:
-                access.privilege = user_project[username][project_auth_id]
-                self.logger.info(
-                    "update {} with {} access to {} in db".format(
-                        username, access.privilege, project_auth_id
-                    )
+        changed = []
+        for key, username in sorted(to_update.iteritems()):
+            access_id, _, privilege = cur_db_access[key]
+            new_privilege = user_project[username][key[1]]
+            if set(privilege) == set(new_privilege):
+                continue
+            new_privilege = sorted(new_privilege)
+            self.logger.info(
+                "update {} with {} access to {} in db".format(
+                    username, new_privilege, key[1]
                 )
-
-        sess.commit()
+            )
+            changed.append((access_id, new_privilege))
+
+        # one executemany per batch, the driver sends each row's privilege
+        table = AccessPrivilege.__table__
+        statement = (
+            table.update()
+            .where(table.c.id == bindparam("access_id"))
+            .values(privilege=bindparam("new_privilege"))
+        )
+        for _, batch in _batches(changed):
+            sess.execute(
+                statement,
+                [
+                    {"access_id": access_id, "new_privilege": privilege}
+                    for access_id, privilege in batch
+                ],
+            )
 
     def _grant_from_db(self, sess, to_add, user_info, user_project, auth_provider_list):
         """
@@ -625,27 +1174,61 @@ class UserSyncer(object):
         Return:
             None
         """
-        for (username, project_auth_id) in to_add:
-            u = query_for_user(session=sess, username=username)
+        # make sure new projects and providers have ids
+        sess.flush()
+        user_ids = self._get_user_ids(sess, {username for username, _ in to_add})
+        project_ids = dict(sess.query(Project.auth_id, Project.id))
+
+        rows = []
+        for (username, project_auth_id) in sorted(to_add):
+            user_id = user_ids.get(username.lower())
+            if user_id is None:
+                self.logger.error(
+                    "user {} not found, not granting access to {}".format(
+                        username, project_auth_id
+                    )
+                )
+                continue
 
             auth_provider = auth_provider_list[0]
             if "dbgap_role" not in user_info[username]["tags"]:
                 auth_provider = auth_provider_list[1]
 
-            user_access = AccessPrivilege(
-                user=u,
-                project=self._projects[project_auth_id],
-                privilege=list(user_project[username][project_auth_id]),
-                auth_provider=auth_provider,
-            )
+            privilege = sorted(user_project[username][project_auth_id])
             self.logger.info(
                 "grant user {} to {} with access {}".format(
-                    username, user_access.project, user_access.privilege
+                    username, project_auth_id, privilege
                 )
             )
-            sess.add(user_access)
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "project_id": project_ids[project_auth_id],
+                    "privilege": privilege,
+                    "provider_id": auth_provider.id,
+                }
+            )
 
-        sess.commit()
+        table = AccessPrivilege.__table__
+        for _, batch in _batches(rows):
+            sess.execute(table.insert(), batch)
+
+    @staticmethod
+    def _get_user_ids(sess, usernames):
+        """
+        Look up users by username, case-insensitively.
+
+        Return:
+            dict: lowercased username -> user id
+        """
+        user_ids = {}
+        for _, batch in _batches(sorted({name.lower() for name in usernames})):
+            query = sess.query(User.id, User.username).filter(
+                func.lower(User.username).in_(batch)
+            )
+            for user_id, username in query:
+                user_ids[username.lower()] = user_id
+        return user_ids
 
     def _upsert_userinfo(self, sess, user_info):
         """
@@ -660,41 +1243,51 @@ class UserSyncer(object):
             None
         """
 
-        for username in user_info:
-            u = query_for_user(session=sess, username=username)
+        users = self._get_identity_map(sess).load_users(user_info)
 
-            if u is None:
-                self.logger.info("create user {}".format(username))
-                u = User(username=username)
-                sess.add(u)
+        # create missing users in one statement and load them back
+        new_usernames = sorted(
+            {
+                username.lower(): username
+                for username in user_info
+                if username.lower() not in users
+            }.values()
+        )
+        for username in new_usernames:
+            self.logger.info("create user {}".format(username))
+        table = User.__table__
+        for _, batch in _batches(new_usernames):
+            sess.execute(table.insert(), [{"username": username} for username in batch])
+            query = (
+                sess.query(User)
+                .options(subqueryload(User.tags))
+                .filter(User.username.in_(batch))
+            )
+            for u in query:
+                users[u.username.lower()] = u
 
-            u.email = user_info[username].get("email", "")
-            u.display_name = user_info[username].get("display_name", "")
-            u.phone_number = user_info[username].get("phone_number", "")
-            u.is_admin = user_info[username].get("admin", False)
+        for username, info in user_info.iteritems():
+            u = users[username.lower()]
+            u.email = info.get("email", "")
+            u.display_name = info.get("display_name", "")
+            u.phone_number = info.get("phone_number", "")
+            u.is_admin = info.get("admin", False)
 
             # do not update if there is no tag
-            if user_info[username]["tags"] == {}:
+            if info["tags"] == {}:
                 continue
 
-            # remove user db tags if they are not shown in new tags
-            for tag in u.tags:
-                if tag.key not in user_info[username]["tags"]:
+            # remove user db tags if they are not shown in new tags, and sync
+            # the rest
+            db_tags = {tag.key: tag for tag in u.tags}
+            for key, tag in db_tags.iteritems():
+                if key not in info["tags"]:
                     u.tags.remove(tag)
-
-            # sync
-            for k, v in user_info[username]["tags"].iteritems():
-                found = False
-                for tag in u.tags:
-                    if tag.key == k:
-                        found = True
-                        tag.value = v
-                # create new tag if not found
-                if not found:
-                    tag = Tag(key=k, value=v)
-                    u.tags.append(tag)
-
-        sess.commit()
+            for k, v in info["tags"].iteritems():
+                if k in db_tags:
+                    db_tags[k].value = v
+                else:
+                    u.tags.append(Tag(key=k, value=v))
 
     def _revoke_from_storage(self, to_delete, sess):
         """
@@ -705,25 +1298,20 @@ class UserSyncer(object):
             to_delete: a set of (username, project.auth_id) to be revoked
 
         Return:
-            None
+            set: the (username, project.auth_id) which could not be revoked
         """
+        projects = self._get_identity_map(sess).projects
+        changes = []
         for (username, project_auth_id) in to_delete:
-            project = (
-                sess.query(Project).filter(Project.auth_id == project_auth_id).first()
-            )
+            project = projects[project_auth_id]
             for sa in project.storage_access:
                 self.logger.info(
                     "revoke {} access to {} in {}".format(
                         username, project_auth_id, sa.provider.name
                     )
                 )
-                self.storage_manager.revoke_access(
-                    provider=sa.provider.name,
-                    username=username,
-                    project=project,
-                    session=sess,
-                )
-        sess.commit()
+                changes.append(AccessChange(sa.provider.name, username, project, None))
+        return self._apply_storage_changes(changes, sess)
 
     def _grant_from_storage(self, to_add, user_project, sess):
         """
@@ -737,8 +1325,9 @@ class UserSyncer(object):
                     {username: {phsid: {'read-storage','write-storage'}}}
 
         Return:
-            None
+            set: the (username, project.auth_id) which could not be granted
         """
+        changes = []
         for (username, project_auth_id) in to_add:
             project = self._projects[project_auth_id]
             for sa in project.storage_access:
@@ -748,13 +1337,25 @@ class UserSyncer(object):
                         username, access, project_auth_id, sa.provider.name
                     )
                 )
-                self.storage_manager.grant_access(
-                    provider=sa.provider.name,
-                    username=username,
-                    project=project,
-                    access=access,
-                    session=sess,
+                changes.append(
+                    AccessChange(sa.provider.name, username, project, access)
                 )
+        return self._apply_storage_changes(changes, sess)
+
+    def _apply_storage_changes(self, changes, sess):
+        """
+        Apply ``changes`` (a list of ``AccessChange``) in the storage backends
+        from ``storage_workers`` threads.
+
+        Return:
+            set: the (username, project.auth_id) of the changes which failed
+        """
+        if not changes:
+            return set()
+        failed = self.storage_manager.apply_access_changes(
+            changes, sess, max_workers=self.storage_workers
+        )
+        return {(change.username, change.project.auth_id) for change in failed}
 
     def _init_projects(self, user_project, sess):
         """
@@ -763,25 +1364,49 @@ class UserSyncer(object):
         if self.project_mapping:
             for projects in self.project_mapping.values():
                 for p in projects:
-                    project = self._get_or_create(sess, Project, **p)
+                    project = self._get_or_create_project(sess, **p)
                     self._projects[p["auth_id"]] = project
         for _, projects in user_project.iteritems():
             for auth_id in projects.keys():
-                project = sess.query(Project).filter(Project.auth_id == auth_id).first()
-                if not project:
-                    data = {"name": auth_id, "auth_id": auth_id}
-                    try:
-                        project = self._get_or_create(sess, Project, **data)
-                    except IntegrityError as e:
-                        sess.rollback()
-                        self.logger.error(str(e))
-                        raise Exception(
-                            "Project {} already exists. Detail {}. Please contact your system administrator.".format(
-                                auth_id, str(e)
-                            )
-                        )
                 if auth_id not in self._projects:
-                    self._projects[auth_id] = project
+                    self._projects[auth_id] = self._get_or_create_project(
+                        sess, name=auth_id, auth_id=auth_id
+                    )
+        try:
+            sess.flush()
+        except IntegrityError as e:
+            sess.rollback()
+            self.logger.error(str(e))
+            raise Exception(
+                "Could not create projects. Detail {}. Please contact your system administrator.".format(
+                    str(e)
+                )
+            )
+
+    def _get_identity_map(self, sess):
+        if self._identity_map is None or self._identity_map.session is not sess:
+            self._identity_map = _IdentityMap(sess)
+        return self._identity_map
+
+    def _get_or_create_project(self, sess, **kwargs):
+        """
+        Return the project with ``kwargs["auth_id"]``, creating it from
+        ``kwargs`` if there is none.
+        """
+        projects = self._get_identity_map(sess).projects
+        project = projects.get(kwargs["auth_id"])
+        if not project:
+            project = Project(**kwargs)
+            sess.add(project)
+            projects[project.auth_id] = project
+        return project
+
+    def _get_or_create_auth_provider(self, sess, name):
+        providers = self._get_identity_map(sess).auth_providers
+        if name not in providers:
+            providers[name] = AuthorizationProvider(name=name)
+            sess.add(providers[name])
+        return providers[name]
 
     @classmethod
     def _get_or_create(self, sess, model, **kwargs):
@@ -802,22 +1427,32 @@ class UserSyncer(object):
         """
         Collect files from dbgap server, sync csv and yaml files to storage
         backend and fence DB
+
+        Files which did not change since the last sync are not parsed again,
+        and only the access which changed since then is written, unless
+        ``full_sync`` is set.
         """
+        state = SyncState(sess, full=self.full_sync)
         dbgap_file_list = []
         tmpdir = tempfile.mkdtemp()
         if self.is_sync_from_dbgap_server:
             self.logger.info("Download from server")
             try:
                 if self.protocol == "sftp":
-                    self._get_from_sftp_with_proxy(tmpdir)
+                    dbgap_file_list = self._get_from_sftp_with_proxy(
+                        self.download_cache_dir or tmpdir
+                    )
                 else:
                     self._get_from_ftp_with_proxy(tmpdir)
-                dbgap_file_list = glob.glob(os.path.join(tmpdir, "*"))
+                    dbgap_file_list = glob.glob(os.path.join(tmpdir, "*"))
             except Exception as e:
                 self.logger.info(e)
         permissions = [{"read-storage"} for _ in dbgap_file_list]
         user_projects, user_info = self._parse_csv(
-            dict(zip(dbgap_file_list, permissions)), encrypted=True, sess=sess
+            dict(zip(dbgap_file_list, permissions)),
+            encrypted=True,
+            sess=sess,
+            state=state,
         )
         try:
             shutil.rmtree(tmpdir)
@@ -834,14 +1469,14 @@ class UserSyncer(object):
 
         permissions = [{"read-storage"} for _ in local_csv_file_list]
         user_projects_csv, user_info_csv = self._parse_csv(
-            dict(zip(local_csv_file_list, permissions)), encrypted=False, sess=sess
+            dict(zip(local_csv_file_list, permissions)),
+            encrypted=False,
+            sess=sess,
+            state=state,
         )
 
         try:
-            user_projects_yaml, user_info_yaml = self._parse_yaml(
-                self.sync_from_local_yaml_file, encrypted=False
-            )
-            user_arborist_info, resources = self._parse_resources_from_yaml(
+            user_yaml = self._load_user_yaml(
                 self.sync_from_local_yaml_file, encrypted=False
             )
         except EnvironmentError as e:
@@ -853,19 +1488,23 @@ class UserSyncer(object):
         self.sync_two_user_info_dict(user_info_csv, user_info)
 
         # privilleges in yaml files overide ones in csv files
-        self.sync_two_phsids_dict(user_projects_yaml, user_projects)
-        self.sync_two_user_info_dict(user_info_yaml, user_info)
+        self.sync_two_phsids_dict(user_yaml.user_projects, user_projects)
+        self.sync_two_user_info_dict(user_yaml.user_info, user_info)
 
         if user_projects:
             self.logger.info("Sync to db and storage backend")
-            self.sync_to_db_and_storage_backend(user_projects, user_info, sess)
+            self.sync_to_db_and_storage_backend(
+                user_projects, user_info, sess, state=state
+            )
             self.logger.info("Finish syncing to db and storage backend")
         else:
             self.logger.info("No users for syncing")
 
-        if resources:
+        if user_yaml.resources:
             self.logger.info("Synchronizing arborist")
-            success = self._update_arborist(sess, resources, user_arborist_info)
+            success = self._update_arborist(
+                sess, user_yaml.resources, user_yaml.user_resources
+            )
             if success:
                 self.logger.info("Finished synchronizing arborist")
             else:
@@ -873,11 +1512,6 @@ class UserSyncer(object):
         else:
             self.logger.info("No resources specified; skipping arborist sync")
 
-    @staticmethod
-    def _reset_user_access(session):
-        session.execute(users_to_policies.delete())
-        # TODO (rudyardrichter 2018-09-10): revoke admin access etc
-
     def _update_arborist(self, session, resources, user_projects):
         """
         Create roles and resources in arborist from the information in
@@ -887,6 +1521,11 @@ class UserSyncer(object):
         ``/projects/{project}``. Roles are created with just the original names
         for the privileges like ``"read-storage"`` etc.
 
+        The resources, roles and policies arborist already has are listed
+        once, and only the missing ones are created. The policies granted to
+        users in the database are diffed against the ones in
+        ``user_projects``, and only the difference is written.
+
         Args:
             user_projects (dict)
             session (sqlalchemy.Session)
@@ -901,74 +1540,111 @@ class UserSyncer(object):
             self.logger.error("arborist service is unavailable; skipping arborist sync")
             return False
 
-        # Set up the resource tree in arborist
-        if resources:
-            # see if arborist has identical resource tree already
-            try:
-                for resource in resources:
-                    self.arborist_client.create_resource("/", resource, overwrite=True)
-            except ArboristError as e:
-                self.logger.error(e)
-                return False
-
-        created_roles = set()
-        created_policies = set()
+        # If arborist can't list what it has, everything is created (arborist
+        # ignores what already exists).
+        existing_resources = None
+        listed = self.arborist_client.list_resources()
+        if isinstance(listed, dict) and "resources" in listed:
+            existing_resources = _resource_paths(listed["resources"])
+        existing_roles = _arborist_ids(self.arborist_client.list_roles(), "roles")
+        existing_policies = _arborist_ids(
+            self.arborist_client.list_policies(), "policies", "policy_ids"
+        )
 
-        self._reset_user_access(session)
+        # Set up the resource tree in arborist
+        try:
+            for resource in resources or []:
+                if existing_resources is not None and _resource_paths(
+                    [resource]
+                ).issubset(existing_resources):
+                    continue
+                self.arborist_client.create_resource("/", resource, overwrite=True)
+        except ArboristError as e:
+            self.logger.error(e)
+            return False
 
+        # (lowercased username, resource path, permission) of every grant
+        user_policies = set()
         for username, user_resources in user_projects.iteritems():
-            self.logger.info("processing user `{}`".format(username))
-            user = query_for_user(session=session, username=username)
-
             for path, permissions in user_resources.iteritems():
                 for permission in permissions:
-                    # "permission" in the dbgap sense, not the arborist sense
-                    if permission not in created_roles:
-                        try:
-                            self.arborist_client.create_role(
-                                arborist_role_for_permission(permission)
-                            )
-                        except ArboristError as e:
-                            self.logger.info(
-                                "not creating role for permission `{}`; {}".format(
-                                    permission, str(e)
-                                )
-                            )
-                        created_roles.add(permission)
-
-                    # If everything was created fine, grant a policy to
-                    # this user which contains exactly just this resource,
-                    # with this permission as a role.
-
-                    # format project '/x/y/z' -> 'x.y.z'
-                    # so the policy id will be something like 'x.y.z-create'
-                    policy_id = _format_policy_id(path, permission)
-                    if policy_id not in created_policies:
-                        try:
-                            self.arborist_client.create_policy(
-                                {
-                                    "id": policy_id,
-                                    "description": "policy created by fence sync",
-                                    "role_ids": [permission],
-                                    "resource_paths": [path],
-                                }
-                            )
-                        except ArboristError as e:
-                            self.logger.info(
-                                "not creating policy in arborist; {}".format(str(e))
-                            )
-                        created_policies.add(policy_id)
-                    policy = session.query(Policy).filter_by(id=policy_id).first()
-                    if not policy:
-                        policy = Policy(id=policy_id)
-                        session.add(policy)
-                        self.logger.info("created policy `{}`".format(policy_id))
-                    user.policies.append(policy)
-                    self.logger.info(
-                        "granted policy `{}` to user `{}`".format(
-                            policy_id, user.username
-                        )
+                    user_policies.add((username.lower(), path, permission))
+
+        # "permission" in the dbgap sense, not the arborist sense
+        for permission in sorted({policy[2] for policy in user_policies}):
+            if existing_roles is not None and permission in existing_roles:
+                continue
+            try:
+                self.arborist_client.create_role(
+                    arborist_role_for_permission(permission)
+                )
+            except ArboristError as e:
+                self.logger.info(
+                    "not creating role for permission `{}`; {}".format(
+                        permission, str(e)
                     )
+                )
+
+        # Every policy contains exactly one resource, with one permission as
+        # its role. Project '/x/y/z' with permission 'create' gets the policy
+        # id 'x.y.z-create'.
+        policies = {}
+        for _, path, permission in user_policies:
+            policies[_format_policy_id(path, permission)] = (path, permission)
+        for policy_id, (path, permission) in sorted(policies.iteritems()):
+            if existing_policies is not None and policy_id in existing_policies:
+                continue
+            try:
+                self.arborist_client.create_policy(
+                    {
+                        "id": policy_id,
+                        "description": "policy created by fence sync",
+                        "role_ids": [permission],
+                        "resource_paths": [path],
+                    }
+                )
+            except ArboristError as e:
+                self.logger.info("not creating policy in arborist; {}".format(str(e)))
+
+        table = Policy.__table__
+        db_policies = {policy_id for (policy_id,) in session.query(Policy.id)}
+        new_policies = sorted(set(policies) - db_policies)
+        for _, batch in _batches(new_policies):
+            session.execute(table.insert(), [{"id": policy_id} for policy_id in batch])
+        for policy_id in new_policies:
+            self.logger.info("created policy `{}`".format(policy_id))
+
+        user_ids = self._get_user_ids(session, {policy[0] for policy in user_policies})
+        granted = set()
+        for username, path, permission in user_policies:
+            if username not in user_ids:
+                self.logger.warning(
+                    "user `{}` not found; not granting policies".format(username)
+                )
+                continue
+            granted.add((user_ids[username], _format_policy_id(path, permission)))
+
+        columns = (users_to_policies.c.user_id, users_to_policies.c.policy_id)
+        current = {tuple(row) for row in session.query(*columns)}
+        to_revoke = sorted(current - granted)
+        to_grant = sorted(granted - current)
+        for _, batch in _batches(to_revoke):
+            session.execute(
+                users_to_policies.delete().where(tuple_(*columns).in_(batch))
+            )
+        for _, batch in _batches(to_grant):
+            session.execute(
+                users_to_policies.insert(),
+                [
+                    {"user_id": user_id, "policy_id": policy_id}
+                    for user_id, policy_id in batch
+                ],
+            )
+        self.logger.info(
+            "granted {} and revoked {} user policies".format(
+                len(to_grant), len(to_revoke)
+            )
+        )
 
         session.commit()
         return True
@@ -0,0 +1,207 @@
+"""
+Compact representation of the access a user sync applies.
+
+The sync collects, for hundreds of thousands of users, which privileges they
+have on which projects. As nested dicts of sets that takes a dict per user
+and a set per (user, project) pair, which adds up to gigabytes; a
+``UserProjects`` stores the same access as one array of integers per user.
+"""
+
+from array import array
+
+#: Bits of an entry holding the privilege bitmask; the rest hold the project.
+_MASK_BITS = 32
+_MASK = (1 << _MASK_BITS) - 1
+
+# entries need 64 bits: "Q" where the array module has it (Python 3), else
+# "L", which is only that wide where C longs are
+try:
+    _TYPECODE = "Q"
+    array(_TYPECODE)
+except ValueError:
+    _TYPECODE = "L"
+if array(_TYPECODE).itemsize < 8:
+    raise ImportError("UserProjects needs 64-bit unsigned arrays")
+
+
+class UserProjects(object):
+    """
+    Map of username -> {project auth_id -> set of privileges}.
+
+    Project auth_ids and privileges are interned and numbered, and each user's
+    access is an array of ``project number << 32 | privilege bitmask``
+    entries. Reading a user's projects builds a new dict, so changes have to
+    go through ``add`` or ``update``.
+
+    Example:
+
+        user_projects = UserProjects()
+        user_projects.add("userA", "phs000178", {"read-storage"})
+        user_projects.update({"userA": {"phs000178": {"write-storage"}}})
+        user_projects["userA"]  # {"phs000178": {"read-storage", "write-storage"}}
+    """
+
+    def __init__(self, user_projects=None):
+        """
+        Args:
+            user_projects (Optional[dict]): initial access, as nested dicts
+        """
+        self._projects = []
+        self._project_numbers = {}
+        self._privileges = []
+        self._privilege_bits = {}
+        self._users = {}
+        if user_projects:
+            self.update(user_projects)
+
+    def _project_number(self, auth_id):
+        number = self._project_numbers.get(auth_id)
+        if number is None:
+            number = self._project_numbers[auth_id] = len(self._projects)
+            self._projects.append(auth_id)
+        return number
+
+    def _privilege_mask(self, privileges):
+        mask = 0
+        for privilege in privileges:
+            bit = self._privilege_bits.get(privilege)
+            if bit is None:
+                if len(self._privileges) == _MASK_BITS:
+                    raise ValueError(
+                        "more than {} distinct privileges".format(_MASK_BITS)
+                    )
+                bit = self._privilege_bits[privilege] = 1 << len(self._privileges)
+                self._privileges.append(privilege)
+            mask |= bit
+        return mask
+
+    def _privilege_set(self, mask):
+        return {
+            privilege for i, privilege in enumerate(self._privileges) if mask & (1 << i)
+        }
+
+    def add(self, username, auth_id=None, privileges=()):
+        """
+        Grant ``privileges`` on project ``auth_id`` to ``username``, on top of
+        what they have already. Without ``auth_id``, only make sure the user
+        is in the map.
+        """
+        entries = self._entries(username)
+        if auth_id is not None:
+            self._grant(
+                entries,
+                self._project_number(auth_id),
+                self._privilege_mask(privileges),
+            )
+
+    def _entries(self, username):
+        entries = self._users.get(username)
+        if entries is None:
+            entries = self._users[username] = array(_TYPECODE)
+        return entries
+
+    @staticmethod
+    def _grant(entries, project, mask):
+        for i, entry in enumerate(entries):
+            if (entry >> _MASK_BITS) == project:
+                entries[i] = entry | mask
+                return
+        entries.append((project << _MASK_BITS) | mask)
+
+    def update(self, user_projects):
+        """
+        Merge ``user_projects`` (nested dicts or a ``UserProjects``) into this
+        map: the privileges on projects both have are combined, like in
+        ``UserSyncer.sync_two_phsids_dict``.
+        """
+        if isinstance(user_projects, UserProjects):
+            # renumber the other map's entries instead of building its dicts
+            projects = [
+                self._project_number(auth_id) for auth_id in user_projects._projects
+            ]
+            bits = [
+                self._privilege_mask([privilege])
+                for privilege in user_projects._privileges
+            ]
+            for username, other_entries in user_projects._users.iteritems():
+                entries = self._entries(username)
+                for entry in other_entries:
+                    mask = 0
+                    for i, bit in enumerate(bits):
+                        if entry & (1 << i):
+                            mask |= bit
+                    self._grant(entries, projects[entry >> _MASK_BITS], mask)
+            return
+        for username, projects in user_projects.iteritems():
+            self.add(username)
+            for auth_id, privileges in projects.iteritems():
+                self.add(username, auth_id, privileges)
+
+    def iteritems(self):
+        for username, entries in self._users.iteritems():
+            yield username, self._projects_of(entries)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def _projects_of(self, entries):
+        return {
+            self._projects[entry >> _MASK_BITS]: self._privilege_set(entry & _MASK)
+            for entry in entries
+        }
+
+    def __getitem__(self, username):
+        return self._projects_of(self._users[username])
+
+    def get(self, username, default=None):
+        entries = self._users.get(username)
+        if entries is None:
+            return default
+        return self._projects_of(entries)
+
+    def keys(self):
+        return self._users.keys()
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def __contains__(self, username):
+        return username in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def __eq__(self, other):
+        if not hasattr(other, "iteritems"):
+            return NotImplemented
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def to_json(self):
+        """
+        Return the map in a compact JSON-serializable form, for ``from_json``.
+        """
+        return [
+            self._projects,
+            self._privileges,
+            {username: entries.tolist() for username, entries in self._users.items()},
+        ]
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Load a map saved with ``to_json``, or given as nested dicts of lists.
+        """
+        if not isinstance(data, list):
+            return cls(data)
+        user_projects = cls()
+        projects, privileges, users = data
+        for auth_id in projects:
+            user_projects._project_number(auth_id)
+        user_projects._privilege_mask(privileges)
+        for username, entries in users.iteritems():
+            user_projects._users[username] = array(_TYPECODE, entries)
+        return user_projects
@@ -0,0 +1,222 @@
+"""
+Loading of the user.yaml file a user sync applies.
+
+The file is loaded once per sync into a ``UserYaml``, which holds both what
+is synced to the database and storage (the access to projects and user
+details) and what is synced to arborist (the resource tree and the access to
+resources). Parsing uses libyaml when PyYAML was built with it.
+
+With ``streaming=True`` the users are read one at a time from the parser's
+events instead of loading the whole document first, so only the
+``UserYaml`` itself is kept in memory.
+"""
+
+import yaml
+from yaml.events import (
+    AliasEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+from yaml.nodes import ScalarNode
+
+from fence.sync.user_projects import UserProjects
+
+#: Safe loader backed by libyaml if available, else PyYAML's pure-Python one.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_MERGE_TAG = "tag:yaml.org,2002:merge"
+
+#: Stands for the ``<<`` key of a mapping while it is constructed.
+_MERGE = object()
+
+
+class UserYaml(object):
+    """
+    The content of a user.yaml.
+
+    Attributes:
+        user_projects (UserProjects):
+            username -> {project auth_id -> set of privileges}
+        user_info (dict):
+            username -> {
+                'email': email,
+                'display_name': display_name,
+                'phone_number': phonenum,
+                'tags': {'k1':'v1', 'k2': 'v2'}
+                'admin': is_admin
+            }
+        user_resources (dict):
+            username -> {resource path -> set of privileges}, for the
+            projects which have a ``resource``
+        resources (list): the resource tree to create in arborist
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.user_projects = UserProjects()
+        self.user_info = {}
+        self.user_resources = {}
+        self.resources = None
+
+    @classmethod
+    def load(cls, stream, streaming=False, logger=None):
+        """
+        Load a user.yaml from ``stream``.
+
+        Raises:
+            EnvironmentError: if the file is not a valid user.yaml
+        """
+        user_yaml = cls(logger=logger)
+        if streaming:
+            sections = _iter_document(stream)
+        else:
+            data = yaml.load(stream, Loader=YAML_LOADER)
+            if not isinstance(data, dict):
+                raise EnvironmentError("invalid yaml file: not a mapping")
+            sections = data.iteritems()
+        for key, value in sections:
+            if key == "users":
+                users = value.iteritems() if isinstance(value, dict) else value
+                for username, details in users or ():
+                    user_yaml.add_user(username, details)
+            elif key == "resources":
+                user_yaml.resources = value
+        return user_yaml
+
+    def add_user(self, username, details):
+        """
+        Add a user with their entry from the yaml ``users``. Projects which
+        miss a field are logged and left out.
+
+        Raises:
+            EnvironmentError: if the user was already added
+        """
+        if username in self.user_info:
+            msg = "invalid yaml file: user `{}` occurs multiple times".format(username)
+            self._log_error(msg)
+            raise EnvironmentError(msg)
+
+        details = details or {}
+        privileges = {}
+        resource_privileges = {}
+        for project in details.get("projects", {}):
+            if "privilege" not in project:
+                self._log_error("project missing field: 'privilege'")
+                continue
+            # a project may have an `auth_id`, a `resource` or both
+            if "auth_id" in project:
+                privileges[project["auth_id"]] = set(project["privilege"])
+            if "resource" in project:
+                resource_privileges[project["resource"]] = set(project["privilege"])
+            if "auth_id" not in project and "resource" not in project:
+                self._log_error("project missing field: 'auth_id'")
+
+        self.user_info[username] = {
+            "email": details.get("email", username),
+            "display_name": details.get("display_name", ""),
+            "phone_number": details.get("phone_number", ""),
+            "tags": details.get("tags", {}),
+            "admin": details.get("admin", False),
+        }
+        self.user_projects.add(username)
+        for auth_id, project_privileges in privileges.iteritems():
+            self.user_projects.add(username, auth_id, project_privileges)
+        self.user_resources[username] = resource_privileges
+
+    def _log_error(self, msg):
+        if self.logger:
+            self.logger.error(msg)
+
+
+def _iter_document(stream):
+    """
+    Parse a yaml document which is a mapping, and yield its ``(key, value)``
+    pairs. The value of ``users`` is an iterator of ``(username, details)``
+    which has to be consumed before the next pair, and reads the users one
+    at a time.
+    """
+    loader = YAML_LOADER(stream)
+    anchors = {}
+    try:
+        loader.get_event()  # stream start
+        if loader.check_event(yaml.events.StreamEndEvent):
+            raise EnvironmentError("invalid yaml file: empty")
+        loader.get_event()  # document start
+        if not loader.check_event(MappingStartEvent):
+            raise EnvironmentError("invalid yaml file: not a mapping")
+        _anchor(loader.get_event(), {}, anchors)
+        while not loader.check_event(MappingEndEvent):
+            key = _construct(loader, anchors)
+            if key == "users" and loader.check_event(MappingStartEvent):
+                _anchor(loader.get_event(), {}, anchors)
+                yield key, _iter_mapping(loader, anchors)
+            else:
+                yield key, _construct(loader, anchors)
+    finally:
+        loader.dispose()
+
+
+def _iter_mapping(loader, anchors):
+    while not loader.check_event(MappingEndEvent):
+        yield _construct(loader, anchors), _construct(loader, anchors)
+    loader.get_event()
+
+
+def _anchor(event, value, anchors):
+    if event.anchor is not None:
+        anchors[event.anchor] = value
+    return value
+
+
+def _construct(loader, anchors):
+    """
+    Build the value of the next node from the loader's events, resolving and
+    constructing scalars like ``yaml.safe_load`` does.
+    """
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(
+                None, None, "found undefined alias %r" % event.anchor, event.start_mark
+            )
+        return anchors[event.anchor]
+
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        if tag == _MERGE_TAG:
+            return _MERGE
+        node = ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark, style=event.style
+        )
+        value = loader.construct_object(node)
+        # scalars are not shared, don't keep them around
+        loader.constructed_objects.clear()
+        return _anchor(event, value, anchors)
+
+    if isinstance(event, SequenceStartEvent):
+        value = _anchor(event, [], anchors)
+        while not loader.check_event(SequenceEndEvent):
+            value.append(_construct(loader, anchors))
+        loader.get_event()
+        return value
+
+    # mapping: keys merged in with ``<<`` don't override the explicit ones
+    value = _anchor(event, {}, anchors)
+    merged = []
+    while not loader.check_event(MappingEndEvent):
+        key = _construct(loader, anchors)
+        item = _construct(loader, anchors)
+        if key is _MERGE:
+            merged.extend(item if isinstance(item, list) else [item])
+        else:
+            value[key] = item
+    loader.get_event()
+    for mapping in merged:
+        for key, item in mapping.iteritems():
+            value.setdefault(key, item)
+    return value
@@ -2,9 +2,12 @@ import bcrypt
 import collections
 from functools import wraps
 import json
+from Queue import Queue
 from random import SystemRandom
 import re
 import string
+import threading
+import time
 import requests
 from urllib import urlencode
 from urlparse import parse_qs, urlsplit, urlunsplit
@@ -243,3 +246,118 @@ def send_email(from_email, to_emails, subject, text, smtp_domain):
         auth=("api", api_key),
         data={"from": from_email, "to": to_emails, "subject": subject, "text": text},
     )
+
+
+def bounded_imap(func, iterable, max_workers, ordered=True, max_pending=None):
+    """
+    Lazily apply ``func`` to each item of ``iterable`` on a pool of
+    ``max_workers`` threads, yielding results as they complete.
+
+    At most ``max_pending`` items (default twice the number of workers) are
+    taken from ``iterable`` before their results have been yielded, so memory
+    stays flat regardless of how long ``iterable`` is. If ``ordered`` is true
+    results are yielded in input order, otherwise in completion order.
+
+    If ``func`` raises, the exception instance is yielded in place of the
+    result, so that one failing item doesn't abort the rest.
+
+    Args:
+        func (Callable[[T], R]): function to apply
+        iterable (Iterable[T]): items to process; consumed lazily
+        max_workers (int): number of worker threads
+        ordered (bool): whether to preserve input order
+        max_pending (Optional[int]): maximum number of items in flight
+
+    Return:
+        Generator[Union[R, Exception]]
+    """
+    max_workers = max(int(max_workers), 1)
+    max_pending = max(int(max_pending or 2 * max_workers), 1)
+    tasks = Queue()
+    results = Queue()
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            index, item = task
+            try:
+                result = func(item)
+            except Exception as e:
+                result = e
+            results.put((index, result))
+
+    workers = [threading.Thread(target=work) for _ in range(max_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    items = iter(iterable)
+    submitted = 0
+    yielded = 0
+    exhausted = False
+    next_index = 0
+    completed = {}
+    try:
+        while True:
+            while not exhausted and submitted - yielded < max_pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tasks.put((submitted, item))
+                submitted += 1
+            if exhausted and yielded == submitted:
+                return
+
+            index, result = results.get()
+            if not ordered:
+                yielded += 1
+                yield result
+                continue
+            completed[index] = result
+            while next_index in completed:
+                yielded += 1
+                next_index += 1
+                yield completed.pop(next_index - 1)
+    finally:
+        # workers finish whatever they're currently running and then exit
+        for _ in workers:
+            tasks.put(None)
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing ``rate`` calls per second on average and bursts of
+    up to ``burst`` calls, shared by any number of threads.
+
+    Example:
+
+        limiter = RateLimiter(10)
+        for item in items:
+            limiter.acquire()  # blocks until a call is allowed
+            call_api(item)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = max(float(burst or rate), 1.0)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,11 @@
+"""
+Load tests for fence, run against local stand-ins for indexd, AWS and Google.
+
+They are skipped unless pytest is given ``--loadtest``::
+
+    pytest tests/benchmarks --loadtest -s
+
+Sizes and stand-in latencies can be changed with the ``LOADTEST_*`` and
+``SYNC_LOADTEST_*`` environment variables read in
+``tests/benchmarks/conftest.py``.
+"""
@@ -0,0 +1,111 @@
+import os
+
+from addict import Dict
+import pytest
+
+from fence import models
+from fence.resources.google.utils import url_signing_key_cache
+
+
+LOADTEST_USERNAME = "loadtest-user"
+
+
+@pytest.fixture(scope="session")
+def loadtest_config():
+    """
+    Size of the load test and latencies (in seconds) of the stand-ins.
+    """
+    return Dict(
+        requests=int(os.environ.get("LOADTEST_REQUESTS", 2000)),
+        concurrency=int(os.environ.get("LOADTEST_CONCURRENCY", 16)),
+        records=int(os.environ.get("LOADTEST_RECORDS", 500)),
+        indexd_latency=float(os.environ.get("LOADTEST_INDEXD_LATENCY", 0.005)),
+        aws_latency=float(os.environ.get("LOADTEST_AWS_LATENCY", 0.02)),
+        google_latency=float(os.environ.get("LOADTEST_GOOGLE_LATENCY", 0.02)),
+        p95_budget=float(os.environ.get("LOADTEST_P95_BUDGET", 1.0)),
+    )
+
+
+@pytest.fixture(scope="session")
+def sync_loadtest_config():
+    """
+    Size and shape of the synthetic access for the user sync load test, and
+    latencies (in seconds) of the storage and arborist stand-ins.
+    """
+    return Dict(
+        users=int(os.environ.get("SYNC_LOADTEST_USERS", 20000)),
+        yaml_users=int(os.environ.get("SYNC_LOADTEST_YAML_USERS", 1000)),
+        projects=int(os.environ.get("SYNC_LOADTEST_PROJECTS", 50)),
+        consent_codes=int(os.environ.get("SYNC_LOADTEST_CONSENT_CODES", 2)),
+        overlap=float(os.environ.get("SYNC_LOADTEST_OVERLAP", 0.3)),
+        churn=float(os.environ.get("SYNC_LOADTEST_CHURN", 0.05)),
+        parse_processes=int(os.environ.get("SYNC_LOADTEST_PARSE_PROCESSES", 4)),
+        storage_latency=float(os.environ.get("SYNC_LOADTEST_STORAGE_LATENCY", 0.0)),
+        arborist_latency=float(os.environ.get("SYNC_LOADTEST_ARBORIST_LATENCY", 0.0)),
+        # fail if a sync takes longer or executes more statements than this
+        max_seconds=float(os.environ.get("SYNC_LOADTEST_MAX_SECONDS", 0)) or None,
+        max_statements=int(os.environ.get("SYNC_LOADTEST_MAX_STATEMENTS", 0)) or None,
+    )
+
+
+@pytest.fixture(scope="function")
+def loadtest_user(app):
+    """
+    Commit a user with read-storage on ``phs000218``, a proxy group and a
+    primary service account, then remove them after the test.
+
+    The data is committed instead of using the ``db_session`` fixture because
+    requests are handled concurrently, each with its own session.
+    """
+    with app.db.session as session:
+        created_project = False
+        project = session.query(models.Project).filter_by(auth_id="phs000218").first()
+        if not project:
+            project = models.Project(name="phs000218", auth_id="phs000218")
+            session.add(project)
+            created_project = True
+        proxy_group = models.GoogleProxyGroup(
+            id="loadtest-proxy-group", email="loadtest-proxy-group@test.com"
+        )
+        session.add(proxy_group)
+        user = models.User(
+            username=LOADTEST_USERNAME, google_proxy_group_id=proxy_group.id
+        )
+        session.add(user)
+        session.add(
+            models.AccessPrivilege(
+                project=project, user=user, privilege=["read", "read-storage"]
+            )
+        )
+        session.flush()
+        session.add(
+            models.GoogleServiceAccount(
+                google_unique_id="loadtest-service-account",
+                email="loadtest-service-account@test.com",
+                user_id=user.id,
+                client_id=None,
+                google_project_id="loadtest-project",
+            )
+        )
+        user_id = user.id
+
+    yield Dict(username=LOADTEST_USERNAME, user_id=user_id)
+
+    url_signing_key_cache.clear()
+    with app.db.session as session:
+        service_account = (
+            session.query(models.GoogleServiceAccount)
+            .filter_by(user_id=user_id)
+            .first()
+        )
+        session.query(models.GoogleServiceAccountKey).filter_by(
+            service_account_id=service_account.id
+        ).delete()
+        session.delete(service_account)
+        session.query(models.AccessPrivilege).filter_by(user_id=user_id).delete()
+        session.query(models.User).filter_by(id=user_id).delete()
+        session.query(models.GoogleProxyGroup).filter_by(
+            id="loadtest-proxy-group"
+        ).delete()
+        if created_project:
+            session.query(models.Project).filter_by(auth_id="phs000218").delete()
@@ -0,0 +1,454 @@
+"""
+Synthetic access files, stand-ins and a driver for benchmarking the user sync.
+
+``make_access`` draws synthetic dbGaP access at any scale, which
+``generate_dbgap_files`` and ``generate_user_yaml`` write out as access files
+for ``UserSyncer``. Storage backends and arborist are replaced by in-memory
+stand-ins which only sleep for a configurable latency, so what is measured is
+the parsing, diffing and database writes of the sync itself.
+"""
+
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import wraps
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+from mock import patch
+from sqlalchemy import event
+import yaml
+
+from fence.resources import userdatamodel as udm
+from tests.benchmarks.harness import _import_attribute
+
+
+DBGAP_HEADER = (
+    "user name, login, authority, role, email, phone, status, phsid, "
+    "permission set, created, updated, expires, downloader for"
+)
+DBGAP_ROW = (
+    '{name},{login},eRA,PI,{email},"123-456-789",active,{phsid},'
+    '"General Research Use",2013-03-19 12:32:12.600,'
+    "2015-05-14 16:01:16.923,2016-05-14 00:00:00.000,"
+)
+
+#: Functions timed separately in the report, by phase name. Phases may nest
+#: (``apply`` includes ``users`` to ``update_db``).
+SYNC_PHASES = OrderedDict(
+    [
+        ("parse_csv", "fence.sync.sync_users.UserSyncer._parse_csv"),
+        ("load_yaml", "fence.sync.sync_users.UserSyncer._load_user_yaml"),
+        (
+            "apply",
+            "fence.sync.sync_users.UserSyncer.sync_to_db_and_storage_backend",
+        ),
+        ("users", "fence.sync.sync_users.UserSyncer._upsert_userinfo"),
+        ("revoke_storage", "fence.sync.sync_users.UserSyncer._revoke_from_storage"),
+        ("revoke_db", "fence.sync.sync_users.UserSyncer._revoke_from_db"),
+        ("grant_storage", "fence.sync.sync_users.UserSyncer._grant_from_storage"),
+        ("grant_db", "fence.sync.sync_users.UserSyncer._grant_from_db"),
+        ("update_db", "fence.sync.sync_users.UserSyncer._update_from_db"),
+        ("arborist", "fence.sync.sync_users.UserSyncer._update_arborist"),
+    ]
+)
+
+
+def phsid(project):
+    """
+    Return the dbGaP study id of synthetic project number ``project``.
+    """
+    return "phs{:06d}".format(900000 + project)
+
+
+def make_access(
+    users,
+    projects,
+    consent_codes=2,
+    overlap=0.2,
+    churn=0.0,
+    seed=0,
+    prefix="USER",
+):
+    """
+    Draw synthetic dbGaP access.
+
+    Every user has access to one project, and a fraction ``overlap`` of them
+    to up to three more, each with a random subset of the ``consent_codes``.
+    A fraction ``churn`` of the users have their access drawn again, so the
+    access for ``churn=0`` and ``churn>0`` with the same ``seed`` differ by
+    about that fraction of users.
+
+    Return:
+        dict: login -> {project number -> sorted consent code numbers}
+    """
+    access = {}
+    for i in range(users):
+        user_seed = "{}-{}".format(seed, i)
+        if churn and random.Random(user_seed + "-churned").random() < churn:
+            user_seed += "-churn"
+        rng = random.Random(user_seed)
+        user_projects = {i % projects}
+        if rng.random() < overlap:
+            user_projects.update(
+                rng.randrange(projects) for _ in range(rng.randint(1, 3))
+            )
+        codes = range(1, consent_codes + 1)
+        access["{}{:07d}".format(prefix, i)] = {
+            project: sorted(rng.sample(codes, rng.randint(1, consent_codes)))
+            for project in user_projects
+        }
+    return access
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Return the memory used by ``obj`` and everything it references (through
+    containers and instance attributes), counting shared objects once.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(
+            deep_sizeof(key, seen) + deep_sizeof(value, seen)
+            for key, value in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+
+def generate_dbgap_files(directory, access):
+    """
+    Write ``access`` (from ``make_access``) to ``directory`` as one
+    unencrypted dbGaP access file per project.
+
+    Return:
+        List[str]: paths of the files
+    """
+    rows = defaultdict(list)
+    for login, projects in sorted(access.items()):
+        for project, codes in sorted(projects.items()):
+            for code in codes:
+                rows[project].append(
+                    DBGAP_ROW.format(
+                        name="User " + login,
+                        login=login,
+                        email=login.lower() + "@example.com",
+                        phsid="{}.v1.p1.c{}".format(phsid(project), code),
+                    )
+                )
+    paths = []
+    for project, lines in sorted(rows.items()):
+        path = os.path.join(
+            directory, "authentication_file_{}.txt".format(phsid(project))
+        )
+        with open(path, "w") as f:
+            f.write("\n".join([DBGAP_HEADER] + lines) + "\n")
+        paths.append(path)
+    return paths
+
+
+def generate_user_yaml(path, access, privileges=("read", "read-storage")):
+    """
+    Write ``access`` (from ``make_access``, consent codes are ignored) to
+    ``path`` as a user.yaml, with a resource ``/programs/<phsid>`` for every
+    project.
+    """
+    projects = sorted({project for user in access.values() for project in user})
+    data = {
+        "cloud_providers": {},
+        "groups": {},
+        "resources": [
+            {
+                "name": "programs",
+                "subresources": [{"name": phsid(project)} for project in projects],
+            }
+        ],
+        "users": {
+            login: {
+                "admin": False,
+                "email": login + "@example.com",
+                "projects": [
+                    {
+                        "auth_id": phsid(project),
+                        "resource": "/programs/" + phsid(project),
+                        "privilege": list(privileges),
+                    }
+                    for project in sorted(user_projects)
+                ],
+            }
+            for login, user_projects in access.items()
+        },
+    }
+    with open(path, "w") as f:
+        yaml.safe_dump(data, f, default_flow_style=False)
+
+
+def create_projects(session, auth_ids, provider, backend="cleversafe"):
+    """
+    Create ``provider`` and the projects with ``auth_ids``, each with a bucket
+    in ``provider``, so that the sync also changes access in storage.
+    """
+    udm.create_provider(session, provider, backend=backend)
+    for auth_id in auth_ids:
+        udm.create_project_with_dict(
+            session,
+            {
+                "auth_id": auth_id,
+                "storage_accesses": [
+                    {"name": provider, "buckets": ["bucket-" + auth_id.lower()]}
+                ],
+            },
+        )
+    session.commit()
+
+
+StorageUser = namedtuple("StorageUser", ["username"])
+
+
+class FakeStorageClient(object):
+    """
+    Stand-in for a ``storageclient`` client keeping users and bucket ACLs in
+    memory, which sleeps for ``latency`` seconds on every call.
+
+    Example:
+
+        patch(
+            "fence.resources.storage.get_client",
+            FakeStorageClient.factory(latency=0.01),
+        )
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.users = {}
+        self.acls = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, latency=0.0):
+        clients = []
+
+        def get_client(config=None, backend=None):
+            clients.append(cls(latency))
+            return clients[-1]
+
+        get_client.clients = clients
+        return get_client
+
+    def _call(self):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+
+    def get_user(self, username):
+        self._call()
+        return self.users.get(username)
+
+    def get_or_create_user(self, username):
+        self._call()
+        with self._lock:
+            return self.users.setdefault(username, StorageUser(username))
+
+    def add_bucket_acl(self, bucket, username, access=None):
+        self._call()
+        with self._lock:
+            self.acls.add((bucket, username))
+
+    def delete_bucket_acl(self, bucket, username):
+        self._call()
+        with self._lock:
+            self.acls.discard((bucket, username))
+
+
+class FakeArboristClient(object):
+    """
+    Stand-in for ``fence.rbac.client.ArboristClient`` keeping resources, roles
+    and policies in memory, which sleeps for ``latency`` seconds on every
+    call.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.resources = {}
+        self.roles = set()
+        self.policies = set()
+
+    def _call(self):
+        time.sleep(self.latency)
+        self.calls += 1
+
+    def healthy(self):
+        self._call()
+        return True
+
+    def list_resources(self):
+        self._call()
+        return {
+            "resources": [
+                {"name": path.rsplit("/", 1)[-1], "path": path}
+                for path in self.resources
+            ]
+        }
+
+    def list_roles(self):
+        self._call()
+        return {"roles": [{"id": role} for role in self.roles]}
+
+    def list_policies(self):
+        self._call()
+        return {"policies": list(self.policies)}
+
+    def create_resource(self, parent_path, resource_json, overwrite=False):
+        self._call()
+
+        def add(parent, resource):
+            path = parent.rstrip("/") + "/" + resource["name"]
+            self.resources[path] = resource
+            for subresource in resource.get("subresources", []):
+                add(path, subresource)
+
+        add(parent_path, resource_json)
+
+    def create_role(self, role_json):
+        self._call()
+        self.roles.add(role_json["id"])
+
+    def create_policy(self, policy_json, skip_if_exists=True):
+        self._call()
+        self.policies.add(policy_json["id"])
+
+
+class StatementCounter(object):
+    """
+    Count the SQL statements executed on an engine while in the ``with``
+    block (an ``executemany`` counts once).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+class SyncProfiler(object):
+    """
+    Accumulate the wall time and SQL statements spent in each of the
+    ``SYNC_PHASES`` while the ``patchers()`` are started.
+    """
+
+    def __init__(self, counter, phases=None):
+        self.counter = counter
+        self.phases = phases or SYNC_PHASES
+        self.seconds = defaultdict(float)
+        self.statements = defaultdict(int)
+
+    def _timed(self, phase, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            statements = self.counter.count
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[phase] += time.time() - start
+                self.statements[phase] += self.counter.count - statements
+
+        return wrapper
+
+    def patchers(self):
+        patchers = []
+        for phase, target in self.phases.items():
+            module_path, attribute = target.rsplit(".", 1)
+            owner = _import_attribute(module_path)
+            original = owner.__dict__.get(attribute, getattr(owner, attribute))
+            if isinstance(original, (classmethod, staticmethod)):
+                wrapped = type(original)(self._timed(phase, original.__func__))
+            else:
+                wrapped = self._timed(phase, original)
+            patchers.append(patch.object(owner, attribute, wrapped))
+        return patchers
+
+
+class SyncReport(object):
+    def __init__(self, elapsed, statements, profiler, max_rss_kb, children_rss_kb):
+        self.elapsed = elapsed
+        self.statements = statements
+        self.phase_seconds = profiler.seconds
+        self.phase_statements = profiler.statements
+        self.phases = profiler.phases
+        self.max_rss_kb = max_rss_kb
+        self.children_rss_kb = children_rss_kb
+
+    def format(self):
+        lines = [
+            "sync in {:.2f}s, {} statements, peak RSS {:.0f} MB "
+            "(parse workers {:.0f} MB)".format(
+                self.elapsed,
+                self.statements,
+                self.max_rss_kb / 1024.0,
+                self.children_rss_kb / 1024.0,
+            ),
+            "{:<16} {:>10} {:>12}".format("phase", "seconds", "statements"),
+        ]
+        for phase in self.phases:
+            if phase not in self.phase_seconds:
+                continue
+            lines.append(
+                "{:<16} {:>10.2f} {:>12}".format(
+                    phase, self.phase_seconds[phase], self.phase_statements[phase]
+                )
+            )
+        return "\n".join(lines)
+
+
+def run_sync(syncer, engine):
+    """
+    Run ``syncer.sync()``, counting the statements executed on ``engine``.
+
+    Peak RSS is that of the whole process so far (and separately of the
+    largest parse worker process), since the OS only reports high-water marks.
+
+    Return:
+        SyncReport
+    """
+    counter = StatementCounter(engine)
+    profiler = SyncProfiler(counter)
+    patchers = profiler.patchers()
+    for patcher in patchers:
+        patcher.start()
+    try:
+        with counter:
+            start = time.time()
+            syncer.sync()
+            elapsed = time.time() - start
+    finally:
+        for patcher in reversed(patchers):
+            patcher.stop()
+
+    return SyncReport(
+        elapsed,
+        counter.count,
+        profiler,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
@@ -0,0 +1,59 @@
+import jwt
+from mock import patch
+import pytest
+
+from tests import utils
+from tests.benchmarks.harness import (
+    FakeIndexd,
+    PhaseTimer,
+    cloud_stubs,
+    make_records,
+    run_load,
+)
+
+
+@pytest.mark.loadtest
+def test_data_download_load(app, loadtest_user, loadtest_config, kid, rsa_private_key):
+    """
+    Drive ``GET /data/download/<did>`` concurrently over a mix of S3, assumed
+    role, Google and replicated records and report throughput and latency by
+    phase.
+    """
+    config = loadtest_config
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                loadtest_user.username, loadtest_user.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        )
+    }
+    records = make_records(config.records)
+    paths = [
+        "/data/download/{}".format(i % config.records) for i in range(config.requests)
+    ]
+
+    phase_timer = PhaseTimer()
+    # the stubs have to be in place before the phase timer wraps them
+    patchers = cloud_stubs(config.aws_latency, config.google_latency)
+    with FakeIndexd(records, latency=config.indexd_latency) as indexd:
+        patchers.append(patch.dict(app.config, {"INDEXD": indexd.url}))
+        for patcher in patchers:
+            patcher.start()
+        timer_patchers = phase_timer.patchers()
+        for patcher in timer_patchers:
+            patcher.start()
+        try:
+            report = run_load(
+                app, paths, config.concurrency, headers=headers, phase_timer=phase_timer
+            )
+        finally:
+            for patcher in reversed(patchers + timer_patchers):
+                patcher.stop()
+
+    print("\n" + report.format())
+    assert report.errors() == 0
+    assert report.summary(report.latencies)["p95"] <= config.p95_budget
@@ -0,0 +1,129 @@
+from mock import patch
+import pytest
+
+from fence.sync.sync_users import UserSyncer
+from fence.sync.user_projects import UserProjects
+from tests.benchmarks.sync_harness import (
+    FakeArboristClient,
+    FakeStorageClient,
+    create_projects,
+    deep_sizeof,
+    generate_dbgap_files,
+    generate_user_yaml,
+    make_access,
+    phsid,
+    run_sync,
+)
+from tests.test_settings import DB
+
+
+@pytest.mark.loadtest
+def test_user_sync_load(db_session, sync_loadtest_config, tmpdir):
+    """
+    Sync synthetic dbGaP access files and a user.yaml into an empty database,
+    then sync again after some of the access changed, and report the time and
+    SQL statements of each phase.
+    """
+    config = sync_loadtest_config
+    csv_dir = tmpdir.mkdir("csv")
+    yaml_path = str(tmpdir.join("user.yaml"))
+
+    def access(churn):
+        return make_access(
+            config.users,
+            config.projects,
+            consent_codes=config.consent_codes,
+            overlap=config.overlap,
+            churn=churn,
+        )
+
+    generate_dbgap_files(str(csv_dir), access(churn=0))
+    generate_user_yaml(
+        yaml_path,
+        make_access(
+            config.yaml_users,
+            config.projects,
+            consent_codes=1,
+            overlap=config.overlap,
+            seed=1,
+            prefix="yamluser",
+        ),
+    )
+    create_projects(
+        db_session,
+        [
+            "{}.c{}".format(phsid(project), code)
+            for project in range(config.projects)
+            for code in range(1, config.consent_codes + 1)
+        ]
+        + [phsid(project) for project in range(config.projects)],
+        "loadtest-storage",
+    )
+
+    get_client = FakeStorageClient.factory(config.storage_latency)
+    with patch("fence.resources.storage.get_client", get_client):
+        syncer = UserSyncer(
+            dbGaP={"parse_processes": config.parse_processes},
+            DB=DB,
+            project_mapping=None,
+            storage_credentials={"loadtest-storage": {"backend": "cleversafe"}},
+            db_session=db_session,
+            sync_from_local_csv_dir=str(csv_dir),
+            sync_from_local_yaml_file=yaml_path,
+        )
+    syncer.arborist_client = FakeArboristClient(config.arborist_latency)
+    engine = db_session.get_bind().engine
+
+    reports = [("initial", run_sync(syncer, engine))]
+    generate_dbgap_files(str(csv_dir), access(churn=config.churn))
+    reports.append(("churned", run_sync(syncer, engine)))
+
+    for name, report in reports:
+        print("\n{} {}".format(name, report.format()))
+    print(
+        "storage calls: {}, arborist calls: {}".format(
+            get_client.clients[0].calls, syncer.arborist_client.calls
+        )
+    )
+    for _, report in reports:
+        if config.max_seconds:
+            assert report.elapsed <= config.max_seconds
+        if config.max_statements:
+            assert report.statements <= config.max_statements
+
+
+@pytest.mark.loadtest
+def test_user_projects_memory(sync_loadtest_config):
+    """
+    Compare the memory used by the access of ``users`` users as nested dicts
+    of sets, like the sync used to keep it, and as a ``UserProjects``.
+    """
+    config = sync_loadtest_config
+    access = make_access(
+        config.users,
+        config.projects,
+        consent_codes=config.consent_codes,
+        overlap=config.overlap,
+    )
+    # strings are built the same way for both, so that only the structure
+    # holding them is compared
+    nested = {
+        login: {
+            "{}.c{}".format(phsid(project), code): {"read-storage"}
+            for project, codes in projects.items()
+            for code in codes
+        }
+        for login, projects in access.items()
+    }
+    compact = UserProjects(nested)
+    assert compact == nested
+
+    logins = sum(deep_sizeof(login) for login in nested)
+    nested_size = deep_sizeof(nested) - logins
+    compact_size = deep_sizeof(compact) - logins
+    print(
+        "\n{} users: nested dicts {:.1f} MB, UserProjects {:.1f} MB".format(
+            len(nested), nested_size / 1e6, compact_size / 1e6
+        )
+    )
+    assert compact_size < nested_size
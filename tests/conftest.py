@@ -50,6 +50,30 @@ def _compile_drop_table(element, compiler, **kwargs):
 os.environ["AUTHLIB_INSECURE_TRANSPORT"] = "true"
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--loadtest",
+        action="store_true",
+        default=False,
+        help="run the load tests in tests/benchmarks",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "loadtest: load test against local stand-ins (needs --loadtest)"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--loadtest"):
+        return
+    skip_loadtest = pytest.mark.skip(reason="load tests only run with --loadtest")
+    for item in items:
+        if "loadtest" in item.keywords:
+            item.add_marker(skip_loadtest)
+
+
 def indexd_get_available_s3_bucket(file_id):
     return {
         "did": "",
@@ -1,10 +1,127 @@
+from StringIO import StringIO
+import glob
+import hashlib
+import os
+
+from mock import MagicMock
+import paramiko
 import pytest
 import yaml
 
 from fence import models
+from fence.errors import InternalError
+from fence.sync import sync_users
 from fence.sync.sync_users import _format_policy_id
+from fence.sync.user_projects import UserProjects
+from fence.sync.user_yaml import UserYaml
+
+from tests.dbgap_sync.conftest import LOCAL_CSV_DIR, LOCAL_YAML_DIR
+
+
+class LocalSFTP(object):
+    """
+    Stand-in for ``paramiko.SFTPClient`` serving files from a local directory.
+    """
+
+    class File(file):
+        def prefetch(self):
+            pass
+
+        def check(self, hash_algorithm):
+            if not self.supports_check:
+                raise IOError("check-file not supported")
+            with open(self.name, "rb") as f:
+                return hashlib.new(hash_algorithm, f.read()).digest()
+
+    def __init__(self, root, opened, supports_check=False):
+        self.root = root
+        self.opened = opened
+        self.supports_check = supports_check
+
+    def listdir_attr(self, path):
+        path = os.path.join(self.root, path)
+        return [
+            paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+            for name in sorted(os.listdir(path))
+        ]
+
+    def open(self, path, mode):
+        self.opened.append(path)
+        remote_file = self.File(os.path.join(self.root, path), mode)
+        remote_file.supports_check = self.supports_check
+        return remote_file
+
+    def close(self):
+        pass
+
+
+def test_download_dir(tmpdir):
+    """
+    Test that files are downloaded concurrently, that an interrupted download
+    resumes and that files which are already downloaded are skipped.
+    """
+    remote = tmpdir.mkdir("remote")
+    remote.join("a.txt").write("a" * 10)
+    remote.mkdir("sub").join("b.txt").write("b")
+    local = tmpdir.mkdir("local")
+    mtime = int(remote.join("a.txt").mtime())
+    local.join("a.txt.10-{}.part".format(mtime)).write("x" * 4)
+
+    opened = []
+
+    def download():
+        return sync_users.download_dir(
+            LocalSFTP(str(remote), opened),
+            ".",
+            str(local),
+            open_sftp=lambda: LocalSFTP(str(remote), opened),
+            workers=2,
+        )
+
+    paths = download()
+    assert sorted(paths) == [str(local.join("a.txt")), str(local.join("sub", "b.txt"))]
+    assert local.join("a.txt").read() == "x" * 4 + "a" * 6
+    assert local.join("sub", "b.txt").read() == "b"
+    assert len(opened) == 2
+
+    download()
+    assert len(opened) == 2
 
-from tests.dbgap_sync.conftest import LOCAL_YAML_DIR
+
+def test_download_dir_checksums(tmpdir):
+    """
+    Test that a resumed download which doesn't match the remote checksum is
+    downloaded again from the start, and that a downloaded file which no
+    longer matches its recorded checksum is downloaded again.
+    """
+    remote = tmpdir.mkdir("remote")
+    remote.join("a.txt").write("a" * 10)
+    local = tmpdir.mkdir("local")
+    mtime = int(remote.join("a.txt").mtime())
+    local.join("a.txt.10-{}.part".format(mtime)).write("x" * 4)
+
+    opened = []
+
+    def download():
+        return sync_users.download_dir(
+            LocalSFTP(str(remote), opened, supports_check=True), ".", str(local)
+        )
+
+    download()
+    assert local.join("a.txt").read() == "a" * 10
+    assert local.join("a.txt.sha1").read() == hashlib.sha1("a" * 10).hexdigest()
+    assert not local.join("a.txt.10-{}.part".format(mtime)).exists()
+    assert len(opened) == 1
+
+    download()
+    assert len(opened) == 1
+
+    # same size and modification time, different content
+    local.join("a.txt").write("b" * 10)
+    local.join("a.txt").setmtime(mtime)
+    download()
+    assert local.join("a.txt").read() == "a" * 10
+    assert len(opened) == 2
 
 
 @pytest.mark.parametrize("syncer", ["google", "cleversafe"], indirect=True)
@@ -83,6 +200,38 @@ def test_sync(syncer, db_session, storage_client):
     assert not user_access
 
 
+@pytest.mark.parametrize("syncer", ["google"], indirect=True)
+def test_sync_incremental(syncer, db_session, storage_client, monkeypatch):
+    """
+    Test that a sync after an unchanged sync does not parse files or write
+    access again unless it is a full sync.
+    """
+    syncer.parse_processes = 1
+    syncer.sync()
+
+    # changed outside of the sync
+    user = db_session.query(models.User).filter_by(username="USERC").one()
+    db_session.query(models.AccessPrivilege).filter_by(user_id=user.id).delete()
+    db_session.commit()
+
+    parse = MagicMock(side_effect=sync_users._parse_dbgap_file)
+    monkeypatch.setattr(sync_users, "_parse_dbgap_file", parse)
+    syncer.sync()
+    assert not parse.called
+    user = db_session.query(models.User).filter_by(username="USERC").one()
+    assert user.project_access == {}
+
+    syncer.full_sync = True
+    syncer.sync()
+    assert parse.called
+    user = db_session.query(models.User).filter_by(username="USERC").one()
+    assert user.project_access == {
+        "phs000178": ["read-storage"],
+        "TCGA-PCAWG": ["read-storage"],
+        "phs000179.c1": ["read-storage"],
+    }
+
+
 @pytest.mark.parametrize("syncer", ["google", "cleversafe"], indirect=True)
 def test_sync_from_files(syncer, db_session, storage_client):
     sess = db_session
@@ -105,6 +254,27 @@ def test_sync_from_files(syncer, db_session, storage_client):
     assert u.project_access == {"phs000179": ["read-storage", "write-storage"]}
 
 
+@pytest.mark.parametrize("syncer", ["google"], indirect=True)
+def test_parse_csv_in_processes(syncer, db_session):
+    """
+    Test that parsing files in several processes gives the same result as
+    parsing them one by one.
+    """
+    file_dict = {
+        filepath: {"read-storage"}
+        for filepath in glob.glob(os.path.join(LOCAL_CSV_DIR, "*"))
+    }
+    syncer.parse_processes = 1
+    serial = syncer._parse_csv(file_dict, db_session, encrypted=False)
+    syncer.parse_processes = 2
+    assert syncer._parse_csv(file_dict, db_session, encrypted=False) == serial
+    assert serial[0]["USERC"] == {
+        "phs000178": {"read-storage"},
+        "TCGA-PCAWG": {"read-storage"},
+        "phs000179.c1": {"read-storage"},
+    }
+
+
 @pytest.mark.parametrize("syncer", ["google", "cleversafe"], indirect=True)
 def test_sync_revoke(syncer, db_session, storage_client):
     phsids = {
@@ -133,6 +303,93 @@ def test_sync_revoke(syncer, db_session, storage_client):
         raise AssertionError()
 
 
+@pytest.mark.parametrize("syncer", ["google"], indirect=True)
+def test_sync_resumes_after_interruption(
+    syncer, db_session, storage_client, monkeypatch
+):
+    """
+    Test that chunks applied before a sync is interrupted are kept, and that
+    running the sync again applies the rest.
+    """
+    phsids = {
+        "userA": {"phs000178": {"read-storage"}, "phs000179": {"read-storage"}},
+        "userB": {"phs000179": {"read-storage"}},
+    }
+    userinfo = {
+        "userA": {"email": "a@b", "tags": {}},
+        "userB": {"email": "a@b", "tags": {}},
+    }
+    syncer.chunk_size = 1
+
+    grant_from_storage = syncer._grant_from_storage
+    calls = []
+
+    def interrupt_second_chunk(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("interrupted")
+        return grant_from_storage(*args)
+
+    monkeypatch.setattr(syncer, "_grant_from_storage", interrupt_second_chunk)
+    with pytest.raises(RuntimeError):
+        syncer.sync_to_db_and_storage_backend(phsids, userinfo, db_session)
+    assert db_session.query(models.AccessPrivilege).count() == 1
+
+    monkeypatch.setattr(syncer, "_grant_from_storage", grant_from_storage)
+    syncer.sync_to_db_and_storage_backend(phsids, userinfo, db_session)
+    assert db_session.query(models.AccessPrivilege).count() == 3
+
+
+@pytest.mark.parametrize("syncer", ["cleversafe"], indirect=True)
+def test_sync_storage_failure(syncer, db_session, storage_client, monkeypatch):
+    """
+    Test that access which could not be granted in the storage backend is
+    not recorded in the database, while the rest of the chunk is.
+    """
+    phsids = {
+        "userA": {"phs000178": {"read-storage"}},
+        "userB": {"phs000179": {"read-storage"}},
+    }
+    userinfo = {
+        "userA": {"email": "a@b", "tags": {}},
+        "userB": {"email": "a@b", "tags": {}},
+    }
+    client = syncer.storage_manager.clients["test-cleversafe"]
+    add_bucket_acl = client.add_bucket_acl
+
+    def fail_for_user_b(bucket, username, **kwargs):
+        if username == "userB":
+            raise RuntimeError("storage unavailable")
+        return add_bucket_acl(bucket, username, **kwargs)
+
+    monkeypatch.setattr(client, "add_bucket_acl", fail_for_user_b)
+    with pytest.raises(InternalError):
+        syncer.sync_to_db_and_storage_backend(phsids, userinfo, db_session)
+    access = db_session.query(models.AccessPrivilege).all()
+    assert [privilege.user.username for privilege in access] == ["userA"]
+
+
+@pytest.mark.parametrize("syncer", ["google", "cleversafe"], indirect=True)
+def test_sync_update_ignores_username_case(syncer, db_session, storage_client):
+    """
+    Test that access synced again for a username spelled with a different
+    case is updated in place rather than revoked and granted again.
+    """
+    userinfo = {"userA": {"email": "a@b", "tags": {}}}
+    phsids = {"userA": {"phs000178": {"read-storage"}}}
+    syncer.sync_to_db_and_storage_backend(phsids, userinfo, db_session)
+    access = db_session.query(models.AccessPrivilege).one()
+    access_id = access.id
+
+    userinfo2 = {"USERA": {"email": "a@b", "tags": {}}}
+    phsids2 = {"USERA": {"phs000178": {"read-storage", "write-storage"}}}
+    syncer.sync_to_db_and_storage_backend(phsids2, userinfo2, db_session)
+
+    access = db_session.query(models.AccessPrivilege).one()
+    assert access.id == access_id
+    assert sorted(access.privilege) == ["read-storage", "write-storage"]
+
+
 @pytest.mark.parametrize("syncer", ["google", "cleversafe"], indirect=True)
 def test_sync_two_phsids_dict(syncer, db_session, storage_client):
 
@@ -178,6 +435,29 @@ def test_sync_two_phsids_dict_override(syncer, db_session, storage_client):
     }
 
 
+@pytest.mark.parametrize("syncer", ["google", "cleversafe"], indirect=True)
+def test_sync_two_phsids_dict_user_projects(syncer, db_session, storage_client):
+    """
+    Merging into a ``UserProjects`` gives the same access as merging dicts,
+    and the map survives saving it in the sync state.
+    """
+    phsids1 = {
+        "userA": {"phs000178": {"read-storage"}, "phs000179": {"write-storage"}},
+        "userB": {"phs000179": {"read-storage", "write-storage"}},
+        "userC": {},
+    }
+    phsids2 = {"userA": {"phs000179": {"read-storage"}, "phs000180": {"admin"}}}
+
+    user_projects = UserProjects(phsids2)
+    syncer.sync_two_phsids_dict(UserProjects(phsids1), user_projects)
+    syncer.sync_two_phsids_dict(phsids1, phsids2)
+
+    assert user_projects == phsids2
+    assert user_projects["userA"]["phs000179"] == {"read-storage", "write-storage"}
+    assert "userC" in user_projects
+    assert UserProjects.from_json(user_projects.to_json()) == phsids2
+
+
 @pytest.mark.parametrize("syncer", ["google", "cleversafe"], indirect=True)
 def test_sync_two_user_info(syncer, db_session, storage_client):
     userinfo1 = {
@@ -339,3 +619,73 @@ def test_update_arborist(syncer, db_session):
                 )
                 user_policy_ids = [policy.id for policy in user_policies]
                 assert policy_id in user_policy_ids
+
+
+@pytest.mark.parametrize("syncer", ["cleversafe"], indirect=True)
+def test_update_arborist_diff(syncer, db_session):
+    """
+    Test that only the roles missing from arborist are created, and that the
+    policies granted to users are diffed against the database rather than
+    reset.
+    """
+    syncer.arborist_client.list_roles.return_value = {"roles": [{"id": "read"}]}
+    user = models.User(username="not_in_yaml")
+    user.policies.append(models.Policy(id="stale-read"))
+    db_session.add(user)
+    db_session.commit()
+
+    syncer.sync()
+
+    created_roles = [
+        call[0][0]["id"] for call in syncer.arborist_client.create_role.call_args_list
+    ]
+    assert "read" not in created_roles
+    assert "upload" in created_roles
+    user = db_session.query(models.User).filter_by(username="not_in_yaml").one()
+    assert user.policies == []
+
+
+@pytest.mark.parametrize("syncer", ["cleversafe"], indirect=True)
+def test_load_user_yaml_streaming(syncer):
+    """
+    Test that reading the user.yaml one user at a time gives the same result
+    as loading it at once, and catches users occurring twice.
+    """
+    loaded = syncer._load_user_yaml(LOCAL_YAML_DIR, encrypted=False)
+    syncer.stream_user_yaml = True
+    streamed = syncer._load_user_yaml(LOCAL_YAML_DIR, encrypted=False)
+
+    assert streamed.user_projects == loaded.user_projects
+    assert streamed.user_info == loaded.user_info
+    assert streamed.user_resources == loaded.user_resources
+    assert streamed.resources == loaded.resources
+    assert len(loaded.user_info) > 0
+
+    with pytest.raises(EnvironmentError):
+        UserYaml.load(StringIO("users:\n  userA: {}\n  userA: {}\n"), streaming=True)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_load_user_yaml_malformed_projects(streaming):
+    """
+    Test that a project with only a ``resource`` still gives the user access
+    to the resource, and that a project missing its privileges is left out
+    without dropping the user.
+    """
+    user_yaml = UserYaml.load(
+        StringIO(
+            "users:\n"
+            "  userA:\n"
+            "    projects:\n"
+            "    - resource: /programs/test\n"
+            "      privilege: [read]\n"
+            "    - auth_id: phs000178\n"
+            "      privilege: [read-storage]\n"
+            "    - auth_id: phs000179\n"
+        ),
+        streaming=streaming,
+    )
+
+    assert user_yaml.user_resources == {"userA": {"/programs/test": {"read"}}}
+    assert user_yaml.user_projects == {"userA": {"phs000178": {"read-storage"}}}
+    assert "userA" in user_yaml.user_info
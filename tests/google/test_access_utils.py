@@ -22,7 +22,10 @@ from cirrus.google_cloud.iam import GooglePolicyMember
 import fence
 from fence.errors import NotFound
 from fence.models import (
+    AccessPrivilege,
     Project,
+    User,
+    UserGoogleAccount,
     UserServiceAccount,
     ServiceAccountAccessPrivilege,
     ServiceAccountToGoogleBucketAccessGroup,
@@ -37,6 +40,12 @@ from fence.resources.google.access_utils import (
     extend_service_account_access,
     patch_user_service_account,
     remove_white_listed_service_account_ids,
+    do_all_users_have_access_to_project,
+)
+from fence.resources.google.utils import (
+    get_project_access_by_service_account,
+    get_project_access_from_service_accounts,
+    get_users_from_google_members,
 )
 
 
@@ -298,6 +307,57 @@ def test_extend_service_account_access(db_session, register_user_service_account
         assert access.expires > int(time.time())
 
 
+def test_batched_google_member_access(db_session, register_user_service_account):
+    """
+    Test that the users of Google members, the service accounts' access and
+    the users' access to a project are found for all of them at once.
+    """
+    service_account = register_user_service_account["service_account"]
+    project1, project2 = register_user_service_account["projects"]
+    users = []
+    for name in ["user_a", "user_b"]:
+        user = User(username=name)
+        db_session.add(user)
+        db_session.commit()
+        db_session.add(
+            UserGoogleAccount(user_id=user.id, email="{}@gmail.com".format(name))
+        )
+        db_session.add(
+            AccessPrivilege(user_id=user.id, project_id=project1.id, privilege=["read"])
+        )
+        users.append(user)
+    db_session.add(
+        AccessPrivilege(user_id=users[1].id, project_id=project2.id, privilege=["read"])
+    )
+    db_session.commit()
+
+    members = [
+        GooglePolicyMember("user", "User_B@gmail.com"),
+        GooglePolicyMember("user", "user_a@gmail.com"),
+    ]
+    assert [user.id for user in get_users_from_google_members(members)] == [
+        users[1].id,
+        users[0].id,
+    ]
+    with pytest.raises(NotFound):
+        get_users_from_google_members(
+            members + [GooglePolicyMember("user", "unlinked@gmail.com")]
+        )
+
+    assert do_all_users_have_access_to_project(users, project1.id)
+    assert not do_all_users_have_access_to_project(users, project2.id)
+    assert do_all_users_have_access_to_project(users[1:], project2.id)
+
+    project_access = get_project_access_by_service_account([service_account])
+    assert sorted(project.id for project in project_access[service_account.id]) == (
+        sorted([project1.id, project2.id])
+    )
+    assert sorted(
+        project.id
+        for project in get_project_access_from_service_accounts([service_account])
+    ) == sorted([project1.id, project2.id])
+
+
 def test_update_user_service_account_success(cloud_manager, db_session, setup_data):
     """
     test@gmail.com has access to test_auth_1 and test_auth_2 already
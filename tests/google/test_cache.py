@@ -0,0 +1,80 @@
+import threading
+import time
+
+# Python 2 and 3 compatible
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+import pytest
+
+from fence.resources.google.access_utils import (
+    get_google_project_number,
+    get_service_account_policy,
+)
+from fence.resources.google.cache import GoogleAPICache
+
+
+def test_cache_reads_once():
+    """
+    Test that concurrent reads of the same key call the API once, and that
+    hits are counted per kind of read.
+    """
+    cache = GoogleAPICache()
+    reads = []
+
+    def read(project_id):
+        reads.append(project_id)
+        time.sleep(0.01)
+        return {"projectNumber": "123"}
+
+    threads = [
+        threading.Thread(
+            target=cache.get, args=(("project_info", "project"), read, "project")
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert reads == ["project"]
+    assert cache.hits["project_info"] == 7
+    assert cache.misses["project_info"] == 1
+    assert "project_info 7/8" in cache.report()
+
+
+def test_cache_does_not_keep_errors():
+    """
+    Test that a read which raises is tried again by the next caller.
+    """
+    cache = GoogleAPICache()
+    read = MagicMock(side_effect=[Exception("unavailable"), "value"])
+
+    with pytest.raises(Exception):
+        cache.get(("kind", "key"), read)
+    assert cache.get(("kind", "key"), read) == "value"
+    assert cache.get(("kind", "key"), read) == "value"
+    assert read.call_count == 2
+
+
+def test_access_utils_use_cache():
+    """
+    Test that the access_utils helpers share reads through the cache, even
+    with different cloud managers.
+    """
+    cache = GoogleAPICache()
+    managers = [MagicMock(), MagicMock()]
+    for manager in managers:
+        manager.get_project_info.return_value = {"projectNumber": "123"}
+        manager.get_service_account_policy.return_value.status_code = 200
+
+    for manager in managers:
+        assert get_google_project_number("project", manager, cache=cache) == "123"
+        get_service_account_policy("sa@example.com", manager, cache=cache)
+
+    assert managers[0].get_project_info.call_count == 1
+    assert managers[0].get_service_account_policy.call_count == 1
+    assert not managers[1].get_project_info.called
+    assert not managers[1].get_service_account_policy.called
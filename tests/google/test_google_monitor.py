@@ -6,6 +6,8 @@ except ImportError:
     from mock import MagicMock
     from mock import patch
 
+from cirrus.google_cloud.iam import GooglePolicyMember
+
 import fence
 from fence.scripting.google_monitor import validation_check
 
@@ -13,6 +15,7 @@ from fence.models import (
     UserServiceAccount,
     ServiceAccountAccessPrivilege,
     Bucket,
+    GoogleProjectValidation,
     Project,
     ProjectToBucket,
 )
@@ -166,6 +169,167 @@ def test_validation_check_multiple_diff_projects(
     _assert_access("3@example.com", db_session)
 
 
+def test_validation_check_concurrent(monkeypatch):
+    """
+    Test that with a db url every Google project is validated on the worker
+    pool, and that a project which fails to validate doesn't stop the others.
+    """
+    registered_service_accounts = [
+        MagicMock(google_project_id="project-{}".format(i % 5), email="{}@sa".format(i))
+        for i in range(20)
+    ]
+    monkeypatch.setattr(
+        fence.scripting.google_monitor,
+        "get_all_registered_service_accounts",
+        MagicMock(return_value=registered_service_accounts),
+    )
+    validated = {}
+
+    def validate(google_project_id, sa_emails, **kwargs):
+        if google_project_id == "project-0":
+            raise Exception("boom")
+        validated[google_project_id] = sorted(sa_emails)
+
+    monkeypatch.setattr(
+        fence.scripting.google_monitor, "_validate_google_project", validate
+    )
+
+    validation_check(
+        db="postgresql://unused",
+        config={"GOOGLE_MONITOR_WORKERS": 4, "GOOGLE_API_REQUESTS_PER_SECOND": 100},
+    )
+
+    assert sorted(validated) == ["project-1", "project-2", "project-3", "project-4"]
+    assert validated["project-1"] == ["11@sa", "16@sa", "1@sa", "6@sa"]
+
+
+def test_validation_check_skips_unchanged_projects(
+    register_user_service_account, db_session, cloud_manager, monkeypatch
+):
+    """
+    Test that with a max validation age, a project found valid is skipped
+    while its fingerprint is the same, and validated again when it changes.
+    """
+    fingerprint = {"value": "a"}
+    monkeypatch.setattr(
+        fence.scripting.google_monitor,
+        "_get_google_project_fingerprint",
+        lambda *args, **kwargs: fingerprint["value"],
+    )
+    valid_project = MagicMock(return_value=True)
+    monkeypatch.setattr(
+        fence.scripting.google_monitor, "_is_valid_google_project", valid_project
+    )
+    monkeypatch.setattr(
+        fence.scripting.google_monitor,
+        "_is_valid_service_account",
+        MagicMock(return_value=True),
+    )
+    monkeypatch.setattr(
+        fence.scripting.google_monitor,
+        "_send_emails_informing_service_account_removal",
+        MagicMock(),
+    )
+    config = {"GOOGLE_MONITOR_MAX_VALIDATION_AGE": 3600}
+
+    validation_check(db=None, config=config)
+    validation_check(db=None, config=config)
+    assert valid_project.call_count == 1
+    validation = db_session.query(GoogleProjectValidation).one()
+    assert validation.fingerprint == "a"
+
+    fingerprint["value"] = "b"
+    validation_check(db=None, config=config)
+    assert valid_project.call_count == 2
+    assert db_session.query(GoogleProjectValidation).one().fingerprint == "b"
+
+    valid_project.return_value = None
+    fingerprint["value"] = "c"
+    validation_check(db=None, config=config)
+    assert valid_project.call_count == 3
+    assert db_session.query(GoogleProjectValidation).count() == 0
+
+
+def test_validation_check_fingerprints_projects(
+    register_user_service_account, db_session, cloud_manager, monkeypatch
+):
+    """
+    Test that the fingerprint is read through an opened cloud manager, and
+    that a change of a registered service account's policy etag makes the
+    project validated again.
+    """
+    manager = cloud_manager.return_value
+    opened = {"value": False}
+
+    def open_manager(*args):
+        opened["value"] = True
+        return manager
+
+    def close_manager(*args):
+        opened["value"] = False
+
+    def get_project_membership(*args):
+        assert opened["value"], "cloud manager used before being opened"
+        role = MagicMock()
+        role.name = "OWNER"
+        return [
+            MagicMock(
+                member_type=GooglePolicyMember.USER,
+                email_id="owner@example.com",
+                roles=[role],
+            )
+        ]
+
+    etag = {"value": "etag-1"}
+
+    def get_service_account_policy(*args):
+        assert opened["value"], "cloud manager used before being opened"
+        return MagicMock(status_code=200, json=lambda: {"etag": etag["value"]})
+
+    manager.__enter__.side_effect = open_manager
+    manager.__exit__.side_effect = close_manager
+    manager.get_project_membership.side_effect = get_project_membership
+    manager.get_service_account_policy.side_effect = get_service_account_policy
+    valid_project = MagicMock(return_value=True)
+    monkeypatch.setattr(
+        fence.scripting.google_monitor, "_is_valid_google_project", valid_project
+    )
+    monkeypatch.setattr(
+        fence.scripting.google_monitor,
+        "_is_valid_service_account",
+        MagicMock(return_value=True),
+    )
+    config = {"GOOGLE_MONITOR_MAX_VALIDATION_AGE": 3600}
+
+    validation_check(db=None, config=config)
+    validation_check(db=None, config=config)
+    assert valid_project.call_count == 1
+    assert db_session.query(GoogleProjectValidation).count() == 1
+
+    etag["value"] = "etag-2"
+    validation_check(db=None, config=config)
+    assert valid_project.call_count == 2
+
+
+def test_rate_limited_cloud_manager():
+    """
+    Test that calls through a wrapped GoogleCloudManager wait for the limiter,
+    but opening and closing it doesn't.
+    """
+    limiter = MagicMock()
+    manager = MagicMock()
+    gcm = fence.scripting.google_monitor._RateLimitedCloudManager(manager, limiter)
+
+    with gcm as entered:
+        entered.open()
+        entered.get_project_membership("project")
+        entered.close()
+
+    assert entered is gcm
+    manager.get_project_membership.assert_called_once_with("project")
+    assert limiter.acquire.call_count == 1
+
+
 def _assert_access(service_account_email, db_session, has_access=True):
     service_account = (
         db_session.query(UserServiceAccount)
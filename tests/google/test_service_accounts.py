@@ -60,6 +60,7 @@ from io import StringIO
 from urllib import quote
 
 from fence.models import (
+    AccessPrivilege,
     Bucket,
     Project,
     ProjectToBucket,
@@ -67,7 +68,10 @@ from fence.models import (
     UserServiceAccount,
     ServiceAccountAccessPrivilege,
     ServiceAccountToGoogleBucketAccessGroup,
+    User,
 )
+from fence.permissions import get_user_permission_indexes
+from fence.resources.google.access_utils import do_all_users_have_access_to_project
 
 # Python 2 and 3 compatible
 try:
@@ -687,6 +691,83 @@ def test_invalid_google_project_no_access(
     assert response.json["errors"]["project_access"]["status"] != 200
 
 
+def test_service_account_registration_checks_member_access(
+    app,
+    db_session,
+    client,
+    encoded_jwt_service_accounts_access,
+    cloud_manager,
+    valid_google_project_patcher,
+    valid_service_account_patcher,
+):
+    """
+    Test that registration checks the Google project members' access to the
+    requested project with their permission indexes
+    """
+    project = Project(id=1, auth_id="some_auth_id")
+    other_project = Project(id=2, auth_id="other_auth_id")
+    bucket = Bucket(id=1)
+    member = User(username="member")
+    db_session.add_all([project, other_project, bucket, member])
+    db_session.commit()
+    db_session.add(ProjectToBucket(project_id=1, bucket_id=1))
+    db_session.add(GoogleBucketAccessGroup(id=1, bucket_id=1, email="gbag@gmail.com"))
+    db_session.add(
+        AccessPrivilege(user_id=member.id, project_id=project.id, privilege=["read"])
+    )
+    db_session.commit()
+
+    valid_google_project_patcher["get_users_from_google_members"].return_value = [
+        member
+    ]
+    (
+        valid_google_project_patcher[
+            "get_project_access_from_service_accounts"
+        ].side_effect
+    ) = lambda *args, **kwargs: []
+    (
+        valid_google_project_patcher["do_all_users_have_access_to_project"].side_effect
+    ) = do_all_users_have_access_to_project
+    (
+        cloud_manager.return_value.__enter__.return_value.get_service_account.return_value
+    ) = {"uniqueId": "sa_unique_id", "email": "sa@gmail.com"}
+    (
+        cloud_manager.return_value.__enter__.return_value.add_member_to_group.return_value
+    ) = {"id": "sa@gmail.com"}
+    encoded_creds_jwt = encoded_jwt_service_accounts_access["jwt"]
+
+    def register(project_access):
+        service_account = {
+            "service_account_email": "sa@gmail.com",
+            "google_project_id": "project-id",
+            "project_access": project_access,
+        }
+        return client.post(
+            "/google/service_accounts",
+            headers={"Authorization": "Bearer " + encoded_creds_jwt},
+            data=json.dumps(service_account),
+            content_type="application/json",
+        )
+
+    with patch(
+        "fence.resources.google.access_utils.get_user_permission_indexes",
+        wraps=get_user_permission_indexes,
+    ) as get_indexes:
+        response = register(["other_auth_id"])
+        assert response.status_code == 400
+        _assert_expected_error_response_structure(response, ["other_auth_id"])
+        assert response.json["errors"]["project_access"]["status"] != 200
+        assert get_indexes.call_count == 1
+        assert get_indexes.call_args[0][0] == [member]
+
+        response = register(["some_auth_id"])
+        assert response.status_code == 200
+        assert get_indexes.call_count == 2
+
+    assert len(db_session.query(UserServiceAccount).all()) == 1
+    assert len(db_session.query(ServiceAccountAccessPrivilege).all()) == 1
+
+
 def test_valid_service_account_registration(
     app,
     db_session,
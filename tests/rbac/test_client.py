@@ -25,6 +25,18 @@ def test_get_resource_call(arborist_client):
         assert mock_get.called_with(arborist_client._base_url + "/resource/a/b/c")
 
 
+def test_list_resources_call(arborist_client):
+    with mock.patch("fence.rbac.client.requests.get") as mock_get:
+        arborist_client.list_resources()
+        mock_get.assert_called_with(arborist_client._base_url + "/resource")
+
+
+def test_list_roles_call(arborist_client):
+    with mock.patch("fence.rbac.client.requests.get") as mock_get:
+        arborist_client.list_roles()
+        mock_get.assert_called_with(arborist_client._base_url + "/role/")
+
+
 def test_list_policies_call(arborist_client):
     with mock.patch("fence.rbac.client.requests.get") as mock_get:
         arborist_client.list_policies()
@@ -0,0 +1,80 @@
+from mock import MagicMock, patch
+
+from fence.resources.aws.boto_manager import BotoManager, ClientPool
+
+
+CONFIG_A = {"aws_access_key_id": "key-a", "aws_secret_access_key": "secret-a"}
+CONFIG_B = {"aws_access_key_id": "key-b", "aws_secret_access_key": "secret-b"}
+
+
+def test_client_pool_reuses_clients():
+    """
+    Test that a client is only created once per service and credentials.
+    """
+    with patch("fence.resources.aws.boto_manager.client") as mock_client:
+        mock_client.side_effect = lambda service, **config: MagicMock()
+        pool = ClientPool(max_size=4)
+
+        s3_a = pool.get("s3", CONFIG_A)
+        assert pool.get("s3", dict(CONFIG_A)) is s3_a
+        assert pool.get("sts", CONFIG_A) is not s3_a
+        assert pool.get("s3", CONFIG_B) is not s3_a
+        assert mock_client.call_count == 3
+
+
+def test_client_pool_is_bounded():
+    """
+    Test that the least recently used client is evicted when the pool is full.
+    """
+    with patch("fence.resources.aws.boto_manager.client") as mock_client:
+        mock_client.side_effect = lambda service, **config: MagicMock()
+        pool = ClientPool(max_size=2)
+
+        s3_a = pool.get("s3", CONFIG_A)
+        pool.get("s3", CONFIG_B)
+        # touch A so B becomes the least recently used client
+        pool.get("s3", CONFIG_A)
+        pool.get("sts", CONFIG_A)
+
+        assert len(pool) == 2
+        assert pool.get("s3", CONFIG_A) is s3_a
+        assert mock_client.call_count == 3
+
+
+def test_boto_manager_does_not_replace_default_clients():
+    """
+    Test that per-request credentials use pooled clients instead of
+    reassigning the manager's shared clients.
+    """
+    with patch("fence.resources.aws.boto_manager.client") as mock_client:
+        mock_client.side_effect = lambda service, **config: MagicMock()
+        manager = BotoManager({}, logger=MagicMock())
+        default_s3_client = manager.s3_client
+        default_sts_client = manager.sts_client
+
+        manager.presigned_url("bucket", "key", 60, CONFIG_A)
+        manager.get_bucket_region("bucket", CONFIG_A)
+        manager.assume_role("arn:aws:iam::role", 900, CONFIG_A)
+
+        assert manager.s3_client is default_s3_client
+        assert manager.sts_client is default_sts_client
+        assert len(manager.client_pool) == 2
+
+
+def test_boto_manager_caches_bucket_regions():
+    """
+    Test that a bucket's region is only looked up from AWS once.
+    """
+    with patch("fence.resources.aws.boto_manager.client") as mock_client:
+        s3_client = MagicMock()
+        s3_client.get_bucket_location.return_value = {
+            "LocationConstraint": "us-west-2"
+        }
+        mock_client.side_effect = lambda service, **config: s3_client
+        manager = BotoManager({}, logger=MagicMock())
+
+        assert manager.get_cached_bucket_region("bucket") is None
+        assert manager.get_bucket_region("bucket", CONFIG_A) == "us-west-2"
+        assert manager.get_bucket_region("bucket", CONFIG_B) == "us-west-2"
+        assert manager.get_cached_bucket_region("bucket") == "us-west-2"
+        assert s3_client.get_bucket_location.call_count == 1
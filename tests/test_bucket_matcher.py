@@ -0,0 +1,38 @@
+from fence.resources.aws.bucket_matcher import S3BucketMatcher
+
+
+def test_exact_bucket_name_takes_precedence():
+    matcher = S3BucketMatcher(
+        {"bucket.*": {"cred": "CRED2"}, "bucket1": {"cred": "CRED1"}}
+    )
+    assert matcher.match("bucket1") == {"cred": "CRED1"}
+    assert matcher.match("bucket2") == {"cred": "CRED2"}
+
+
+def test_patterns_must_match_whole_bucket_name():
+    matcher = S3BucketMatcher({"bucket[0-9]": {"cred": "CRED1"}})
+    assert matcher.match("bucket1") == {"cred": "CRED1"}
+    assert matcher.match("bucket10") is None
+    assert matcher.match("xbucket1") is None
+
+
+def test_first_pattern_in_sorted_order_wins():
+    matcher = S3BucketMatcher(
+        {"b.*": {"cred": "CRED2"}, "a|bucket(1)": {"cred": "CRED1"}}
+    )
+    assert matcher.match("bucket1") == {"cred": "CRED1"}
+    assert matcher.match("bucket2") == {"cred": "CRED2"}
+
+
+def test_many_patterns():
+    """
+    Test that more patterns than fit in a single expression are all matched.
+    """
+    s3_buckets = {
+        "project-{}-(data|logs)".format(i): {"cred": "CRED{}".format(i)}
+        for i in range(300)
+    }
+    matcher = S3BucketMatcher(s3_buckets)
+    assert matcher.match("project-0-data") == {"cred": "CRED0"}
+    assert matcher.match("project-299-logs") == {"cred": "CRED299"}
+    assert matcher.match("project-300-logs") is None
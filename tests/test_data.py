@@ -1,8 +1,18 @@
 from . import utils
+import json
 import jwt
+from StringIO import StringIO
 import urlparse
+import time
 import pytest
+from mock import MagicMock, patch
+from fence.blueprints.data import IndexedFile, SignedUrlCache, rank_locations
 from fence.errors import NotSupported
+from fence.resources.google.utils import (
+    UrlSigningKeyCache,
+    get_or_create_primary_service_account_key,
+    url_signing_key_cache,
+)
 
 
 @pytest.mark.parametrize(
@@ -116,6 +126,176 @@ def test_indexd_download_file_no_protocol(
     assert "url" in response.json.keys()
 
 
+@pytest.mark.parametrize("indexd_client", ["gs", "gs_acl"], indirect=True)
+def test_indexd_download_file_reuses_url_signing_key(
+    client,
+    oauth_client,
+    user_client,
+    indexd_client,
+    kid,
+    rsa_private_key,
+    google_proxy_group,
+    primary_google_service_account,
+    cloud_manager,
+    google_signed_url,
+):
+    """
+    Test that repeated ``GET /data/download/1`` for the same user only looks up
+    and decrypts the url signing key once.
+    """
+    url_signing_key_cache.clear()
+    path = "/data/download/1"
+    query_string = {"protocol": "gs"}
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        )
+    }
+    with patch(
+        "fence.blueprints.data.get_or_create_primary_service_account_key",
+        wraps=get_or_create_primary_service_account_key,
+    ) as get_key:
+        for _ in range(3):
+            response = client.get(path, headers=headers, query_string=query_string)
+            assert response.status_code == 200
+            assert "url" in response.json.keys()
+
+    assert get_key.call_count == 1
+    assert google_signed_url.call_count == 3
+    url_signing_key_cache.clear()
+
+
+def test_url_signing_key_cache_ttl(monkeypatch):
+    """
+    Test that a cached key is dropped once it is older than the cache's ttl,
+    even though the key itself is still valid.
+    """
+    now = 1000000
+    monkeypatch.setattr("fence.resources.google.utils.time.time", lambda: now)
+    cache = UrlSigningKeyCache(ttl=60)
+    cache.set("1", "private-key", "key-id", now + 86400)
+    assert cache.get("1") == "private-key"
+
+    now += 61
+    assert cache.get("1") is None
+
+
+@pytest.mark.parametrize("indexd_client", ["gs", "gs_acl"], indirect=True)
+def test_indexd_download_file_signed_url_cache(
+    app,
+    client,
+    oauth_client,
+    user_client,
+    indexd_client,
+    kid,
+    rsa_private_key,
+    google_proxy_group,
+    primary_google_service_account,
+    cloud_manager,
+    google_signed_url,
+    monkeypatch,
+):
+    """
+    Test that with the signed url cache enabled, repeated
+    ``GET /data/download/1`` requests reuse the url while it is valid for
+    the requested ``expires_in``.
+    """
+    monkeypatch.setattr(app, "signed_url_cache", SignedUrlCache(), raising=False)
+    path = "/data/download/1"
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        )
+    }
+
+    first = client.get(
+        path, headers=headers, query_string={"protocol": "gs", "expires_in": 600}
+    )
+    second = client.get(
+        path, headers=headers, query_string={"protocol": "gs", "expires_in": 300}
+    )
+    assert first.status_code == 200
+    assert second.json["url"] == first.json["url"]
+    assert google_signed_url.call_count == 1
+
+    # the cached url doesn't cover a longer expiration, so sign again
+    third = client.get(
+        path, headers=headers, query_string={"protocol": "gs", "expires_in": 1200}
+    )
+    assert third.status_code == 200
+    assert google_signed_url.call_count == 2
+
+
+@pytest.mark.parametrize("indexd_client", ["gs"], indirect=True)
+def test_indexd_download_file_signed_url_cache_reuse_window(
+    app,
+    client,
+    oauth_client,
+    user_client,
+    indexd_client,
+    kid,
+    rsa_private_key,
+    google_proxy_group,
+    primary_google_service_account,
+    cloud_manager,
+    google_signed_url,
+    monkeypatch,
+):
+    """
+    Test that identical requests share a url for the cache's reuse window,
+    which is added to the expiration the url is signed for.
+    """
+    monkeypatch.setattr(
+        app, "signed_url_cache", SignedUrlCache(reuse_window=60), raising=False
+    )
+    now = {"value": int(time.time())}
+    monkeypatch.setattr("fence.blueprints.data.time.time", lambda: now["value"])
+    path = "/data/download/1"
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        )
+    }
+    query_string = {"protocol": "gs", "expires_in": 300}
+
+    first = client.get(path, headers=headers, query_string=query_string)
+    assert first.status_code == 200
+    assert google_signed_url.call_args[0][2] == now["value"] + 360
+
+    now["value"] += 1
+    assert client.get(path, headers=headers, query_string=query_string).json == (
+        first.json
+    )
+    now["value"] += 58
+    assert client.get(path, headers=headers, query_string=query_string).json == (
+        first.json
+    )
+    assert google_signed_url.call_count == 1
+
+    # past the reuse window the url doesn't cover the request anymore
+    now["value"] += 2
+    client.get(path, headers=headers, query_string=query_string)
+    assert google_signed_url.call_count == 2
+
+
 def test_indexd_download_file_no_jwt(client, auth_client):
     """
     Test ``GET /data/download/1``.
@@ -334,3 +514,339 @@ def test_public_bucket_unsupported_protocol_file(
     # response should not be JSON, should be HTML error page
     with pytest.raises(ValueError):
         response.json
+
+
+@pytest.mark.parametrize("indexd_client", ["s3", "s3_acl"], indirect=True)
+def test_sign_manifest(
+    client, oauth_client, user_client, indexd_client, kid, rsa_private_key
+):
+    """
+    Test ``POST /data/manifest`` with a JSON list of GUIDs.
+    """
+    path = "/data/manifest"
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        ),
+        "Content-Type": "application/json",
+    }
+    guids = ["1", "2", "3", "4", "5"]
+    response = client.post(
+        path,
+        headers=headers,
+        data=json.dumps(guids),
+        query_string={"protocol": "s3"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.data.splitlines() if line]
+    assert [result["guid"] for result in results] == guids
+    assert all("url" in result for result in results)
+
+
+@pytest.mark.parametrize("indexd_client", ["s3"], indirect=True)
+def test_sign_manifest_file_upload(
+    client, oauth_client, user_client, indexd_client, kid, rsa_private_key
+):
+    """
+    Test ``POST /data/manifest`` with an uploaded TSV manifest.
+    """
+    path = "/data/manifest"
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        )
+    }
+    manifest = "file_name\tguid\nfile1\t1\nfile2\t2\n"
+    response = client.post(
+        path,
+        headers=headers,
+        data={"file": (StringIO(manifest), "manifest.tsv")},
+        query_string={"protocol": "s3", "ordered": "false"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.data.splitlines() if line]
+    assert sorted(result["guid"] for result in results) == ["1", "2"]
+    assert all("url" in result for result in results)
+
+
+@pytest.mark.parametrize("indexd_client", ["s3"], indirect=True)
+def test_unauthorized_sign_manifest(
+    client, oauth_client, user_client, indexd_client, kid, rsa_private_key
+):
+    """
+    Test that ``POST /data/manifest`` reports files the user can't access
+    per GUID instead of failing the whole request.
+    """
+    path = "/data/manifest"
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.unauthorized_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        ),
+        "Content-Type": "application/json",
+    }
+    response = client.post(
+        path,
+        headers=headers,
+        data=json.dumps({"guids": ["1"]}),
+        query_string={"protocol": "s3"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.data.splitlines() if line]
+    assert results == [
+        {
+            "guid": "1",
+            "error": "You don't have access permission on this file",
+            "status": 401,
+        }
+    ]
+
+
+@pytest.mark.parametrize("indexd_client", ["s3"], indirect=True)
+def test_sign_manifest_s3_only_skips_google_key(
+    client, oauth_client, user_client, indexd_client, kid, rsa_private_key
+):
+    """
+    Test that without a ``protocol``, a manifest of S3 files is signed
+    without getting (or creating) the user's Google url signing key.
+    """
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        ),
+        "Content-Type": "application/json",
+    }
+    with patch(
+        "fence.blueprints.data.GoogleStorageIndexedFileLocation.get_url_signing_key"
+    ) as get_url_signing_key:
+        response = client.post(
+            "/data/manifest", headers=headers, data=json.dumps(["1", "2"])
+        )
+        results = [json.loads(line) for line in response.data.splitlines() if line]
+    assert response.status_code == 200
+    assert all("url" in result for result in results)
+    assert not get_url_signing_key.called
+
+
+@pytest.mark.parametrize("indexd_client", ["s3"], indirect=True)
+def test_sign_manifest_invalid_expires_in(
+    client, oauth_client, user_client, indexd_client, kid, rsa_private_key
+):
+    """
+    Test that a non-integer ``expires_in`` is rejected with a 400.
+    """
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_download_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        ),
+        "Content-Type": "application/json",
+    }
+    response = client.post(
+        "/data/manifest",
+        headers=headers,
+        data=json.dumps(["1"]),
+        query_string={"expires_in": "soon"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("indexd_client", ["s3", "s3_acl"], indirect=True)
+def test_multipart_upload(
+    client, oauth_client, user_client, indexd_client, kid, rsa_private_key
+):
+    """
+    Test initiating, presigning parts of and completing a multipart upload
+    through ``/data/upload/1/multipart``.
+    """
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_upload_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        ),
+        "Content-Type": "application/json",
+    }
+    boto_manager = "fence.resources.aws.boto_manager.BotoManager."
+    with patch(
+        boto_manager + "initiate_multipart_upload", return_value="upload-1"
+    ), patch(boto_manager + "complete_multipart_upload") as complete:
+        response = client.post("/data/upload/1/multipart", headers=headers)
+        assert response.status_code == 200
+        assert response.json["uploadId"] == "upload-1"
+
+        response = client.post(
+            "/data/upload/1/multipart/parts",
+            headers=headers,
+            data=json.dumps({"uploadId": "upload-1", "partNumbers": [2, 1]}),
+        )
+        assert response.status_code == 200
+        parts = response.json["parts"]
+        assert [part["partNumber"] for part in parts] == [2, 1]
+        for part in parts:
+            query = urlparse.parse_qs(urlparse.urlparse(part["url"]).query)
+            assert query["partNumber"] == [str(part["partNumber"])]
+            assert query["uploadId"] == ["upload-1"]
+
+        response = client.post(
+            "/data/upload/1/multipart/complete",
+            headers=headers,
+            data=json.dumps(
+                {
+                    "uploadId": "upload-1",
+                    "parts": [
+                        {"partNumber": 2, "etag": "etag-2"},
+                        {"partNumber": 1, "etag": "etag-1"},
+                    ],
+                }
+            ),
+        )
+        assert response.status_code == 200
+        assert complete.call_args[0][3] == [
+            {"PartNumber": 1, "ETag": "etag-1"},
+            {"PartNumber": 2, "ETag": "etag-2"},
+        ]
+
+
+@pytest.mark.parametrize("indexd_client", ["s3"], indirect=True)
+def test_multipart_upload_invalid_part_numbers(
+    client, oauth_client, user_client, indexd_client, kid, rsa_private_key
+):
+    """
+    Test that presigning parts outside of S3's part number range is rejected.
+    """
+    headers = {
+        "Authorization": "Bearer "
+        + jwt.encode(
+            utils.authorized_upload_context_claims(
+                user_client.username, user_client.user_id
+            ),
+            key=rsa_private_key,
+            headers={"kid": kid},
+            algorithm="RS256",
+        ),
+        "Content-Type": "application/json",
+    }
+    response = client.post(
+        "/data/upload/1/multipart/parts",
+        headers=headers,
+        data=json.dumps({"uploadId": "upload-1", "partNumbers": [0, 10001]}),
+    )
+    assert response.status_code == 400
+
+
+def test_rank_locations():
+    """
+    Test that replicas in the requested region come first, then replicas in
+    the same area, keeping the index order otherwise.
+    """
+
+    def location(name, region):
+        return MagicMock(name=name, get_region=MagicMock(return_value=region))
+
+    unknown = location("unknown", None)
+    us_east = location("us_east", "us-east-1")
+    eu_west = location("eu_west", "eu-west-1")
+    gs_us = location("gs_us", "us-central1")
+    us_west = location("us_west", "us-west-2")
+    locations = [unknown, us_east, eu_west, gs_us, us_west]
+
+    assert rank_locations(locations, "us-west-2") == [
+        us_west,
+        us_east,
+        gs_us,
+        unknown,
+        eu_west,
+    ]
+    assert rank_locations(locations, "EU-WEST-1")[0] is eu_west
+    assert rank_locations(locations, None) == locations
+
+
+@pytest.mark.parametrize(
+    "aws_region,google_region",
+    [
+        ("us-east-1", "us-central1"),
+        ("ca-central-1", "northamerica-northeast1"),
+        ("sa-east-1", "southamerica-east1"),
+        ("eu-west-1", "europe-west1"),
+        ("ap-southeast-1", "asia-southeast1"),
+        ("ap-southeast-2", "australia-southeast1"),
+    ],
+)
+def test_rank_locations_across_clouds(aws_region, google_region):
+    """
+    Test that a replica on one cloud counts as being in the same area as a
+    region of the other cloud on the same continent.
+    """
+
+    def location(name, region):
+        return MagicMock(name=name, get_region=MagicMock(return_value=region))
+
+    elsewhere = location("elsewhere", "af-south-1")
+    s3 = location("s3", aws_region)
+    gs = location("gs", google_region)
+
+    assert rank_locations([elsewhere, gs], aws_region) == [gs, elsewhere]
+    assert rank_locations([elsewhere, s3], google_region) == [s3, elsewhere]
+    assert rank_locations([gs, s3], aws_region) == [s3, gs]
+    assert rank_locations([s3, gs], google_region) == [gs, s3]
+
+
+def test_signed_url_location_tie_break():
+    """
+    Test that with a protocol, the last matching location is signed unless
+    another one is closer to the region, with or without a region.
+    """
+
+    def location(region):
+        return MagicMock(
+            protocol="s3",
+            get_region=MagicMock(return_value=region),
+            get_signed_url=MagicMock(return_value=region),
+        )
+
+    indexed_file = IndexedFile.__new__(IndexedFile)
+    indexed_file.file_id = "1"
+    indexed_file.public = False
+    indexed_file.indexed_file_locations = [location(None), location(None)]
+    for region in [None, "us-east-1"]:
+        indexed_file._get_signed_url("s3", "download", 60, region=region)
+        assert not indexed_file.indexed_file_locations[0].get_signed_url.called
+        assert indexed_file.indexed_file_locations[1].get_signed_url.called
+
+    indexed_file.indexed_file_locations = [location("us-east-1"), location(None)]
+    assert indexed_file._get_signed_url("s3", "download", 60, region="us-east-1") == (
+        "us-east-1"
+    )
@@ -0,0 +1,58 @@
+from mock import MagicMock
+import time
+
+from fence.permissions import PermissionIndex, TokenPermissionIndexCache
+
+
+def test_authorized_auth_ids_by_action():
+    index = PermissionIndex(
+        {
+            "phs000178": ["read", "read-storage"],
+            "phs000179": ["read-storage", "write-storage"],
+            "phs000180": [],
+        }
+    )
+    assert index.authorized_auth_ids("download") == {"phs000178", "phs000179"}
+    assert index.authorized_auth_ids("upload") == {"phs000179"}
+    assert index.authorized_auth_ids("delete") == frozenset()
+    assert index.has_project("phs000180")
+    assert not index.has_project("phs000181")
+
+
+def test_storage_access_from_user():
+    """
+    Test that storage access needs read-storage on some project and a
+    project stored in the requested provider.
+    """
+    storage_access = MagicMock()
+    storage_access.provider.name = "cleversafe"
+    project = MagicMock(storage_access=[storage_access])
+    user = MagicMock(
+        project_access={"phs000178": ["read-storage"]},
+        projects={"phs000178": project},
+    )
+
+    index = PermissionIndex.from_user(user)
+    assert index.can_access_storage("cleversafe")
+    assert not index.can_access_storage("google")
+
+    user.project_access = {"phs000178": ["read"]}
+    assert not PermissionIndex.from_user(user).can_access_storage("cleversafe")
+
+
+def test_token_permission_index_cache():
+    """
+    Test that an index is built once per token until the token expires.
+    """
+    cache = TokenPermissionIndexCache()
+    token = {
+        "jti": "token-1",
+        "exp": int(time.time()) + 600,
+        "context": {"user": {"projects": {"phs000178": ["read-storage"]}}},
+    }
+    index = cache.get(token)
+    assert cache.get(dict(token)) is index
+    assert index.authorized_auth_ids("download") == {"phs000178"}
+
+    expired = dict(token, jti="token-2", exp=int(time.time()) - 1)
+    assert cache.get(expired) is not cache.get(expired)